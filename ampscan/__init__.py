@@ -3,8 +3,11 @@
 Copyright: Joshua Steer 2020, Joshua.Steer@soton.ac.uk
 """
 
-from .core import AmpObject
+__version__ = '0.3.0'
+
+from .core import AmpObject, setDefaultDtype
 from .registration import registration
 from .align import align
+from .bulk import load_many, iload_many
 from . import analyse
 from . import vis
\ No newline at end of file
@@ -5,16 +5,19 @@ Copyright: Joshua Steer 2020, Joshua.Steer@soton.ac.uk
 """
 
 import numpy as np
-import copy
-import vtk
+import os
+import json
 import math
+import time
+import inspect
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from scipy import spatial
 from scipy.optimize import minimize
-from ampscan.core import AmpObject
-from ampscan.vis import vtkRenWin
+from ampscan.core import AmpObject, invertTForm
+from ampscan.cache import _jsonDefault
 
 # For doc examples
-import os
 staticfh = os.path.join(os.getcwd(), "tests", "stl_file.stl")
 movingfh = os.path.join(os.getcwd(), "tests", "stl_file_2.stl")
 
@@ -32,8 +35,21 @@ class align(object):
         will be aligned to
     method: str, default 'linPoint2Plane'
         A string of the method used for alignment
+    inverse: boolean, default False
+        If True, the static mesh is aligned to the moving mesh and the 
+        inverse of that transformation is used to align the moving mesh. 
+        The static mesh is not moved
     *args:
     	The arguments used for the alignment methods
+    cache: resultCache, default None
+        If not None, the transformation is loaded from the cache when the 
+        same meshes have been aligned with the same parameters and the same 
+        value of inverse, otherwise it is calculated and stored
+    apply: boolean, default True
+        If True, the moving AmpObject is cloned and the transformation is 
+        applied to the clone. Otherwise only the transformation is found, 
+        the moving AmpObject is neither copied nor changed and align.m is 
+        the moving AmpObject itself
     **kwargs:
     	The keyword arguments used for the alignment methods
 
@@ -43,6 +59,9 @@ class align(object):
         The aligned AmpObject, it same number of vertices and face array as 
         the moving AmpObject
         Access this using align.m
+    tForm: ndarray
+        The 4x4 transformation that aligns the moving AmpObject
+        Access this using align.tForm
 
     Examples
     --------
@@ -53,23 +72,297 @@ class align(object):
     """    
 
     def __init__(self, moving, static, method = 'linPoint2Plane', 
-                inverse=False, *args, **kwargs):
-        mData = dict(zip(['vert', 'faces', 'values'], 
-                         [moving.vert, moving.faces, moving.values]))
-        alData = copy.deepcopy(mData)
-        self.m = AmpObject(alData, stype='reg')
+                inverse=False, *args, cache=None, apply=True, **kwargs):
+        if apply is True:
+            self.m = moving.clone()
+            self.m.stype = 'reg'
+        else:
+            self.m = moving
         self.s = static
-        if inverse:
+        if cache is not None:
+            self.cachedICP(cache, method, *args, inverse=inverse, **kwargs)
+        elif inverse:
             self.inverse(method=method, *args, **kwargs)
         else:
             self.runICP(method=method, *args, **kwargs)
+        if apply is True:
+            self.m.matrixTransform(self.tForm)
+
+    def cachedICP(self, cache, method='linPoint2Plane', *args, 
+                  inverse=False, **kwargs):
+        r"""
+        Run the ICP algorithm through a resultCache, the result is keyed on 
+        the fingerprints of the meshes, inverse and all the parameters of 
+        runICP including the defaults
+        
+        Parameters
+        ----------
+        cache: resultCache
+            The cache to load the result from or store it within
+        method: str, default 'linPoint2Plane'
+            A string of the method used for alignment
+        *args:
+        	The arguments used for runICP
+        inverse: boolean, default False
+            If True, the alignment is found using inverse
+        **kwargs:
+        	The keyword arguments used for runICP
+        
+        """
+        params = inspect.signature(self.runICP).bind(method, *args, **kwargs)
+        params.apply_defaults()
+        params = params.arguments
+        # The number of threads does not change the result
+        params.pop('queryWorkers')
+        key = cache.key('align', self.m, self.s, inverse=inverse, **params)
+        result = cache.get(key)
+        if result is None:
+            if inverse:
+                self.inverse(method, *args, **kwargs)
+            else:
+                self.runICP(method, *args, **kwargs)
+            cache.put(key, R=self.R, T=self.T, tForm=self.tForm, 
+                      rmse=np.array(self.rmse), 
+                      converged=np.array(self.converged), 
+                      **{'history_' + k: v for k, v in self.history.items()})
+        else:
+            self.R = result['R']
+            self.T = result['T']
+            self.tForm = result['tForm']
+            self.rmse = float(result['rmse'])
+            self.converged = bool(result['converged'])
+            self.history = {k[8:]: v for k, v in result.items() 
+                            if k.startswith('history_')}
 
     
+    @classmethod
+    def batch(cls, movings, static, method='linPoint2Plane', *args, 
+              workers=None, apply=False, **kwargs):
+        r"""
+        Align many moving AmpObjects to one static AmpObject using a pool of 
+        threads. The spatial index and derived arrays of the static mesh are 
+        built once and shared read-only by all the alignments, the KD-tree 
+        queries and most of the linear algebra release the GIL so the 
+        alignments run in parallel. The moving meshes are not copied, each 
+        alignment transforms a copy of the vertex array only and keeps the 
+        transformation
+
+        Parameters
+        ----------
+        movings: list of AmpObject
+            The moving AmpObjects that are to be aligned to the static object
+        static: AmpObject
+            The static AmpObject that the moving objects will be aligned to
+        method: str, default 'linPoint2Plane'
+            A string of the method used for alignment
+        *args:
+        	The arguments used for the alignment methods
+        workers: int, default None
+            The number of threads, if None then the default of 
+            ThreadPoolExecutor is used. If 1, the alignments are run within 
+            the current thread
+        apply: boolean, default False
+            If True, each transformation is applied to its moving AmpObject. 
+            Otherwise the moving AmpObjects are not changed
+        **kwargs:
+        	The keyword arguments used for runICP and the alignment methods
+
+        Returns
+        -------
+        results: dict
+            The stacked R, T, tForm, rmse and converged of each alignment, in 
+            the same order as movings
+
+        Examples
+        --------
+        >>> static = AmpObject(staticfh)
+        >>> movings = [AmpObject(movingfh) for _ in range(3)]
+        >>> res = align.batch(movings, static, workers=2, maxiter=5)
+        >>> res['tForm'].shape, res['rmse'].shape
+        ((3, 4, 4), (3,))
+
+        """
+        movings = list(movings)
+        # Build the shared arrays before the threads start so they are only 
+        # read concurrently
+        static.applyTransform()
+        static.faceCent, static.norm, static.faceTree
+        if kwargs.get('exact') is True:
+            static.faceBVH
+        for moving in movings:
+            moving.applyTransform()
+        if workers != 1:
+            # The alignments are already run in parallel
+            kwargs.setdefault('queryWorkers', 1)
+        def run(moving):
+            al = cls(moving, static, method, False, *args, apply=False, 
+                     **kwargs)
+            return al.R, al.T, al.tForm, al.rmse, al.converged
+        if workers == 1:
+            out = [run(moving) for moving in movings]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                out = list(pool.map(run, movings))
+        keys = ['R', 'T', 'tForm', 'rmse', 'converged']
+        results = {k: np.array([o[i] for o in out]) 
+                   for i, k in enumerate(keys)}
+        if apply is True:
+            for moving, tForm in zip(movings, results['tForm']):
+                moving.matrixTransform(tForm)
+        return results
+
+    @classmethod
+    def pairwise(cls, amps, method='linPoint2Plane', *args, workers=None, 
+                 checkpoint=None, interval=60, **kwargs):
+        r"""
+        Align every AmpObject to every other AmpObject using a pool of 
+        threads, for example to find the medoid of a cohort of scans or the 
+        outliers within it. Only one alignment is run for each pair, the 
+        transformation of the reverse alignment is its inverse and the rmse 
+        of the reverse alignment is found from a single matching. The 
+        spatial index of each AmpObject is built once and shared by all of 
+        its pairings. Long runs can be resumed from a checkpoint
+
+        Parameters
+        ----------
+        amps: list of AmpObject
+            The AmpObjects to align
+        method: str, default 'linPoint2Plane'
+            A string of the method used for alignment
+        *args:
+        	The arguments used for the alignment methods
+        workers: int, default None
+            The number of threads, if None then the default of 
+            ThreadPoolExecutor is used. If 1, the alignments are run within 
+            the current thread
+        checkpoint: str, default None
+            The path of a .npz file the partial results are saved to, if it 
+            exists then the pairs already aligned within it are not repeated. 
+            A ValueError is raised if it was made from different AmpObjects 
+            or parameters
+        interval: float, default 60
+            The minimum time in seconds between saves of the checkpoint, it 
+            is always saved when the run finishes or fails
+        **kwargs:
+        	The keyword arguments used for runICP and the alignment methods
+
+        Returns
+        -------
+        results: dict
+            The NxN rmse and Nx4x4 tForm arrays, where tForm[i, j] aligns 
+            amps[i] to amps[j] and rmse[i, j] is the rmse of that alignment
+
+        Examples
+        --------
+        >>> amps = [AmpObject(staticfh), AmpObject(movingfh)]
+        >>> res = align.pairwise(amps, maxiter=5)
+        >>> res['rmse'].shape, res['tForm'].shape
+        ((2, 2), (2, 2, 4, 4))
+
+        """
+        amps = list(amps)
+        N = len(amps)
+        # The cache is passed to each alignment but is not a parameter of it
+        icpKwargs = {k: v for k, v in kwargs.items() if k != 'cache'}
+        params = inspect.signature(cls.runICP).bind(None, method, *args, 
+                                                    **icpKwargs)
+        params.apply_defaults()
+        params = params.arguments
+        params.pop('self')
+        params.pop('queryWorkers')
+        if workers != 1:
+            # The alignments are already run in parallel
+            kwargs.setdefault('queryWorkers', 1)
+        # Build the shared arrays before the threads start so they are only 
+        # read concurrently
+        for amp in amps:
+            amp.applyTransform()
+            amp.faceCent, amp.norm, amp.faceTree
+            if params['exact'] is True:
+                amp.faceBVH
+        meta = {'fingerprints': np.array([amp.fingerprint() for amp in amps]),
+                'params': np.array(json.dumps(params, sort_keys=True, 
+                                              default=_jsonDefault))}
+        rmse = np.zeros([N, N])
+        tForm = np.tile(np.eye(4), [N, N, 1, 1])
+        done = np.eye(N, dtype=bool)
+        if checkpoint is not None and os.path.exists(checkpoint):
+            with np.load(checkpoint, allow_pickle=False) as data:
+                for k, v in meta.items():
+                    if not np.array_equal(data[k], v):
+                        raise ValueError("The checkpoint {} was made with "
+                                         "different {}".format(checkpoint, k))
+                [rmse, tForm, done] = [data['rmse'], data['tForm'], 
+                                       data['done']]
+        trim = {k: params[k] for k in ['inlier', 'maxdist', 'madTol']}
+        def run(i, j):
+            al = cls(amps[i], amps[j], method, False, *args, apply=False, 
+                     **kwargs)
+            inv = invertTForm(al.tForm)
+            back = cls._tFormRmse(amps[j], amps[i], inv, params['exact'], 
+                                  trim)
+            return al.tForm, al.rmse, inv, back
+        def save():
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(
+                os.path.abspath(checkpoint)), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as fh:
+                np.savez(fh, rmse=rmse, tForm=tForm, done=done, **meta)
+            os.replace(tmp, checkpoint)
+        pairs = [(i, j) for i in range(N) for j in range(i+1, N) 
+                 if not done[i, j]]
+        pool = None
+        futures = {}
+        last = time.perf_counter()
+        try:
+            if workers == 1:
+                finished = (((i, j), run(i, j)) for i, j in pairs)
+            else:
+                pool = ThreadPoolExecutor(max_workers=workers)
+                futures = {pool.submit(run, i, j): (i, j) for i, j in pairs}
+                finished = ((futures[f], f.result()) 
+                            for f in as_completed(futures))
+            for (i, j), res in finished:
+                [tForm[i, j], rmse[i, j], tForm[j, i], rmse[j, i]] = res
+                done[i, j] = done[j, i] = True
+                if (checkpoint is not None and 
+                        time.perf_counter() - last >= interval):
+                    save()
+                    last = time.perf_counter()
+        finally:
+            for future in futures:
+                future.cancel()
+            if pool is not None:
+                pool.shutdown()
+            if checkpoint is not None and len(pairs):
+                save()
+        return {'rmse': rmse, 'tForm': tForm}
+
+    @classmethod
+    def _tFormRmse(cls, moving, static, tForm, exact=False, trim=None):
+        r"""
+        The rmse of the inliers of a moving AmpObject moved by tForm onto a 
+        static AmpObject, matched in the same way as runICP
+        """
+        points = np.dot(moving.vert, tForm[:3, :3].T) + tForm[3, :3]
+        if exact is True:
+            dist = static.closest_points(points)[3]
+        else:
+            dist = static.queryTree(points, 1, typ='faces')[0]
+        dist = dist[cls._inliers(dist, **(trim or {}))]
+        return math.sqrt(dist.mean())
+
     def runICP(self, method = 'linPoint2Plane', maxiter=20, inlier=1.0,
-               initTransform=None, *args, **kwargs):
+               initTransform=None, *args, exact=False, rmseTol=None, 
+               tformTol=None, levels=None, sampling='random', maxdist=None, 
+               madTol=None, queryWorkers=-1, **kwargs):
         r"""
         The function to run the ICP algorithm, this function calls one of 
-        multiple methods to calculate the affine transformation 
+        multiple methods to calculate the affine transformation. The 
+        iterations stop early once the change in rmse and the transformation 
+        increment are within the tolerances, the rmse, number of inliers, 
+        time and level of each iteration are stored in align.history. Only 
+        a copy of the moving vertices is transformed while iterating, the 
+        transformation is stored in align.tForm
         
         Parameters
         ----------
@@ -83,103 +376,367 @@ class align(object):
             discounted
         *args:
         	The arguments used for the alignment methods
+        exact: boolean, default False
+            If True, each vertex is matched to the exact closest point on the 
+            surface of the static mesh, see AmpObject.closest_points. 
+            Otherwise it is matched to the nearest face centroid
+        rmseTol: float, default None
+            Stop when the change in rmse over an iteration is less than 
+            rmseTol, if None the rmse is not checked
+        tformTol: float, default None
+            Stop when no element of the incremental transformation matrix of 
+            an iteration differs from the identity by more than tformTol, ie 
+            the rotation and translation increments are negligible. If None 
+            the transformation is not checked. If both tolerances are given 
+            then both must be met
+        levels: list of float, default None
+            The fraction of the vertices used by each coarse level of a 
+            multiresolution schedule, eg [0.01, 0.1]. Each coarse level 
+            aligns a sample of the moving vertices to a sample of the same 
+            fraction of the static face centroids, its transformation is the 
+            starting point of the next level. The final level always uses 
+            all the vertices. Each level runs up to maxiter iterations, so 
+            this is best combined with rmseTol or tformTol. Not used by 
+            contPoints or idxPoints
+        sampling: str, default 'random'
+            The method used to sample the coarse levels, either 'random', 
+            'voxel' or 'normal', see samplePoints
+        maxdist: float, default None
+            If not None, vertices further than maxdist from their match are 
+            discounted
+        madTol: float, default None
+            If not None, vertices further from their match than the median 
+            distance plus madTol times the scaled median absolute deviation 
+            of the distances are discounted. This is a robust rejection of 
+            outliers such as scanning artefacts, a madTol of 3 is typical
+        queryWorkers: int, default -1
+            The number of threads used by the KD-tree queries that match the 
+            vertices at full resolution, -1 uses all the cpus. This does not 
+            change the result
         **kwargs:
         	The keyword arguments used for the alignment methods
+
+        Examples
+        --------
+        >>> static = AmpObject(staticfh)
+        >>> moving = AmpObject(movingfh)
+        >>> al = align(moving, static, maxiter=50, rmseTol=1e-4)
+        >>> al.converged, len(al.history['rmse']) < 51
+        (True, True)
+        >>> al = align(moving, static, maxiter=50, rmseTol=1e-4, 
+        ...            levels=[0.05, 0.25], sampling='voxel')
+        >>> np.unique(al.history['level'])
+        array([0, 1, 2])
         
         """
         # Define the rotation, translation, error and quaterion arrays
         Rs = np.zeros([3, 3, maxiter+1])
         Ts = np.zeros([3, maxiter+1])
         err = np.zeros([maxiter+1])
+        nInlier = np.zeros([maxiter+1], dtype=int)
+        times = np.zeros([maxiter+1])
         if initTransform is None:
             initTransform = np.eye(4)
+        trim = {'inlier': inlier, 'maxdist': maxdist, 'madTol': madTol}
+        coarse = []
+        if levels is not None and method not in ('contPoints', 'idxPoints'):
+            for frac in levels:
+                initTransform, hist = self._coarseICP(frac, sampling, method, 
+                                                      maxiter, trim, 
+                                                      initTransform, rmseTol,
+                                                      tformTol, *args, 
+                                                      **kwargs)
+                coarse.append(hist)
+        tic = time.perf_counter()
         Rs[:, :, 0] = initTransform[:3, :3]
         Ts[:, 0] = initTransform[3, :3]
-        fC = self.s.vert[self.s.faces].mean(axis=1)
-        kdTree = spatial.cKDTree(fC)
-        self.m.rigidTransform(Rs[:, :, 0], Ts[:, 0])
-        inlier = math.ceil(self.m.vert.shape[0]*inlier)
-        [dist, idx] = kdTree.query(self.m.vert, 1)
-        # Sort by distance
-        sort = np.argsort(dist)
-        # Keep only those within the inlier fraction
-        [dist, idx] = [dist[sort], idx[sort]]
-        [dist, idx, sort] = dist[:inlier], idx[:inlier], sort[:inlier]
+        mv = self._move(self.m.vert.copy(), Rs[:, :, 0], Ts[:, 0])
+        [dist, idx, sv] = self._closest(mv, exact, queryWorkers)
+        # Keep only the inliers
+        sort = self._inliers(dist, **trim)
+        [dist, idx, sv] = [dist[sort], idx[sort], sv[sort]]
         err[0] = math.sqrt(dist.mean())
+        nInlier[0] = len(dist)
+        times[0] = time.perf_counter() - tic
+        self.converged = False
+        n = 0
         for i in range(maxiter):
-            if method == 'linPoint2Point':
-                [R, T] = getattr(self, method)(self.m.vert[sort, :],
-                                               fC[idx, :], 
-                                               *args, **kwargs)
-            elif method == 'linPoint2Plane': 
-                [R, T] = getattr(self, method)(self.m.vert[sort, :],
-                                               fC[idx, :], 
-                                               self.s.norm[idx, :],
-                                               *args, **kwargs)
-            elif method == 'optPoint2Point':
-                [R, T] = getattr(self, method)(self.m.vert[sort, :],
-                                               fC[idx, :],
-                                               *args, **kwargs)
-            elif method == 'contPoints':
+            tic = time.perf_counter()
+            if method in ('linPoint2Point', 'linPoint2Plane', 
+                          'optPoint2Point'):
+                [R, T] = self._solve(method, mv[sort, :], sv, 
+                                     self.s.norm[idx, :], *args, **kwargs)
+            elif method in ('contPoints', 'idxPoints'):
+                # The transformation is found directly from the points
                 [R, T] = getattr(self, method)(*args, **kwargs)
-                self.m.rigidTransform(R, T)
-                [dist, idx] = kdTree.query(self.m.vert, 1)
-                sort = np.argsort(dist)
-                [dist, idx] = [dist[sort], idx[sort]]
-                [dist, idx, sort] = dist[:inlier], idx[:inlier], sort[:inlier]
-                self.tForm = np.r_[np.c_[R, np.zeros(3)], np.append(T, 1)[:, None].T]
-                self.R = R
-                self.T = T
-                self.rmse = math.sqrt(dist.mean())
-                return
-            elif method == 'idxPoints':
-                [R, T] = getattr(self, 'idxPoints')(*args, **kwargs)
-                self.m.rigidTransform(R, T)
-                [dist, idx] = kdTree.query(self.m.vert, 1)
-                sort = np.argsort(dist)
-                [dist, idx] = [dist[sort], idx[sort]]
-                [dist, idx, sort] = dist[:inlier], idx[:inlier], sort[:inlier]
+                self._move(mv, R, T)
+                dist = self._closest(mv, exact, queryWorkers)[0]
+                dist = dist[self._inliers(dist, **trim)]
                 self.tForm = np.r_[np.c_[R, np.zeros(3)], np.append(T, 1)[:, None].T]
                 self.R = R
                 self.T = T
                 self.rmse = math.sqrt(dist.mean())
+                err[1], nInlier[1] = self.rmse, len(dist)
+                times[1] = time.perf_counter() - tic
+                self.converged = True
+                self._setHistory(err, nInlier, times, 1, coarse)
                 return
             else: KeyError('Not a supported alignment method')
             Rs[:, :, i+1] = np.dot(R, Rs[:, :, i])
             Ts[:, i+1] = np.dot(R, Ts[:, i]) + T
-            self.m.rigidTransform(R, T)
-            [dist, idx] = kdTree.query(self.m.vert, 1)
-            sort = np.argsort(dist)
-            [dist, idx] = [dist[sort], idx[sort]]
-            [dist, idx, sort] = dist[:inlier], idx[:inlier], sort[:inlier]
+            self._move(mv, R, T)
+            [dist, idx, sv] = self._closest(mv, exact, queryWorkers)
+            sort = self._inliers(dist, **trim)
+            [dist, idx, sv] = [dist[sort], idx[sort], sv[sort]]
             err[i+1] = math.sqrt(dist.mean())
+            nInlier[i+1] = len(dist)
+            times[i+1] = time.perf_counter() - tic
+            n = i + 1
 #            qs[:, i+1] = np.r_[self.rot2quat(R), T]
-        R = Rs[:, :, -1]
+            if self._isConverged(R, T, err[i] - err[i+1], rmseTol, tformTol):
+                self.converged = True
+                break
+        R = Rs[:, :, n]
         #Simpl
         [U, s, V] = np.linalg.svd(R)
         R = np.dot(U, V)
-        self.tForm = np.r_[np.c_[R, np.zeros(3)], np.append(Ts[:, -1], 1)[:, None].T]
+        self.tForm = np.r_[np.c_[R, np.zeros(3)], np.append(Ts[:, n], 1)[:, None].T]
         self.R = R
-        self.T = Ts[:, -1]
-        self.rmse = err[-1]  
+        self.T = Ts[:, n]
+        self.rmse = err[n]
+        self._setHistory(err, nInlier, times, n, coarse)
+
+    @staticmethod
+    def _move(mv, R, T):
+        r"""
+        Rotate then translate the moving vertices in place, they keep the 
+        dtype of the moving mesh
+        """
+        mv[:] = np.dot(mv, R.T)
+        mv += T
+        return mv
+
+    def _coarseICP(self, frac, sampling, method, maxiter, trim, 
+                   initTransform, rmseTol=None, tformTol=None, *args, 
+                   **kwargs):
+        r"""
+        Run one coarse level of a multiresolution ICP on a sample of the 
+        moving vertices and static face centroids, see runICP. The sampled 
+        vertices are moved locally so the moving mesh is not transformed
+
+        Returns
+        -------
+        tForm: ndarray
+            The transformation found by the level, including initTransform
+        history: dict
+            The rmse, number of inliers and time of each iteration
+
+        """
+        tic = time.perf_counter()
+        mNorm = self.m.vNorm if sampling == 'normal' else None
+        mInd = samplePoints(self.m.vert, math.ceil(frac*len(self.m.vert)), 
+                            sampling, mNorm)
+        sInd = samplePoints(self.s.faceCent, 
+                            math.ceil(frac*len(self.s.faceCent)), sampling, 
+                            self.s.norm)
+        mv = self.m.vert[mInd].astype(np.float64)
+        [sv, sn] = [self.s.faceCent[sInd], self.s.norm[sInd]]
+        tree = spatial.cKDTree(sv)
+        [R, T] = [initTransform[:3, :3], initTransform[3, :3]]
+        def match(R, T):
+            points = np.dot(mv, R.T) + T
+            [dist, idx] = tree.query(points)
+            keep = self._inliers(dist, **trim)
+            return points[keep], idx[keep], dist[keep]
+        [points, idx, dist] = match(R, T)
+        err = [math.sqrt(dist.mean())]
+        nInlier = [len(dist)]
+        times = [time.perf_counter() - tic]
+        for i in range(maxiter):
+            tic = time.perf_counter()
+            [dR, dT] = self._solve(method, points, sv[idx], sn[idx], 
+                                   *args, **kwargs)
+            [R, T] = [np.dot(dR, R), np.dot(dR, T) + dT]
+            [points, idx, dist] = match(R, T)
+            err.append(math.sqrt(dist.mean()))
+            nInlier.append(len(dist))
+            times.append(time.perf_counter() - tic)
+            if self._isConverged(dR, dT, err[-2] - err[-1], rmseTol, 
+                                 tformTol):
+                break
+        tForm = np.eye(4)
+        tForm[:3, :3] = R
+        tForm[3, :3] = T
+        history = {'rmse': np.array(err), 
+                   'inliers': np.array(nInlier), 
+                   'time': np.array(times)}
+        return tForm, history
+
+    def _solve(self, method, mv, sv, sn, *args, **kwargs):
+        r"""
+        Find the transformation of one ICP iteration from the matched 
+        moving vertices, static points and static normals using one of the 
+        iterative alignment methods
+        """
+        if method == 'linPoint2Plane':
+            return getattr(self, method)(mv, sv, sn, *args, **kwargs)
+        return getattr(self, method)(mv, sv, *args, **kwargs)
+
+    @staticmethod
+    def _inliers(dist, inlier=1.0, maxdist=None, madTol=None):
+        r"""
+        Select the inlier matches of an ICP iteration in linear time, see 
+        runICP. Matches are first rejected by distance and by the median 
+        absolute deviation, then the closest proportion inlier of all the 
+        matches are kept from those remaining
+
+        Parameters
+        ----------
+        dist: ndarray
+            The distance of each match
+        inlier: float, default 1.0
+            The proportion of matches to keep
+        maxdist: float, default None
+            The maximum distance of a match
+        madTol: float, default None
+            The number of scaled median absolute deviations above the median 
+            distance beyond which matches are rejected
+
+        Returns
+        -------
+        keep: slice or ndarray
+            The matches to keep, these are not ordered by distance. If all 
+            the matches are kept this is a slice so no arrays are copied
+
+        Examples
+        --------
+        >>> dist = np.array([0.5, 0.1, 9.0, 0.3, 0.2])
+        >>> align._inliers(dist)
+        slice(None, None, None)
+        >>> np.sort(align._inliers(dist, inlier=0.6))
+        array([1, 3, 4])
+        >>> align._inliers(dist, madTol=3)
+        array([0, 1, 3, 4])
+
+        """
+        n = len(dist)
+        k = min(math.ceil(n*inlier), n)
+        if maxdist is None and madTol is None:
+            if k == n:
+                return slice(None)
+            return np.argpartition(dist, k-1)[:k]
+        mask = np.ones(n, dtype=bool)
+        if maxdist is not None:
+            mask &= dist <= maxdist
+        if madTol is not None:
+            # The upper medians are found by a single partition each
+            h = n // 2
+            med = np.partition(dist, h)[h]
+            mad = np.partition(np.abs(dist - med), h)[h]
+            # Scale the deviation to match the standard deviation of a normal
+            mask &= dist <= med + madTol * 1.4826 * mad
+        keep = np.flatnonzero(mask)
+        if len(keep) == 0:
+            raise ValueError("No inliers remain after rejecting the matches, "
+                             "increase maxdist or madTol")
+        if k < len(keep):
+            keep = keep[np.argpartition(dist[keep], k-1)[:k]]
+        return keep
+
+    def _setHistory(self, err, nInlier, times, n, coarse=()):
+        r"""
+        Store the rmse, number of inliers and time of the initial matching 
+        and the n iterations that were run as align.history, after those of 
+        any coarse levels
+        """
+        levels = list(coarse) + [{'rmse': err[:n+1], 
+                                  'inliers': nInlier[:n+1], 
+                                  'time': times[:n+1]}]
+        self.history = {k: np.concatenate([h[k] for h in levels]) 
+                        for k in ('rmse', 'inliers', 'time')}
+        self.history['level'] = np.concatenate(
+            [np.full(len(h['rmse']), i) for i, h in enumerate(levels)])
+
+    @staticmethod
+    def _isConverged(R, T, dErr, rmseTol=None, tformTol=None):
+        r"""
+        Test if an ICP iteration has converged, see runICP
+
+        Parameters
+        ----------
+        R: ndarray
+            The rotation increment of the iteration
+        T: ndarray
+            The translation increment of the iteration
+        dErr: float
+            The change in rmse over the iteration
+        rmseTol: float, default None
+            The tolerance on the change in rmse
+        tformTol: float, default None
+            The tolerance on the transformation increment
+
+        Returns
+        -------
+        converged: boolean
+            True if all the given tolerances are met, False if neither 
+            tolerance is given
+
+        """
+        if rmseTol is None and tformTol is None:
+            return False
+        if rmseTol is not None and abs(dErr) >= rmseTol:
+            return False
+        if tformTol is not None:
+            step = max(np.abs(R - np.eye(3)).max(), np.abs(T).max())
+            if step > tformTol:
+                return False
+        return True
+
+    def _closest(self, mv, exact=False, workers=1):
+        r"""
+        Find the point on the static mesh matched to each vertex of the 
+        moving mesh
+
+        Parameters
+        ----------
+        mv: ndarray
+            The transformed vertices of the moving mesh
+        exact: boolean, default False
+            If True, use the exact closest point on the surface, otherwise 
+            use the nearest face centroid
+        workers: int, default 1
+            The number of threads used by the KD-tree query
+
+        Returns
+        -------
+        dist: ndarray
+            The distance to the matched point
+        idx: ndarray
+            The index of the face of the matched point
+        points: ndarray
+            The matched point
+
+        """
+        if exact is True:
+            idx, _, points, dist = self.s.closest_points(mv)
+        else:
+            [dist, idx] = self.s.queryTree(mv, 1, typ='faces', 
+                                           workers=workers)
+            points = self.s.faceCent[idx]
+        return dist, idx, points
             
     def inverse(self, method = 'linPoint2Plane', *args, **kwargs):
-        #inverting the objects
-        self.temp = self.s
-        self.s = self.m
-        self.m = self.temp
-        self.runICP(method=method, *args, **kwargs)
-        #resetting the objects
-        self.temp = self.s
-        self.s = self.m
-        self.m = self.temp
-        del self.temp
-        #inverting the transformation on both objects
-        self.R = self.R.transpose()
-        self.T = -self.T
-        self.tForm = np.r_[np.c_[self.R, np.zeros(3)], np.append(self.T, 1)[:, None].T]
-        self.s.rigidTransform(self.R, self.T)
-        self.m.rigidTransform(self.R, self.T)
+        #inverting the objects, neither mesh is moved by runICP
+        [self.m, self.s] = [self.s, self.m]
+        try:
+            self.runICP(method=method, *args, **kwargs)
+        finally:
+            #resetting the objects
+            [self.m, self.s] = [self.s, self.m]
+        #inverting the transformation
+        self.tForm = invertTForm(self.tForm)
+        self.R = self.tForm[:3, :3]
+        self.T = self.tForm[3, :3]
     
     @staticmethod
     def linPoint2Plane(mv, sv, sn):
@@ -223,6 +780,8 @@ class align(object):
         >>> al = align(moving, static, method='linPoint2Plane').m
         
         """
+        # Solve the least squares in double precision
+        [mv, sv, sn] = [np.asarray(a, dtype=np.float64) for a in [mv, sv, sn]]
         cn = np.c_[np.cross(mv, sn), sn]
         C = np.dot(cn.T, cn)
         v = sv - mv
@@ -544,6 +1103,8 @@ class align(object):
         window 
         
         """
+        import vtk
+        from ampscan.vis import vtkRenWin
         if not hasattr(self.s, 'actor'):
             self.s.addActor()
         if not hasattr(self.m, 'actor'):
@@ -578,6 +1139,7 @@ class align(object):
         window 
         
         """
+        from ampscan.vis import vtkRenWin
         if not hasattr(self.s, 'actor'):
             self.s.addActor()
         if not hasattr(self.m, 'actor'):
@@ -613,3 +1175,80 @@ class align(object):
             im = im[:, mask, :]
         return im, win
 
+
+def samplePoints(points, n, method='random', norms=None, seed=0):
+    r"""
+    Sample a subset of points, used to create the coarse levels of a 
+    multiresolution alignment. The points are grouped into buckets and 
+    drawn from each bucket in turn, so the sample is spread evenly across 
+    the buckets
+
+    Parameters
+    ----------
+    points: ndarray
+        The points to sample
+    n: int
+        The number of points in the sample
+    method: str, default 'random'
+        'random' draws the points uniformly at random, 'voxel' buckets the 
+        points by a grid of voxels sized to give about n occupied voxels, so 
+        the sample is spread evenly over the surface, and 'normal' buckets 
+        the points by the direction of their normals, so surfaces of every 
+        orientation are sampled which constrains the alignment [1]
+    norms: ndarray, default None
+        The normal of each point, required if method is 'normal'
+    seed: int, default 0
+        The seed of the random draws, so the sample is repeatable
+
+    Returns
+    -------
+    ind: ndarray
+        The indicies of the sampled points
+
+    References
+    ----------
+    .. [1] Rusinkiewicz, Szymon; Marc Levoy (2001). "Efficient Variants of 
+       the ICP Algorithm". Proceedings of the Third International Conference 
+       on 3-D Digital Imaging and Modeling: 145-152
+
+    Examples
+    --------
+    >>> static = AmpObject(staticfh)
+    >>> samplePoints(static.vert, 100, 'voxel').shape
+    (100,)
+
+    """
+    points = np.asarray(points)
+    n = min(n, len(points))
+    if method == 'random':
+        key = np.zeros(len(points), dtype=np.int64)
+    elif method == 'voxel':
+        lo = points.min(axis=0)
+        ext = points.max(axis=0) - lo
+        size = max(ext.max(), 1e-12) / math.sqrt(n)
+        # A surface occupies a number of voxels inversely proportional to 
+        # the square of their size
+        for _ in range(4):
+            dims = np.floor(ext / size).astype(np.int64) + 1
+            q = np.floor((points - lo) / size).astype(np.int64)
+            key = (q[:, 0] * dims[1] + q[:, 1]) * dims[2] + q[:, 2]
+            size *= math.sqrt(len(np.unique(key)) / n)
+    elif method == 'normal':
+        if norms is None:
+            raise ValueError("Normals are required for normal space sampling")
+        # Bucket the normals by a 6x6x6 grid over the unit cube
+        q = np.floor((np.nan_to_num(norms) + 1) * 3).clip(0, 5).astype(np.int64)
+        key = q.dot([36, 6, 1])
+    else:
+        raise ValueError("Expected method to be 'random', 'voxel' or 'normal' "
+                         "but found: {}".format(method))
+    rng = np.random.RandomState(seed)
+    perm = rng.permutation(len(points))
+    key = key[perm]
+    # The rank of each point within its bucket, points are then taken from 
+    # each bucket in turn
+    order = np.argsort(key, kind='stable')
+    start = np.searchsorted(key[order], key[order])
+    rank = np.empty(len(key), dtype=np.int64)
+    rank[order] = np.arange(len(key)) - start
+    return perm[np.argsort(rank, kind='stable')[:n]]
@@ -1,5 +1,19 @@
 from .analyse import (calc_volume_closed, create_slices, calc_perimeter, calc_widths, calc_csa, est_volume, 
                       visualise_slices, plot_slices, MeasurementsOut, CMapOut)
-from .output import getPDF, generateRegBinsCsv, generateRegCsv
 
-del analyse, output
\ No newline at end of file
+del analyse
+
+# The report functions need reportlab and PyPDF2 so are only imported when
+# they are first accessed
+_lazy = ('getPDF', 'generateRegBinsCsv', 'generateRegCsv')
+
+
+def __getattr__(name):
+    if name in _lazy:
+        from . import output
+        return getattr(output, name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_lazy))
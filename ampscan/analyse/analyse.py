@@ -7,12 +7,7 @@ Copyright: Joshua Steer 2020, Joshua.Steer@soton.ac.uk
 
 import numpy as np
 from ampscan.core import AmpObject
-import matplotlib.pyplot as plt
-import matplotlib.colors as clr
-import matplotlib.colorbar as clb
-from mpl_toolkits.mplot3d import Axes3D
 from collections import defaultdict
-from .output import getPDF
 from math import floor
 #from .cython_ext import planeEdgeIntersect_cy, logEuPath_cy
 import os
@@ -40,12 +35,7 @@ def calc_volume_closed(amp_in, return_closed=False):
     amp: AmpObject
         If return_closed is True, then the closed shape is returned 
     """
-    amp = AmpObject({
-        'vert': amp_in.vert.copy(),
-        'faces': amp_in.faces.copy(),
-        'values': amp_in.values.copy(),
-    })
-    amp.calcStruct()
+    amp = amp_in.clone()
     # Fill in the holes
     while (amp.faceEdges == -99999).sum() != 0: 
         # Find the edges which are only conected to one face
@@ -61,8 +51,7 @@ def calc_volume_closed(amp_in, return_closed=False):
         # Add in each face using adjacent vertices in loop
         for f1, f2 in zip(vInd, np.roll(vInd, 1)):
             amp.faces = np.r_[amp.faces, [[f1, f0, f2]]]
-        # Update structure and check if any more holes (algorithm keeps going until all holes filled)
-        amp.calcStruct()
+        # Setting the faces updates the structure, check if any more holes (algorithm keeps going until all holes filled)
     # Calculate the area of each face in the array using vector cross product
     v01 = amp.vert[amp.faces[:, 1], :] - amp.vert[amp.faces[:, 0], :]
     v02 = amp.vert[amp.faces[:, 2], :] - amp.vert[amp.faces[:, 0], :]
@@ -70,10 +59,12 @@ def calc_volume_closed(amp_in, return_closed=False):
     area = 0.5 * np.sqrt(cp.sum(axis=1))
     # Get surface volume contributions 
     sVC = area * amp.vert[amp.faces, 2].mean(axis=1) * amp.norm[:, 2]
+    # Accumulate in double precision for single precision meshes
+    vol = sVC.sum(dtype=np.float64)
     if return_closed is True:
-        return sVC.sum(), amp
+        return vol, amp
     else:
-        return sVC.sum()
+        return vol
 
 
 
@@ -395,6 +386,8 @@ def visualise_slices(amp):
     r"""
     Create an mpl figure with the 3D rendering, slices, slice height and cross sectional area
     """
+    import matplotlib.pyplot as plt
+    from mpl_toolkits.mplot3d import Axes3D
     fig = plt.figure()
     fig.set_size_inches(8, 8)
     ax = plt.axes(projection="3d")
@@ -437,6 +430,8 @@ def plot_slices(amp, axis=2, slWidth=10):
         A tuple of axes used for each subplot in the figure
 
     """
+    import matplotlib.pyplot as plt
+    from mpl_toolkits.mplot3d import Axes3D
     # Find the brim edges 
     ind = np.where(amp.faceEdges[:,1] == -99999)[0]
     # Define max Z from lowest point on brim
@@ -502,6 +497,8 @@ def MeasurementsOut(amp, pos):
     -------
     The path to the output file
     """
+    import matplotlib.pyplot as plt
+    from .output import getPDF
     # print(pos)
     maxZ = []
     for i in [0,1,2]:
@@ -558,6 +555,9 @@ def CMapOut(amp, colors):
     """
     Colour Map with 4 views (copied Josh's code)
     """
+    import matplotlib.pyplot as plt
+    import matplotlib.colors as clr
+    import matplotlib.colorbar as clb
     titles = ['Anterior', 'Medial', 'Proximal', 'Lateral']
     fig,axes = plt.subplots(ncols=5)
     cmap = clr.ListedColormap(colors, name='Amp')
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Package for loading many AmpObjects in parallel
+Copyright: Joshua Steer 2020, Joshua.Steer@soton.ac.uk
+"""
+
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from ampscan.core import AmpObject, getDefaultDtype
+
+# For doc examples
+stlfhs = [os.path.join(os.getcwd(), "tests", fh) for fh in
+          ["stl_file.stl", "stl_file_2.stl", "stl_file_4.stl"]]
+
+
+def load_many(paths, workers=None, unify=True, struc=True, stype='limb',
+              dtype=None):
+    r"""
+    Load many files into AmpObjects using a pool of processes. Each file is
+    read, unified and structured within a worker process, the arrays are
+    passed back as an uncompressed .amp file in shared memory which is
+    memory-mapped by the parent process, so the meshes are not pickled or
+    copied again. A file that fails to load does not stop the rest
+
+    Parameters
+    ----------
+    paths: list of str
+        The file paths to load, any file type supported by AmpObject
+    workers: int, default None
+        The number of worker processes, if None then the number of cpus is
+        used. If 1, the files are loaded within the current process
+    unify: boolean, default True
+        unify the coincident vertices of each face
+    struc: boolean, default True
+        Calculate the underlying structure of the mesh, such as edges
+    stype: str, default 'limb'
+        descriptor of the type of data the AmpObjects are representing
+    dtype: data-type, default None
+        The floating point type of the AmpObjects, if None the default set 
+        by setDefaultDtype is used
+
+    Returns
+    -------
+    amps: list
+        The AmpObject for each path, in the same order as paths, this is
+        None for any file that failed to load
+    errors: dict
+        The exception raised for each file that failed to load, keyed by 
+        the position of its path in paths so repeated paths are each 
+        reported
+
+    Examples
+    --------
+    >>> amps, errors = load_many(stlfhs, workers=2)
+    >>> [amp.vert.shape for amp in amps]
+    [(7530, 3), (7630, 3), (482, 3)]
+
+    """
+    paths = list(paths)
+    amps = [None] * len(paths)
+    errors = {}
+    # Results are placed by position so repeated paths are each filled
+    for i, _, amp, err in _iload(paths, workers, unify, struc, stype, dtype):
+        if err is None:
+            amps[i] = amp
+        else:
+            errors[i] = err
+    return amps, errors
+
+
+def iload_many(paths, workers=None, unify=True, struc=True, stype='limb',
+               dtype=None):
+    r"""
+    Lazily load many files into AmpObjects using a pool of processes, see
+    load_many. The AmpObjects are yielded in the order that they finish
+    loading
+
+    Parameters
+    ----------
+    paths: list of str
+        The file paths to load, any file type supported by AmpObject
+    workers: int, default None
+        The number of worker processes, if None then the number of cpus is
+        used. If 1, the files are loaded within the current process
+    unify: boolean, default True
+        unify the coincident vertices of each face
+    struc: boolean, default True
+        Calculate the underlying structure of the mesh, such as edges
+    stype: str, default 'limb'
+        descriptor of the type of data the AmpObjects are representing
+    dtype: data-type, default None
+        The floating point type of the AmpObjects, if None the default set 
+        by setDefaultDtype is used
+
+    Yields
+    ------
+    path: str
+        The file path
+    amp: AmpObject
+        The loaded AmpObject, or None if the file failed to load
+    err: Exception
+        The exception raised when loading the file, or None
+
+    """
+    for _, path, amp, err in _iload(paths, workers, unify, struc, stype,
+                                    dtype):
+        yield path, amp, err
+
+
+def _iload(paths, workers, unify, struc, stype, dtype):
+    r"""
+    Load many files, see iload_many, yielding the position of each path in 
+    paths along with the results
+    """
+    paths = list(paths)
+    if dtype is None:
+        dtype = getDefaultDtype()
+    if workers == 1:
+        for i, path in enumerate(paths):
+            try:
+                yield i, path, AmpObject(path, stype, unify, struc,
+                                         dtype=dtype), None
+            except Exception as err:
+                yield i, path, None, err
+        return
+    # Use memory backed storage for the transfer where available
+    shm = '/dev/shm' if os.access('/dev/shm', os.W_OK) else None
+    tmp = tempfile.mkdtemp(prefix='ampscan_', dir=shm)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(_loadWorker, path,
+                                   os.path.join(tmp, '%d.amp' % i),
+                                   unify, struc, stype, dtype): (i, path)
+                       for i, path in enumerate(paths)}
+            for future in as_completed(futures):
+                i, path = futures[future]
+                try:
+                    fh = future.result()
+                    amp = AmpObject(stype=stype, dtype=dtype)
+                    amp.load_amp(fh, mmap=True)
+                except Exception as err:
+                    yield i, path, None, err
+                    continue
+                try:
+                    # The mapping remains valid once the file is removed
+                    os.remove(fh)
+                except OSError:
+                    pass
+                yield i, path, amp, None
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _loadWorker(path, out, unify, struc, stype, dtype):
+    r"""
+    Load a file within a worker process and save it as a .amp file
+
+    Parameters
+    ----------
+    path: str
+        The file path to load
+    out: str
+        The file path of the .amp file to write
+    unify: boolean
+        unify the coincident vertices of each face
+    struc: boolean
+        Calculate the underlying structure of the mesh, such as edges
+    stype: str
+        descriptor of the type of data the AmpObject is representing
+    dtype: data-type
+        The floating point type of the AmpObject
+
+    Returns
+    -------
+    out: str
+        The file path of the .amp file
+
+    """
+    amp = AmpObject(path, stype, unify, struc, dtype=dtype)
+    amp.save_amp(out, struc=struc)
+    return out
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+Package for exact closest point queries on the surface of a mesh using a
+bounding volume hierarchy of the triangles
+Copyright: Joshua Steer 2020, Joshua.Steer@soton.ac.uk
+"""
+
+import numpy as np
+from scipy import spatial
+
+
+class triBVH(object):
+    r"""
+    An axis-aligned bounding volume hierarchy over the triangles of a mesh.
+    The triangles are sorted along a Morton curve through their centroids
+    and grouped into leaves, the boxes of the leaves are then merged in
+    pairs up to the root. Queries are vectorised over batches of points, each
+    level of the tree is traversed for all the points at once and any boxes
+    further away than an upper bound on the distance to the closest point
+    are pruned. The bound starts at the distance to the nearest vertex and
+    is lowered at each level to the distance to a triangle within the
+    nearest box, so long thin triangles far from their vertices are pruned
+
+    Parameters
+    ----------
+    vert: ndarray
+        The vertices of the mesh
+    faces: ndarray
+        The vertex indicies of each triangle
+    leafSize: int, default 4
+        The number of triangles in each leaf of the tree
+
+    Examples
+    --------
+    >>> vert = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0]])
+    >>> bvh = triBVH(vert, np.array([[0, 1, 2]]))
+    >>> face, bary, point, dist = bvh.query(np.array([[0.25, 0.25, 1.0]]))
+    >>> face, bary, dist
+    (array([0]), array([[0.5 , 0.25, 0.25]]), array([1.]))
+
+    """
+
+    def __init__(self, vert, faces, leafSize=4):
+        from ampscan.core import mortonCode
+        vert = np.asarray(vert, dtype=np.float64)
+        faces = np.asarray(faces)
+        self.leafSize = leafSize
+        self.tri = vert[faces]
+        # Only the vertices on the surface give a bound on the distance
+        self.vertTree = spatial.cKDTree(vert[np.unique(faces)])
+        nF = len(faces)
+        # Sort the triangles along a Morton curve so each leaf is compact
+        order = np.argsort(mortonCode(self.tri.mean(axis=1)), kind='stable')
+        nLeaves = max(int(np.ceil(nF / leafSize)), 1)
+        self.depth = int(np.ceil(np.log2(nLeaves)))
+        nSlots = 2**self.depth * leafSize
+        # The triangles in each leaf, padded with -1
+        leafTri = np.full(nSlots, -1, dtype=np.int64)
+        leafTri[:nF] = order
+        self.leafTri = leafTri.reshape(-1, leafSize)
+        valid = self.leafTri >= 0
+        tri = self.tri[np.where(valid, self.leafTri, 0)]
+        lo = np.where(valid[..., None], tri.min(axis=2), np.inf).min(axis=1)
+        hi = np.where(valid[..., None], tri.max(axis=2), -np.inf).max(axis=1)
+        # Merge the boxes in pairs up to the root
+        self.lo = [lo]
+        self.hi = [hi]
+        for _ in range(self.depth):
+            self.lo.insert(0, np.minimum(self.lo[0][0::2], self.lo[0][1::2]))
+            self.hi.insert(0, np.maximum(self.hi[0][0::2], self.hi[0][1::2]))
+
+    def query(self, points, chunk=4096):
+        r"""
+        Find the closest point on the surface of the mesh to each point
+
+        Parameters
+        ----------
+        points: array_like
+            The points to query
+        chunk: int, default 4096
+            The number of points traversed at once, this bounds the memory
+            used by the query
+
+        Returns
+        -------
+        face: ndarray
+            The index of the closest triangle
+        bary: ndarray
+            The barycentric co-ordinates of the closest point on the triangle
+        point: ndarray
+            The closest point
+        dist: ndarray
+            The distance to the closest point
+
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        n = len(points)
+        face = np.empty(n, dtype=np.int64)
+        bary = np.empty([n, 3])
+        point = np.empty([n, 3])
+        dist2 = np.empty(n)
+        for st in range(0, n, chunk):
+            sl = slice(st, st + chunk)
+            face[sl], bary[sl], point[sl], dist2[sl] = self._query(points[sl])
+        return face, bary, point, np.sqrt(dist2)
+
+    def _query(self, p):
+        r"""
+        Query a chunk of points, see query
+        """
+        n = len(p)
+        # Allow for rounding so the bound never excludes the nearest vertex
+        ub = self.vertTree.query(p)[0]**2 * (1 + 1e-9)
+        # Traverse the tree, pruning boxes further away than the bound
+        pInd = np.arange(n)
+        node = np.zeros(n, dtype=np.int64)
+        for level in range(1, self.depth + 1):
+            pInd = np.repeat(pInd, 2)
+            node = (2*np.repeat(node, 2)) + np.tile([0, 1], len(node))
+            d = boxDist2(p[pInd], self.lo[level][node], self.hi[level][node])
+            keep = d <= ub[pInd]
+            pInd, node, d = pInd[keep], node[keep], d[keep]
+            # Lower the bound to a triangle in the nearest box of each point
+            self._tighten(p, pInd, node, d, ub, level)
+            keep = d <= ub[pInd]
+            pInd, node = pInd[keep], node[keep]
+        return self._leafSearch(p, pInd, node, n)
+
+    def _tighten(self, p, pInd, node, d, ub, level):
+        r"""
+        Lower the bound of each point in place to the distance to the first
+        triangle in its nearest box, pInd must be sorted
+        """
+        if len(pInd) == 0:
+            return
+        st = np.flatnonzero(np.r_[True, pInd[1:] != pInd[:-1]])
+        dMin = np.minimum.reduceat(d, st)
+        near = np.flatnonzero(d == np.repeat(dMin, np.diff(np.r_[st, len(d)])))
+        near = near[np.r_[True, pInd[near][1:] != pInd[near][:-1]]]
+        pInd = pInd[near]
+        # The first triangle of the first leaf below the node
+        tri = self.tri[self.leafTri[node[near] << (self.depth - level), 0]]
+        _, q = closestPointTriangle(p[pInd], tri[:, 0], tri[:, 1], tri[:, 2])
+        dist2 = ((p[pInd] - q)**2).sum(axis=1) * (1 + 1e-9)
+        ub[pInd] = np.minimum(ub[pInd], dist2)
+
+    def _leafSearch(self, p, pInd, leaf, n, block=4096):
+        r"""
+        Find the closest triangle within the leaves paired with each point,
+        the pairs are searched in blocks to bound the memory used
+        """
+        face = np.full(n, -1, dtype=np.int64)
+        baryOut = np.full([n, 3], np.nan)
+        point = np.full([n, 3], np.nan)
+        dist2 = np.full(n, np.inf)
+        for st in range(0, len(pInd), block):
+            tInd = self.leafTri[leaf[st:st + block]].reshape(-1)
+            bInd = np.repeat(pInd[st:st + block], self.leafSize)
+            keep = tInd >= 0
+            tInd, bInd = tInd[keep], bInd[keep]
+            tri = self.tri[tInd]
+            bary, q = closestPointTriangle(p[bInd], tri[:, 0], tri[:, 1],
+                                           tri[:, 2])
+            d = ((p[bInd] - q)**2).sum(axis=1)
+            # The closest candidate for each point in the block
+            order = np.lexsort((d, bInd))
+            first = order[np.r_[True, bInd[order][1:] != bInd[order][:-1]]]
+            first = first[d[first] < dist2[bInd[first]]]
+            face[bInd[first]] = tInd[first]
+            baryOut[bInd[first]] = bary[first]
+            point[bInd[first]] = q[first]
+            dist2[bInd[first]] = d[first]
+        return face, baryOut, point, dist2
+
+
+def boxDist2(p, lo, hi):
+    r"""
+    The squared distance from points to axis-aligned boxes, this is zero
+    for points inside the box
+
+    Parameters
+    ----------
+    p: ndarray
+        The points
+    lo: ndarray
+        The minimum corner of each box
+    hi: ndarray
+        The maximum corner of each box
+
+    Returns
+    -------
+    dist2: ndarray
+        The squared distance
+
+    """
+    with np.errstate(invalid='ignore'):
+        d = np.maximum(np.maximum(lo - p, p - hi), 0)
+    d[np.isnan(d)] = np.inf
+    return (d**2).sum(axis=-1)
+
+
+def closestPointTriangle(p, a, b, c):
+    r"""
+    The closest point on each triangle to each point, using the Voronoi
+    regions of the vertices, edges and face of the triangle. Degenerate
+    triangles with collinear vertices are treated as the segment of their
+    longest edge
+
+    Parameters
+    ----------
+    p: ndarray
+        The points
+    a, b, c: ndarray
+        The vertices of each triangle
+
+    Returns
+    -------
+    bary: ndarray
+        The barycentric co-ordinates of the closest point, the weights of
+        a, b and c
+    q: ndarray
+        The closest point
+
+    References
+    ----------
+    .. [1] Ericson, Christer (2004). "Real-Time Collision Detection". Morgan
+       Kaufmann: 136-142
+
+    Examples
+    --------
+    >>> a, b, c = np.eye(3)[None, :, :].transpose(1, 0, 2)
+    >>> bary, q = closestPointTriangle(np.array([[2.0, 0, 0]]), a, b, c)
+    >>> bary
+    array([[1., 0., 0.]])
+
+    """
+    ab = b - a
+    ac = c - a
+    ap = p - a
+    bp = p - b
+    cp = p - c
+    d1 = np.einsum('ij, ij->i', ab, ap)
+    d2 = np.einsum('ij, ij->i', ac, ap)
+    d3 = np.einsum('ij, ij->i', ab, bp)
+    d4 = np.einsum('ij, ij->i', ac, bp)
+    d5 = np.einsum('ij, ij->i', ab, cp)
+    d6 = np.einsum('ij, ij->i', ac, cp)
+    va = d3*d6 - d5*d4
+    vb = d5*d2 - d1*d6
+    vc = d1*d4 - d3*d2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Within the face
+        denom = va + vb + vc
+        v = vb / denom
+        w = vc / denom
+        bary = np.stack([1 - v - w, v, w], axis=1)
+        # On edge bc
+        inBC = (va <= 0) & (d4 - d3 >= 0) & (d5 - d6 >= 0)
+        w = (d4 - d3) / ((d4 - d3) + (d5 - d6))
+        bary[inBC] = np.stack([np.zeros_like(w), 1 - w, w], axis=1)[inBC]
+        # On edge ac
+        inAC = (vb <= 0) & (d2 >= 0) & (d6 <= 0)
+        w = d2 / (d2 - d6)
+        bary[inAC] = np.stack([1 - w, np.zeros_like(w), w], axis=1)[inAC]
+        # At vertex c
+        inC = (d6 >= 0) & (d5 <= d6)
+        bary[inC] = [0, 0, 1]
+        # On edge ab
+        inAB = (vc <= 0) & (d1 >= 0) & (d3 <= 0)
+        v = d1 / (d1 - d3)
+        bary[inAB] = np.stack([1 - v, v, np.zeros_like(v)], axis=1)[inAB]
+        # At vertex b
+        inB = (d3 >= 0) & (d4 <= d3)
+        bary[inB] = [0, 1, 0]
+        # At vertex a
+        inA = (d1 <= 0) & (d2 <= 0)
+        bary[inA] = [1, 0, 0]
+    # The denominator is the squared norm of the normal of the triangle, so
+    # is zero if the vertices are collinear. The triangle is then the
+    # segment of its longest edge
+    scale = np.einsum('ij, ij->i', ab, ab) + np.einsum('ij, ij->i', ac, ac)
+    deg = np.flatnonzero((denom <= 1e-20 * scale**2) |
+                         ~np.isfinite(bary).all(axis=1))
+    if len(deg):
+        vert = np.stack([a[deg], b[deg], c[deg]], axis=1)
+        edge = np.roll(vert, -1, axis=1) - vert
+        len2 = (edge**2).sum(axis=2)
+        k = np.argmax(len2, axis=1)
+        r = np.arange(len(deg))
+        e, l2 = edge[r, k], len2[r, k]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            t = np.einsum('ij, ij->i', p[deg] - vert[r, k], e) / l2
+        # Coincident vertices are a single point
+        t = np.where(l2 > 0, np.clip(t, 0, 1), 0)
+        w = np.zeros([len(deg), 3])
+        w[r, k] = 1 - t
+        w[r, (k + 1) % 3] += t
+        bary[deg] = w
+    q = bary[:, 0, None]*a + bary[:, 1, None]*b + bary[:, 2, None]*c
+    return bary, q
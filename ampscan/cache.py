@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Package for caching the results of expensive operations on AmpObjects
+Copyright: Joshua Steer 2020, Joshua.Steer@soton.ac.uk
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+from ampscan import __version__
+
+# The file path used in doc examples
+filename = os.path.join(os.getcwd(), "tests", "stl_file.stl")
+
+
+class resultCache(object):
+    r"""
+    A persistent on-disk cache for the results of alignments and
+    registrations. Each result is stored as a compressed .npz file named by a
+    key made from the library version, the fingerprints of the meshes and
+    the full set of parameters, so results are invalidated when any of these
+    change. When the total size of the cache exceeds maxsize, the least
+    recently used results are removed
+
+    Parameters
+    ----------
+    directory: str
+        The directory the results are stored within, this is created if it
+        does not exist
+    maxsize: int, default 2**30
+        The maximum total size of the cache in bytes
+
+    Examples
+    --------
+    >>> import tempfile
+    >>> from ampscan.core import AmpObject
+    >>> amp = AmpObject(filename)
+    >>> cache = resultCache(tempfile.mkdtemp())
+    >>> key = cache.key('volume', amp, axis=2)
+    >>> cache.get(key) is None
+    True
+    >>> cache.put(key, vol=np.array(1.0))
+    >>> float(cache.get(key)['vol'])
+    1.0
+
+    """
+
+    def __init__(self, directory, maxsize=2**30):
+        self.directory = directory
+        self.maxsize = maxsize
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, kind, *amps, **params):
+        r"""
+        Create the key for a result
+
+        Parameters
+        ----------
+        kind: str
+            The name of the operation, eg 'align' or 'registration'
+        *amps: AmpObject
+            The AmpObjects the operation is performed upon
+        **params:
+            The parameters of the operation, these must be json serialisable
+            or numpy arrays, otherwise a TypeError is raised
+
+        Returns
+        -------
+        key: str
+            The hexadecimal key of the result
+
+        """
+        data = {'version': __version__, 'kind': kind,
+                'meshes': [amp.fingerprint() for amp in amps],
+                'params': params}
+        data = json.dumps(data, sort_keys=True, default=_jsonDefault)
+        return hashlib.blake2b(data.encode(), digest_size=20).hexdigest()
+
+    def get(self, key):
+        r"""
+        Get a result from the cache, this marks the result as recently used
+
+        Parameters
+        ----------
+        key: str
+            The key of the result, see key
+
+        Returns
+        -------
+        result: dict or None
+            The arrays that were stored for the result, or None if the
+            result is not in the cache
+
+        """
+        fh = self._path(key)
+        try:
+            with np.load(fh, allow_pickle=False) as data:
+                result = {k: data[k] for k in data.files}
+        except (OSError, ValueError):
+            # Missing, partly evicted or corrupt results are recalculated
+            return None
+        try:
+            os.utime(fh)
+        except OSError:
+            pass
+        return result
+
+    def put(self, key, **arrays):
+        r"""
+        Store a result in the cache, then evict the least recently used
+        results if the cache is larger than maxsize
+
+        Parameters
+        ----------
+        key: str
+            The key of the result, see key
+        **arrays: ndarray
+            The arrays of the result
+
+        """
+        # Write to a temporary file first so readers never see a partial file
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                np.savez_compressed(fh, **arrays)
+            os.replace(tmp, self._path(key))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.evict()
+
+    def evict(self, maxsize=None):
+        r"""
+        Remove the least recently used results until the cache is no larger
+        than maxsize
+
+        Parameters
+        ----------
+        maxsize: int, default None
+            The maximum total size in bytes, if None then the maxsize of the
+            cache is used
+
+        """
+        if maxsize is None:
+            maxsize = self.maxsize
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npz'):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(e[1] for e in entries)
+        for _, size, fh in sorted(entries):
+            if total <= maxsize:
+                break
+            try:
+                os.remove(fh)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        r"""
+        Remove all the results from the cache
+        """
+        self.evict(0)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+
+def _jsonDefault(obj):
+    r"""
+    Convert numpy arrays and scalars within the parameters for json. Other
+    objects are rejected as their repr may not be the same for equal objects
+    or may hide a difference between them
+    """
+    if isinstance(obj, np.ndarray):
+        return {'dtype': obj.dtype.str, 'data': obj.tolist()}
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError("Expected parameters that are json serialisable or numpy "
+                    "arrays but found: {}".format(type(obj).__name__))
@@ -8,14 +8,134 @@ Copyright: Joshua Steer 2020, Joshua.Steer@soton.ac.uk
 import numpy as np
 import os
 import struct
+import io
+import json
+import zipfile
+import hashlib
+from scipy import sparse, spatial
+from scipy.sparse import csgraph
 from ampscan.trim import trimMixin
 from ampscan.smooth import smoothMixin
 from ampscan.vis import visMixin
+from ampscan.weld import weldVert
+from ampscan.bvh import triBVH
 
 
 # The file path used in doc examples
 filename = os.path.join(os.getcwd(), "tests", "stl_file.stl")
 
+# Defined no of bytes for header and no of faces in a binary .stl file 
+HEADER_SIZE = 80
+COUNT_SIZE = 4
+# State the data type and length in bytes of the normals and vertices
+STL_DTYPE = np.dtype([('normals', np.float32, (3, )),
+                      ('vertices', np.float32, (9, )),
+                      ('atttr', '<i2', (1, ))])
+# Version of the .amp container layout
+AMP_VERSION = 1
+# The default floating point type of the vertices and values, if None the 
+# type of the input data is kept, see setDefaultDtype
+_defaultDtype = None
+
+
+def setDefaultDtype(dtype=None):
+    r"""
+    Set the floating point type used for the vertices, values and the 
+    arrays derived from them for AmpObjects created afterwards, eg 
+    np.float32 to halve the memory use of large batches. This can be 
+    overridden for each AmpObject using the dtype argument
+    
+    Parameters
+    ----------
+    dtype: data-type, default None
+        The floating point type, if None the type of the input data is kept
+
+    Examples
+    --------
+    >>> setDefaultDtype(np.float32)
+    >>> AmpObject({'vert': np.zeros([3, 3]), 'faces': [[0, 1, 2]]}).vert.dtype
+    dtype('float32')
+    >>> setDefaultDtype(None)
+
+    """
+    global _defaultDtype
+    _defaultDtype = checkDtype(dtype)
+
+
+def getDefaultDtype():
+    r"""
+    Get the default floating point type set by setDefaultDtype
+
+    Returns
+    -------
+    dtype: numpy dtype or None
+        The floating point type, or None if the type of the input data is 
+        kept
+
+    """
+    return _defaultDtype
+
+
+def checkDtype(dtype):
+    r"""
+    Check that a data-type is a floating point type
+
+    Parameters
+    ----------
+    dtype: data-type or None
+        The data-type to check
+
+    Returns
+    -------
+    dtype: numpy dtype or None
+        The data-type as a numpy dtype
+
+    """
+    if dtype is None:
+        return None
+    dtype = np.dtype(dtype)
+    if dtype.kind != 'f':
+        raise TypeError("Expected a floating point dtype but found: {}".format(dtype))
+    return dtype
+
+
+def derived(name, calc, **kwargs):
+    r"""
+    Create a property for an array derived from the vertices or faces of 
+    the AmpObject. The array is calculated using the calc method when it is 
+    first accessed and cached until it is invalidated
+    
+    Parameters
+    ----------
+    name: str
+        The name of the array 
+    calc: str
+        The name of the method which calculates the array
+    **kwargs:
+        The keyword arguments passed to the calc method
+    
+    Returns
+    -------
+    prop: property
+        The cached property 
+
+    """
+    def fget(self):
+        if self._pending is not None and name in self._poseCache:
+            self.applyTransform()
+        if name not in self._cache:
+            getattr(self, calc)(**kwargs)
+        return self._cache[name]
+    
+    def fset(self, value):
+        self._cache[name] = value
+    
+    def fdel(self):
+        self._cache.pop(name, None)
+    
+    return property(fget, fset, fdel, 
+                    "Derived array calculated by {}, see {}".format(calc, calc))
+
 
 class AmpObject(trimMixin, smoothMixin, visMixin):
     r"""
@@ -33,6 +153,14 @@ class AmpObject(trimMixin, smoothMixin, visMixin):
     stype : str, optional
         descriptor of the type of data the AmpObject is representing, e.g 
         'limb' or 'socket'. Default is 'limb'
+    deferTransform : boolean, optional
+        If True, rigid transformations are accumulated and only applied to 
+        the vertices when they are next read, see applyTransform. Default 
+        is False
+    dtype : data-type, optional
+        The floating point type of the vertices, values and the arrays 
+        derived from them. Default is None, which uses the type set by 
+        setDefaultDtype or else keeps the type of the input data
     
     Returns
     -------
@@ -45,22 +173,288 @@ class AmpObject(trimMixin, smoothMixin, visMixin):
 
     """
 
-    def __init__(self, data=None, stype='limb', unify=True, struc=True):
+    # Cached arrays that are invalidated when the vertices are changed
+    _geometryCache = ('norm', 'vNorm', 'cotanLap', 'faceCent', 'vertTree', 
+                      'faceTree', 'faceBVH', 'vNormAngle', 'edgeNorm', 
+                      'vertHash', 'valuesHash', 'fingerprint')
+    # Cached arrays that are invalidated when the faces are changed
+    _topologyCache = ('edges', 'edgesFace', 'faceEdges', 'brimEdges', 
+                      'valence', 'vertAdj', 'vertFaceAdj', 'uniformLap', 
+                      'facesHash')
+    # Cached hashes that are invalidated when the values are changed
+    _valuesCache = ('valuesHash', 'fingerprint')
+    # Cached arrays that are moved with the vertices by rigid transformations
+    _poseCache = ('norm', 'vNorm', 'faceCent', 'vNormAngle', 'edgeNorm')
+    
+    # Rigid transformations that are yet to be applied to the vertices and
+    # the total transformation applied since the vertices were set
+    _pending = None
+    _pose = None
+    deferTransform = False
+    dtype = None
+    # The original index of each vertex and face, set by reorder
+    vertPerm = None
+    facePerm = None
+    # The weighting of the vertex normals, set by calcVNorm
+    _vNormWeight = 'uniform'
+
+    norm = derived('norm', 'calcNorm')
+    vNorm = derived('vNorm', 'calcVNorm')
+    faceCent = derived('faceCent', 'calcFaceCent')
+    vertTree = derived('vertTree', 'calcTree', typ='vert')
+    faceTree = derived('faceTree', 'calcTree', typ='faces')
+    faceBVH = derived('faceBVH', 'calcBVH')
+    vNormAngle = derived('vNormAngle', 'calcPseudoNorm')
+    edgeNorm = derived('edgeNorm', 'calcPseudoNorm')
+    edges = derived('edges', 'calcTopology')
+    edgesFace = derived('edgesFace', 'calcTopology')
+    faceEdges = derived('faceEdges', 'calcTopology')
+    brimEdges = derived('brimEdges', 'calcTopology')
+    valence = derived('valence', 'calcTopology')
+    vertAdj = derived('vertAdj', 'calcAdjacency')
+    vertFaceAdj = derived('vertFaceAdj', 'calcAdjacency')
+    uniformLap = derived('uniformLap', 'calcLaplacian', typ='uniform')
+    cotanLap = derived('cotanLap', 'calcLaplacian', typ='cotan')
+
+    def __init__(self, data=None, stype='limb', unify=True, struc=True,
+                 mmap=False, deferTransform=False, dtype=None):
+        self._cache = {}
+        self._treeFrame = {}
         self.stype = stype
-        self.createCMap()
+        self.deferTransform = deferTransform
+        dtype = checkDtype(dtype)
+        self.dtype = _defaultDtype if dtype is None else dtype
         if isinstance(data, str):
-            self.read_stl(data, unify, struc)
+            if data.lower().endswith('.amp'):
+                self.load_amp(data, mmap)
+            else:
+                self.read_stl(data, unify, struc, mmap)
         elif isinstance(data, dict):
+            # Set the vertices and faces first as these invalidate the 
+            # derived arrays
+            for k in ['faces', 'vert']:
+                if k in data:
+                    setattr(self, k, data[k])
             for k, v in data.items():
-                setattr(self, k, v)
-            self.calcStruct()
+                if k not in ['faces', 'vert']:
+                    setattr(self, k, v)
         elif isinstance(data, bytes):
             self.read_bytes(data, unify, struc)
 
+    @property
+    def vert(self):
+        r"""
+        The vertices of the mesh, setting this invalidates the cached arrays 
+        derived from the geometry and resets the transform_matrix
+        """
+        if self._pending is not None:
+            self.applyTransform()
+        return self._vert
+    
+    @vert.setter
+    def vert(self, vert):
+        if self.dtype is not None:
+            vert = np.asarray(vert, dtype=self.dtype)
+        self._vert = vert
+        self._pending = None
+        self._pose = None
+        self.invalidate('geometry')
+    
+    @property
+    def values(self):
+        r"""
+        The values at each vertex, eg the shape deviation from a 
+        registration 
+        """
+        return self._values
+
+    @values.setter
+    def values(self, values):
+        if self.dtype is not None:
+            values = np.asarray(values, dtype=self.dtype)
+        self._values = values
+        for name in self._valuesCache:
+            self._cache.pop(name, None)
+
+    def floatType(self):
+        r"""
+        The floating point type of the arrays derived from the vertices, 
+        this is the type of the vertices if they are floating point, 
+        otherwise float64
+
+        Returns
+        -------
+        dtype: numpy dtype
+            The floating point type
+
+        """
+        dtype = np.asarray(self.vert).dtype
+        return dtype if dtype.kind == 'f' else np.dtype(np.float64)
+
+    @property
+    def faces(self):
+        r"""
+        The vertex indicies of each face, setting this invalidates all the 
+        cached derived arrays 
+        """
+        return self._faces
     
+    @faces.setter
+    def faces(self, faces):
+        self._faces = faces
+        self.invalidate('topology')
+
+    def invalidate(self, level='topology'):
+        r"""
+        Clear the cached arrays derived from the mesh so they are 
+        recalculated when next accessed. This is called automatically when 
+        the vert or faces arrays are set, it must be called if they or the 
+        values are edited in place 
+        
+        Parameters
+        ----------
+        level: str, default 'topology'
+            If 'geometry', only the arrays that depend upon the vertex 
+            positions or values, such as the normals and the fingerprint, 
+            are cleared. If 'topology', all the derived arrays are cleared
+        
+        Examples
+        --------
+        >>> amp = AmpObject(filename)
+        >>> amp.vert[:, 2] *= 2
+        >>> amp.invalidate('geometry')
 
+        """
+        if level == 'geometry':
+            names = self._geometryCache
+        elif level == 'topology':
+            names = self._geometryCache + self._topologyCache
+        else:
+            raise ValueError("Expected level to be 'geometry' or 'topology' "
+                             "but found: {}".format(level))
+        for name in names:
+            self._cache.pop(name, None)
+
+    def isStale(self, *names):
+        r"""
+        Test if any of the derived arrays need to be recalculated 
+        
+        Parameters
+        ----------
+        *names: str
+            The names of the derived arrays, eg 'norm' or 'edges'
+        
+        Returns
+        -------
+        stale: boolean
+            True if any of the arrays are not cached 
 
-    def read_stl(self, filename, unify=True, struc=True):
+        """
+        return any(name not in self._cache for name in names)
+
+    def fingerprint(self):
+        r"""
+        A hash of the vertices, faces and values of the AmpObject which can 
+        be used to tell if two meshes are the same, eg as a key to cache 
+        results. The hash of each array is cached and cleared with the 
+        derived arrays, so only the arrays that have changed are rehashed. 
+        The fingerprint is saved in .amp files and restored by load_amp. 
+        Call invalidate after editing the vertices, faces or values in place
+
+        Returns
+        -------
+        fingerprint: str
+            The hexadecimal hash of the mesh
+
+        Examples
+        --------
+        >>> amp = AmpObject(filename)
+        >>> amp.fingerprint() == amp.clone().fingerprint()
+        True
+        >>> fp = amp.fingerprint()
+        >>> amp.translate([0, 0, 1])
+        >>> amp.fingerprint() == fp
+        False
+
+        """
+        if not self.isStale('fingerprint'):
+            return self._cache['fingerprint']
+        if self.isStale('vertHash'):
+            self._cache['vertHash'] = arrayHash(self.vert)
+        if self.isStale('facesHash'):
+            self._cache['facesHash'] = arrayHash(self.faces)
+        h = hashlib.blake2b(digest_size=16)
+        h.update(self._cache['vertHash'].encode())
+        h.update(self._cache['facesHash'].encode())
+        if hasattr(self, 'values'):
+            if self.isStale('valuesHash'):
+                self._cache['valuesHash'] = arrayHash(self.values)
+            h.update(self._cache['valuesHash'].encode())
+        self._cache['fingerprint'] = h.hexdigest()
+        return self._cache['fingerprint']
+
+    def clone(self, share_topology=True):
+        r"""
+        Create a copy of the AmpObject. The vertices and values are copied so
+        they can be edited independently, while the faces and the cached
+        derived arrays are shared. This avoids copying and recalculating the 
+        structure when many objects are derived from one mesh. The clone 
+        holds read-only views of the shared arrays, so it cannot edit them 
+        in place and must set new arrays instead, eg by setting the faces. 
+        The source is not changed, but arrays it edits in place are seen by 
+        the clone. The actor is not copied and the clone starts with an 
+        identity transform_matrix
+
+        Parameters
+        ----------
+        share_topology: boolean, default True
+            If True, the faces and cached arrays are shared with the source,
+            if False they are copied
+
+        Returns
+        -------
+        amp: AmpObject
+            The cloned AmpObject
+
+        Examples
+        --------
+        >>> amp = AmpObject(filename)
+        >>> reg = amp.clone()
+        >>> reg.vert[:, 2] += 1.0
+        >>> np.shares_memory(reg.edges, amp.edges)
+        True
+        >>> reg.edges.flags.writeable, amp.edges.flags.writeable
+        (False, True)
+
+        """
+        self.applyTransform()
+        amp = type(self).__new__(type(self))
+        for k, v in self.__dict__.items():
+            if k in ['actor', '_cache', '_pending', '_pose']:
+                continue
+            if k == '_faces' and share_topology is True:
+                if isinstance(v, np.ndarray):
+                    v = readOnly(v)
+            elif isinstance(v, np.ndarray):
+                v = v.copy()
+            elif k == '_treeFrame':
+                v = dict(v)
+            amp.__dict__[k] = v
+        amp._cache = {}
+        for k, v in self._cache.items():
+            if isinstance(v, str) or not hasattr(v, 'copy'):
+                # Strings and the spatial indexes are never edited in place
+                pass
+            elif share_topology is not True:
+                v = v.copy()
+            elif isinstance(v, np.ndarray):
+                v = readOnly(v)
+            amp._cache[k] = v
+        return amp
+
+    
+
+    def read_stl(self, filename, unify=True, struc=True, mmap=False):
         """
         Function to read .stl file from filename and import data into 
         the AmpObj 
@@ -73,44 +467,53 @@ class AmpObject(trimMixin, smoothMixin, visMixin):
             unify the coincident vertices of each face
         struc: boolean, default True
             Calculate the underlying structure of the mesh, such as edges
+        mmap: boolean, default False
+            If True, the file is memory-mapped and the vertices are built 
+            directly from the mapped records, this avoids holding 
+            temporary copies of the whole file in memory for large scans
+
+        Examples
+        --------
+        >>> amp = AmpObject(filename, mmap=True)
+        >>> amp.vert.shape
+        (7530, 3)
 
         """
+        size = os.path.getsize(filename)
         with open(filename, 'rb') as fh:
-        # Defined no of bytes for header and no of faces
-            HEADER_SIZE = 80
-            COUNT_SIZE = 4
-            # State the data type and length in bytes of the normals and vertices
-            data_type = np.dtype([('normals', np.float32, (3, )),
-                                  ('vertices', np.float32, (9, )),
-                                  ('atttr', '<i2', (1, ))])
             # Read the header of the STL
             head = fh.read(HEADER_SIZE).lower()
             # Read the number of faces
             NFaces, = struct.unpack('@i', fh.read(COUNT_SIZE))
-            # Read the remaining data and save as void, then close file
-            data = np.fromfile(fh, data_type)
-        # Test if the file is ascii
-        if str(head[:5], 'utf-8') == 'solid':
-            raise ValueError("ASCII files not supported")
-        # Write the data to a numpy arrays in AmpObj
-        tfcond = NFaces==data['vertices'].shape[0]			#assigns true or false to tfcond
-        if not tfcond:							#if tfcond is false, raise error
-            raise ValueError("File is corrupt")							#if true, move on
-        vert = np.resize(np.array(data['vertices']), (NFaces*3, 3))
-        norm = np.array(data['normals'])
-        faces = np.reshape(range(NFaces*3), [NFaces,3])
-        self.faces = faces
-        self.vert = vert
-        self.norm = norm
-        
-        # Call function to unify vertices of the array
-        if unify is True:
-            self.unifyVert()
-        # Call function to calculate the edges array
-#        self.fixNorm()
-        if struc is True:
-            self.calcStruct()
-        self.values = np.zeros([len(self.vert)])
+            # Test if the file is ascii
+            if isASCII(head, NFaces, size):
+                fh.seek(0)
+                vert, norm = readASCII(fh)
+                self._setSTLData(vert, norm, unify, struc)
+                return
+            if mmap is False:
+                # Read the remaining data and save as void, then close file
+                data = np.fromfile(fh, STL_DTYPE)
+        if mmap is True:
+            # Number of complete records in the file 
+            nRec = (size - HEADER_SIZE - COUNT_SIZE) // STL_DTYPE.itemsize
+            if NFaces != nRec:
+                raise ValueError("File is corrupt")
+            if NFaces == 0:
+                # An empty range cannot be mapped, the empty mesh is 
+                # reported by _setSTLData as in the other modes
+                data = np.empty(0, STL_DTYPE)
+            else:
+                # Map the records in read only mode, nothing is read until 
+                # the arrays are accessed
+                data = np.memmap(filename, STL_DTYPE, mode='r', 
+                                 offset=HEADER_SIZE+COUNT_SIZE, 
+                                 shape=(NFaces,))
+        vert, norm = unpackBinary(data, NFaces)
+        # vert and norm are copies, so dropping the last reference to the 
+        # map closes the file before the mesh is processed
+        del data
+        self._setSTLData(vert, norm, unify, struc)
 
     def read_bytes(self, data, unify=True, struc=True):
         """
@@ -127,32 +530,45 @@ class AmpObject(trimMixin, smoothMixin, visMixin):
             Calculate the underlying structure of the mesh, such as edges
 
         """
-        # Defined no of bytes for header and no of faces
-        HEADER_SIZE = 80
-        COUNT_SIZE = 4
-        # State the data type and length in bytes of the normals and vertices
-        data_type = np.dtype([('normals', np.float32, (3, )),
-                                ('vertices', np.float32, (9, )),
-                                ('atttr', '<i2', (1, ))])
         # Read the header of the STL
         head = data[:HEADER_SIZE].lower()
         # Read the number of faces
         NFaces, = struct.unpack('@i', data[HEADER_SIZE:HEADER_SIZE+COUNT_SIZE])
-        # Read the remaining data and save as void, then close file
-        data = np.frombuffer(data[COUNT_SIZE+HEADER_SIZE:], data_type)
         # Test if the file is ascii
-        if str(head[:5], 'utf-8') == 'solid':
-            raise ValueError("ASCII files not supported")
-        # Write the data to a numpy arrays in AmpObj
-        tfcond = NFaces==data['vertices'].shape[0]			#assigns true or false to tfcond
-        if not tfcond:							#if tfcond is false, raise error
-            raise ValueError("File is corrupt")							#if true, move on
-        vert = np.resize(np.array(data['vertices']), (NFaces*3, 3))
-        norm = np.array(data['normals'])
-        faces = np.reshape(range(NFaces*3), [NFaces,3])
+        if isASCII(head, NFaces, len(data)):
+            vert, norm = readASCII(io.BytesIO(data))
+            self._setSTLData(vert, norm, unify, struc)
+            return
+        # Read the complete records as a view on the bytes
+        nRec = (len(data) - HEADER_SIZE - COUNT_SIZE) // STL_DTYPE.itemsize
+        data = np.frombuffer(data, STL_DTYPE, count=nRec, 
+                             offset=HEADER_SIZE+COUNT_SIZE)
+        vert, norm = unpackBinary(data, NFaces)
+        self._setSTLData(vert, norm, unify, struc)
+
+    def _setSTLData(self, vert, norm, unify=True, struc=True):
+        r"""
+        Set the vertices, faces and normals from the unconnected triangles 
+        read from an .stl file
+
+        Parameters
+        ----------
+        vert: ndarray
+            The vertices of each face, with three consecutive rows per face
+        norm: ndarray
+            The normal of each face
+        unify: boolean, default True
+            unify the coincident vertices of each face
+        struc: boolean, default True
+            Calculate the underlying structure of the mesh, such as edges
+
+        """
+        if len(vert) == 0:
+            raise ValueError("File contains no faces")
+        faces = np.arange(len(vert), dtype=np.int32).reshape(-1, 3)
         self.faces = faces
         self.vert = vert
-        self.norm = norm
+        self.norm = norm.astype(self.floatType(), copy=False)
         
         # Call function to unify vertices of the array
         if unify is True:
@@ -167,7 +583,8 @@ class AmpObject(trimMixin, smoothMixin, visMixin):
                    edgeFaces=True, faceEdges=True, vNorm=False):
         r"""
         Top level function to calculate the underlying structure of the 
-        AmpObject
+        AmpObject. Only the arrays which are not already cached are 
+        calculated, the arrays are otherwise calculated when first accessed
         
         Parameters
         ----------
@@ -188,23 +605,30 @@ class AmpObject(trimMixin, smoothMixin, visMixin):
             If true, the normals of each vertex in the mesh will be calculated
 
         """
-        if norm is True:
+        if norm is True and self.isStale('norm'):
             self.calcNorm()
-        if edges is True:
-            self.calcEdges()
-        if edgeFaces is True:
-            self.calcEdgeFaces()
-        if faceEdges is True:
-            self.calcFaceEdges()
-        if vNorm is True:
+        # All the edge arrays are derived from a single pass
+        if ((edges is True or edgeFaces is True or faceEdges is True) and 
+                self.isStale('edges', 'edgesFace', 'faceEdges', 
+                             'brimEdges', 'valence')):
+            self.calcTopology()
+        if vNorm is True and self.isStale('vNorm'):
             self.calcVNorm()
 
-    def unifyVert(self):
+    def unifyVert(self, tol=None):
         r"""
         Function to unify coincident vertices of the mesh to reduce
         size of the vertices array enabling speed increases when performing
         calculations using the vertex array
         
+        Parameters
+        ----------
+        tol: float, default None
+            If None, only vertices with identical co-ordinates are unified. 
+            Otherwise, clusters of vertices within tol of each other are 
+            merged, see weldTol, and any faces that collapse as a result are 
+            removed
+        
         Examples
         --------
         >>> amp = AmpObject(filename, unify=False)
@@ -215,16 +639,241 @@ class AmpObject(trimMixin, smoothMixin, visMixin):
         (7530, 3)
 
         """
-        # Requires numpy 1.13
-        self.vert, indC = np.unique(self.vert, return_inverse=True, axis=0)
+        self.vert, indC = weldVert(self.vert, tol)
         # Maps the new vertices index to the face array
-        self.faces = np.resize(indC[self.faces], 
-                               (len(self.norm), 3)).astype(np.int32)
+        faces = indC[self.faces].astype(np.int32)
+        if tol is not None:
+            # Remove faces which have collapsed to an edge or point
+            keep = ((faces[:, 0] != faces[:, 1]) & (faces[:, 0] != faces[:, 2])
+                    & (faces[:, 1] != faces[:, 2]))
+            faces = faces[keep, :]
+        self.faces = faces
+
+    def reorder(self, bits=10):
+        r"""
+        Reorder the vertices and faces along a Morton space filling curve so 
+        that elements which are close in space are close in memory. This 
+        improves the cache locality of the gathers used to calculate the 
+        normals, the registration and the nearest neighbour queries. The 
+        permutations from the original order are kept in vertPerm and 
+        facePerm, see originalOrder, and are saved in .amp files. They only 
+        follow reorder, so once vertices or faces are added or removed they 
+        no longer match the mesh and originalOrder raises a ValueError. The 
+        mesh is never reordered unless this is called and the 
+        transform_matrix is kept
+        
+        Parameters
+        ----------
+        bits: int, default 10
+            The number of bits used to quantise each axis, at most 21
+
+        Examples
+        --------
+        >>> amp = AmpObject(filename)
+        >>> vert = amp.vert.copy()
+        >>> amp.reorder()
+        >>> np.array_equal(amp.originalOrder(amp.vert), vert)
+        True
+
+        """
+        for perm, arr, typ in [(self.vertPerm, self.vert, 'vertices'),
+                               (self.facePerm, self.faces, 'faces')]:
+            if perm is not None and len(perm) != len(arr):
+                raise ValueError("Expected {} {} but found {}, the mesh has "
+                                 "changed since it was reordered".format(
+                                     len(perm), typ, len(arr)))
+        code = mortonCode(self.vert, bits)
+        order = np.argsort(code, kind='stable')
+        inv = np.empty_like(order)
+        inv[order] = np.arange(len(order))
+        faces = inv[self.faces].astype(self.faces.dtype)
+        # Order the faces by their lowest vertex so they follow the curve
+        fOrder = np.lexsort((faces.max(axis=1), faces.min(axis=1)))
+        # Setting the vertices resets the pose, reading them above applied 
+        # any pending transformation so the pose is still valid afterwards
+        pose = self._pose
+        self.faces = faces[fOrder]
+        self.vert = self.vert[order]
+        self._pose = pose
+        if hasattr(self, 'values'):
+            self.values = self.values[order]
+        # Compose with any previous reordering
+        if self.vertPerm is not None:
+            order = self.vertPerm[order]
+        if self.facePerm is not None:
+            fOrder = self.facePerm[fOrder]
+        self.vertPerm = order
+        self.facePerm = fOrder
+
+    def originalOrder(self, arr, typ='vert'):
+        r"""
+        Map an array from the current order of the vertices or faces back to 
+        the order before reorder was called 
+        
+        Parameters
+        ----------
+        arr: ndarray
+            The array with one row for each vertex or face, eg the values
+        typ: str, default 'vert'
+            Either 'vert' if arr has a row for each vertex or 'faces' if it 
+            has a row for each face
+
+        Returns
+        -------
+        arr: ndarray
+            The array in the original order 
+
+        """
+        if typ not in ('vert', 'faces'):
+            raise ValueError("Expected typ to be 'vert' or 'faces' but "
+                             "found: {}".format(typ))
+        perm = self.vertPerm if typ == 'vert' else self.facePerm
+        if perm is None:
+            return arr
+        if len(perm) != len(arr):
+            raise ValueError("Expected {} rows but found {}, the mesh has "
+                             "changed since it was reordered".format(len(perm), len(arr)))
+        out = np.empty_like(arr)
+        out[perm] = arr
+        return out
+
+    def calcTopology(self):
+        r"""
+        Function to compute all the connectivity arrays of the mesh from a 
+        single sort of the edges of each face. Each edge is encoded as an 
+        integer key, v0 * nVert + v1 where v0 < v1, so the duplicated edges 
+        are found with a one dimensional sort 
+        
+        Returns
+        -------
+        edges: ndarray
+            Denoting the indicies of two vertices on each edge
+        edgesFace: ndarray
+            Denoting the indicies of the three edges on each face
+        faceEdges: ndarray
+            The indicies of the faces in each edge, edges may have either 
+            1 or 2 faces, if 1 then the second index will be -99999
+        brimEdges: ndarray
+            Boolean array which is True for edges with only one face, ie 
+            those on the brim or around holes in the mesh
+        valence: ndarray
+            The number of edges connected to each vertex
+
+        Examples
+        --------
+        >>> amp = AmpObject(filename, struc=False)
+        >>> amp.calcTopology()
+        >>> amp.edges.shape, amp.edgesFace.shape, amp.faceEdges.shape
+        ((22473, 2), (14944, 3), (22473, 2))
+
+        """
+        nVert = len(self.vert)
+        # Get the edges of each face, in the order [0, 1], [0, 2], [1, 2]
+        edges = np.sort(np.reshape(self.faces[:, [0, 1, 0, 2, 1, 2]], 
+                                   [-1, 2]), 1)
+        key = edges[:, 0].astype(np.int64) * nVert + edges[:, 1]
+        # A stable sort keeps the faces on each edge in face order
+        order = np.argsort(key, kind='stable')
+        sKey = key[order]
+        first = np.r_[True, sKey[1:] != sKey[:-1]]
+        eInd = np.cumsum(first) - 1
+        self.edges = edges[order[first], :]
+        # Remap the sorted edge index back to the edges on each face
+        edgesFace = np.empty([len(key)], dtype=np.int32)
+        edgesFace[order] = eInd
+        self.edgesFace = np.reshape(edgesFace, [-1, 3])
+        # The face of each of the sorted edges
+        fInd = (order // 3).astype(np.int32)
+        self.faceEdges = np.empty([len(self.edges), 2], dtype=np.int32)
+        self.faceEdges.fill(-99999)
+        self.faceEdges[eInd[first], 0] = fInd[first]
+        self.faceEdges[eInd[~first], 1] = fInd[~first]
+        self.brimEdges = self.faceEdges[:, 1] == -99999
+        self.valence = np.bincount(self.edges.flatten(), minlength=nVert)
+
+    def calcAdjacency(self):
+        r"""
+        Function to compute the sparse adjacency matrices of the mesh, these 
+        are cached and can be reused by any method that requires the 
+        neighbours of each vertex
+        
+        Returns
+        -------
+        vertAdj: csr_matrix
+            The nVert x nVert vertex adjacency matrix, with a value of 1 for 
+            each pair of vertices that share an edge 
+        vertFaceAdj: csr_matrix
+            The nVert x nFaces incidence matrix, with a value of 1 for each 
+            face connected to each vertex
+
+        Examples
+        --------
+        >>> amp = AmpObject(filename)
+        >>> neighMean = amp.vertAdj.dot(amp.vert) / amp.valence[:, None]
+
+        """
+        nVert = len(self.vert)
+        nFaces = len(self.faces)
+        e = self.edges
+        self.vertAdj = sparse.csr_matrix((np.ones(2*len(e)), 
+                                          (np.r_[e[:, 0], e[:, 1]], 
+                                           np.r_[e[:, 1], e[:, 0]])),
+                                         shape=(nVert, nVert))
+        self.vertFaceAdj = sparse.csr_matrix((np.ones(3*nFaces), 
+                                              (self.faces.flatten(), 
+                                               np.repeat(np.arange(nFaces), 3))),
+                                             shape=(nVert, nFaces))
+
+    def calcLaplacian(self, typ='uniform'):
+        r"""
+        Function to compute the sparse Laplacian matrix of the mesh, L = D - W,
+        where W is the weighted adjacency matrix and D is the diagonal matrix 
+        of its row sums
+        
+        Parameters
+        ----------
+        typ: str, default 'uniform'
+            If 'uniform', each edge has a weight of 1 and the result is 
+            cached as uniformLap. If 'cotan', each edge is weighted by half 
+            the sum of the cotangents of the angles opposite the edge and the 
+            result is cached as cotanLap
+        
+        Returns
+        -------
+        L: csr_matrix
+            The nVert x nVert Laplacian matrix
+
+        """
+        nVert = len(self.vert)
+        if typ == 'uniform':
+            W = self.vertAdj
+        elif typ == 'cotan':
+            v = self.vert[self.faces]
+            # Edge vectors from each corner to the other two vertices
+            a = np.roll(v, -1, axis=1) - v
+            b = np.roll(v, 1, axis=1) - v
+            cross = np.linalg.norm(np.cross(a, b), axis=2)
+            dot = np.einsum('ijk, ijk->ij', a, b)
+            cot = np.divide(dot, cross, out=np.zeros(dot.shape), 
+                            where=cross > 0)
+            # The angle at each corner is opposite the edge between the 
+            # other two vertices
+            i = np.roll(self.faces, -1, axis=1).flatten()
+            j = np.roll(self.faces, 1, axis=1).flatten()
+            w = 0.5 * cot.flatten()
+            W = sparse.csr_matrix((np.r_[w, w], (np.r_[i, j], np.r_[j, i])),
+                                  shape=(nVert, nVert))
+        else:
+            raise ValueError("Expected typ to be 'uniform' or 'cotan' but "
+                             "found: {}".format(typ))
+        L = sparse.diags(np.asarray(W.sum(axis=1)).flatten()) - W
+        setattr(self, typ + 'Lap', L.tocsr())
 
     def calcEdges(self):
         """
         Function to compute the edges array ie the index of the two vertices
-        that make up each edge
+        that make up each edge. This is calculated with the other 
+        connectivity arrays by calcTopology
         
         Returns
         -------
@@ -232,16 +881,13 @@ class AmpObject(trimMixin, smoothMixin, visMixin):
             Denoting the indicies of two vertices on each edge
 
         """
-        # Get edges array
-        self.edges = np.reshape(self.faces[:, [0, 1, 0, 2, 1, 2]], [-1, 2])
-        self.edges = np.sort(self.edges, 1)
-        # Unify the edges
-        self.edges, indC = np.unique(self.edges, return_inverse=True, axis=0)
+        self.calcTopology()
 
     def calcEdgeFaces(self):
         r"""
         Function that calculates the indicies of the three edges that make up
-        each face 
+        each face. This is calculated with the other connectivity arrays by 
+        calcTopology
         
         Returns
         -------
@@ -249,39 +895,21 @@ class AmpObject(trimMixin, smoothMixin, visMixin):
             Denoting the indicies of the three edges on each face
         
         """
-        edges = np.reshape(self.faces[:, [0, 1, 0, 2, 1, 2]], [-1, 2])
-        edges = np.sort(edges, 1)
-        # Unify the edges
-        edges, indC = np.unique(edges, return_inverse=True, axis=0)
-        # Get edges on each face 
-        self.edgesFace = np.reshape(range(len(self.faces)*3), [-1,3])
-        #Remap the edgesFace array 
-        self.edgesFace = indC[self.edgesFace].astype(np.int32)
+        self.calcTopology()
 
     def calcFaceEdges(self):
         r"""
-        Function that calculates the indicies of the faces on each edge
+        Function that calculates the indicies of the faces on each edge. This 
+        is calculated with the other connectivity arrays by calcTopology
         
         Returns
         -------
         faceEdges: ndarray
             The indicies of the faces in each edge, edges may have either 
-            1 or 2 faces, if 1 then the second index will be NaN
+            1 or 2 faces, if 1 then the second index will be -99999
 
         """
-        #Initiate the faceEdges array
-        self.faceEdges = np.empty([len(self.edges), 2], dtype=np.int32)
-        self.faceEdges.fill(-99999)
-        # Denote the face index for flattened edge array
-        fInd = np.repeat(np.array(range(len(self.faces))), 3)
-        # Flatten edge array
-        eF = np.reshape(self.edgesFace, [-1])
-        eFInd = np.unique(eF, return_index=True)[1]
-        logic = np.zeros([len(eF)], dtype=bool)
-        logic[eFInd] = True
-        self.faceEdges[eF[logic], 0] = fInd[logic]
-        self.faceEdges[eF[~logic], 1] = fInd[~logic]        
-        
+        self.calcTopology()
 
     def calcNorm(self):
         r"""
@@ -299,48 +927,338 @@ class AmpObject(trimMixin, smoothMixin, visMixin):
                          self.vert[self.faces[:,2]] -
                          self.vert[self.faces[:,0]])
         mag = np.linalg.norm(norms, axis=1)
-        self.norm = np.divide(norms, mag[:,None])
+        self.norm = np.divide(norms, mag[:,None]).astype(self.floatType(), 
+                                                         copy=False)
     
+    def calcFaceCent(self):
+        r"""
+        Calculate the centroid of each face of the AmpObj
+        
+        Returns
+        -------
+        faceCent: ndarray
+            centroid of each face
+
+        """
+        self.faceCent = self.vert[self.faces].mean(axis=1)
+
+    def calcTree(self, typ='vert'):
+        r"""
+        Build a KD-tree of the vertices or face centroids of the AmpObj, this 
+        is cached as vertTree or faceTree and reused by queryTree until the 
+        geometry is changed. Rigid transformations do not require the tree 
+        to be rebuilt
+
+        Parameters
+        ----------
+        typ: str, default 'vert'
+            Either 'vert' to build the tree of the vertices or 'faces' to 
+            build the tree of the face centroids
+
+        """
+        if typ == 'vert':
+            name, points = 'vertTree', self.vert
+        elif typ == 'faces':
+            name, points = 'faceTree', self.faceCent
+        else:
+            raise ValueError("Expected typ to be 'vert' or 'faces' but "
+                             "found: {}".format(typ))
+        setattr(self, name, spatial.cKDTree(points))
+        self._treeFrame[name] = np.eye(4)
+
+    def queryTree(self, points, k=1, typ='vert', **kwargs):
+        r"""
+        Find the nearest vertices or face centroids of the AmpObj to a set 
+        of points using the cached KD-tree, see calcTree. If the AmpObj has 
+        been moved by a rigid transformation since the tree was built, the 
+        points are moved into the frame of the tree instead
+
+        Parameters
+        ----------
+        points: array_like
+            The points to query
+        k: int, default 1
+            The number of nearest neighbours to find
+        typ: str, default 'vert'
+            Either 'vert' to find the nearest vertices or 'faces' to find the 
+            nearest face centroids
+        **kwargs:
+            The keyword arguments passed to cKDTree.query
+
+        Returns
+        -------
+        dist: ndarray
+            The distance to each neighbour
+        idx: ndarray
+            The index of each neighbour
+
+        Examples
+        --------
+        >>> amp = AmpObject(filename)
+        >>> dist, idx = amp.queryTree(amp.vert[:5] + 0.01)
+        >>> idx
+        array([0, 1, 2, 3, 4])
+
+        """
+        if typ not in ('vert', 'faces'):
+            raise ValueError("Expected typ to be 'vert' or 'faces' but "
+                             "found: {}".format(typ))
+        name = 'vertTree' if typ == 'vert' else 'faceTree'
+        tree = getattr(self, name)
+        return tree.query(self._toTreeFrame(points, name), k, **kwargs)
+
+    def _toTreeFrame(self, points, name):
+        r"""
+        Move points into the frame of a cached spatial index by inverting 
+        the rigid transformation applied since the index was built
+        """
+        frame = self._treeFrame[name]
+        if np.array_equal(frame, np.eye(4)):
+            return points
+        return np.dot(np.asarray(points) - frame[3, :3], frame[:3, :3])
+
+    def calcBVH(self, leafSize=4):
+        r"""
+        Build a bounding volume hierarchy of the faces of the AmpObj, this is 
+        cached as faceBVH and reused by closest_points until the geometry is 
+        changed. Rigid transformations do not require it to be rebuilt
+
+        Parameters
+        ----------
+        leafSize: int, default 4
+            The number of faces in each leaf of the hierarchy, see triBVH
+
+        """
+        self.faceBVH = triBVH(self.vert, self.faces, leafSize)
+        self._treeFrame['faceBVH'] = np.eye(4)
+
+    def closest_points(self, points, signed=False):
+        r"""
+        Find the exact closest point on the surface of the AmpObj to each of 
+        a set of points using the cached bounding volume hierarchy, see 
+        calcBVH. Unlike queryTree, the closest point may lie anywhere on a 
+        face rather than only at its vertices or centroid
+
+        Parameters
+        ----------
+        points: array_like
+            The points to query
+        signed: boolean, default False
+            If True, the distance is negative for points behind the surface. 
+            The sign is found from the angle weighted pseudo-normal of the 
+            closest face, edge or vertex so it is robust at sharp features 
+
+        Returns
+        -------
+        face: ndarray
+            The index of the face the closest point lies upon
+        bary: ndarray
+            The barycentric co-ordinates of the closest point on the face
+        point: ndarray
+            The closest point on the surface
+        dist: ndarray
+            The distance to the closest point
+
+        Examples
+        --------
+        >>> amp = AmpObject(filename)
+        >>> face, bary, point, dist = amp.closest_points(amp.faceCent[:3])
+        >>> face
+        array([0, 1, 2])
+        >>> np.allclose(dist, 0, atol=1e-4)
+        True
+
+        """
+        bvh = self.faceBVH
+        frame = self._treeFrame['faceBVH']
+        points = np.asarray(points).reshape(-1, 3)
+        face, bary, point, dist = bvh.query(self._toTreeFrame(points, 
+                                                              'faceBVH'))
+        # Move the closest points back into the current frame
+        point = np.dot(point, frame[:3, :3].T) + frame[3, :3]
+        if signed is True:
+            n = self._pseudoNorm(face, bary)
+            sign = np.einsum('ij, ij->i', points - point, n) < 0
+            dist[sign] *= -1
+        return face, bary, point, dist
+
+    def _pseudoNorm(self, face, bary):
+        r"""
+        The pseudo-normal at points on the faces of the AmpObj. This is the 
+        normal of the face for points within a face, the sum of the normals 
+        of the adjacent faces for points on an edge and the angle weighted 
+        vertex normal for points on a vertex
+        """
+        n = self.norm[face].astype(np.float64)
+        onEdge = (bary == 0).sum(axis=1)
+        # The edges of each face are ordered [0, 1], [0, 2], [1, 2] so the 
+        # edge opposite to the zero co-ordinate is 2 - its position
+        e = np.flatnonzero(onEdge == 1)
+        if len(e):
+            col = 2 - np.argmin(bary[e] != 0, axis=1)
+            n[e] = self.edgeNorm[self.edgesFace[face[e], col]]
+        v = np.flatnonzero(onEdge == 2)
+        if len(v):
+            vInd = self.faces[face[v], np.argmax(bary[v], axis=1)]
+            n[v] = self.vNormAngle[vInd]
+        return n
+
+    def calcPseudoNorm(self):
+        r"""
+        Calculate the pseudo-normals of the vertices and edges of the AmpObj 
+        used for the sign of the distance by closest_points. These are 
+        cached as vNormAngle, the angle weighted vertex normals, and 
+        edgeNorm, the sum of the normals of the faces of each edge
+
+        """
+        norm = self.norm
+        fE = self.faceEdges
+        edgeNorm = norm[fE[:, 0]].copy()
+        # Edges on the brim only have one face
+        inner = fE[:, 1] >= 0
+        edgeNorm[inner] += norm[fE[inner, 1]]
+        self.edgeNorm = edgeNorm
+        self.vNormAngle = self._weightedVNorm('angle')
+
     def fixNorm(self):
         r"""
-        Fix normals of faces so they all face outwards 
-        """
-        fC = self.vert[self.faces].mean(axis=1)
-        cent = self.vert.mean(axis=0)
-        # polarity = np.sum(self.norm * (fC-cent), axis=1) < 0
-        # if polarity.mean() > 0.5:
-        #     self.faces[:, [1,2]] = self.faces[:, [2,1]]
-        #     self.calcNorm()
-        #     if hasattr(self, 'vNorm'): self.calcVNorm()
-        polarity  = np.einsum('ij, ij->i', fC - cent, self.norm) < 0
-        # self.faces[polarity, [1,2]] = self.faces[polarity, [2,1]]
-        for i, f in enumerate(self.faces):
-            if polarity[i] == True:
-                self.faces[i, :] = [f[0], f[2], f[1]]
+        Fix normals of faces so they all face outwards. The winding of the 
+        faces is made consistent by propagating it across the shared edges 
+        of each connected region of the mesh, then each region is flipped 
+        if its signed volume is negative. This is valid for concave shapes, 
+        unlike a comparison with the centroid of the mesh 
 
-        self.calcNorm()
-        if hasattr(self, 'vNorm'): self.calcVNorm()
+        Examples
+        --------
+        >>> amp = AmpObject(filename)
+        >>> faces = amp.faces.copy()
+        >>> faces[::2] = faces[::2, [0, 2, 1]]
+        >>> amp.faces = faces
+        >>> amp.fixNorm()
         
-    def calcVNorm(self):
+        """
+        faces = self.faces
+        nFaces = len(faces)
+        # Direction of each edge on each face, in the order of edgesFace, 
+        # relative to its sorted vertex indicies 
+        sign = (faces[:, [0, 2, 1]] < faces[:, [1, 0, 2]]).flatten()
+        eF = self.edgesFace.flatten()
+        order = np.argsort(eF, kind='stable')
+        count = np.bincount(eF, minlength=len(self.edges))
+        start = np.r_[0, np.cumsum(count)[:-1]]
+        # Only consider manifold edges that join two faces 
+        start = start[count == 2]
+        h0 = order[start]
+        h1 = order[start+1]
+        f0 = h0 // 3
+        f1 = h1 // 3
+        # Faces are consistent if they traverse the shared edge in opposite 
+        # directions, store as 1 for consistent and 2 for a change in winding
+        rel = 1 + (sign[h0] == sign[h1])
+        graph = sparse.coo_matrix((np.r_[rel, rel], (np.r_[f0, f1], np.r_[f1, f0])),
+                                  shape=(nFaces+1, nFaces+1)).tocsr()
+        nComp, labels = csgraph.connected_components(graph[:nFaces, :nFaces], 
+                                                     directed=False)
+        # Join a root node to one face of each connected region so one 
+        # traversal covers the whole mesh
+        rep = np.unique(labels, return_index=True)[1]
+        root = sparse.coo_matrix((np.ones(len(rep)), (np.full(len(rep), nFaces), rep)),
+                                 shape=(nFaces+1, nFaces+1))
+        graph = (graph + root + root.T).tocsr()
+        _, pred = csgraph.breadth_first_order(graph, nFaces, directed=False, 
+                                              return_predecessors=True)
+        pred[nFaces] = nFaces
+        # Change of winding between each face and its parent in the tree
+        parity = (np.asarray(graph[np.arange(nFaces+1), pred]).flatten() == 2)
+        # Accumulate the parity to the root by pointer jumping 
+        anc = pred
+        while (anc != nFaces).any():
+            parity = parity ^ parity[anc]
+            anc = anc[anc]
+        flip = parity[:nFaces]
+        faces = faces.copy()
+        faces[flip] = faces[flip][:, [0, 2, 1]]
+        # Signed volume of each region about its centroid
+        v = self.vert[faces]
+        cent = np.stack([np.bincount(labels, v[:, :, i].mean(axis=1), nComp) 
+                         for i in range(3)], axis=1)
+        cent /= np.bincount(labels, minlength=nComp)[:, None]
+        v = v - cent[labels][:, None, :]
+        vol = np.einsum('ij, ij->i', v[:, 0], np.cross(v[:, 1], v[:, 2]))
+        vol = np.bincount(labels, vol, nComp)
+        neg = (vol < 0)[labels]
+        faces[neg] = faces[neg][:, [0, 2, 1]]
+        # Setting the faces invalidates the derived arrays 
+        self.faces = faces
+        
+    def calcVNorm(self, weight=None):
         """
         Function to compute the vertex normals based upon the mean of the
-        connected face normals 
+        connected face normals. Faces with undefined normals are ignored
+        
+        Parameters
+        ----------
+        weight: str, default None
+            The weighting of each face normal, 'uniform' weights each 
+            connected face equally, 'area' weights by the area of the face 
+            and 'angle' weights by the interior angle of the face at the 
+            vertex. If None, the weighting last used is kept, this is 
+            initially 'uniform'. The weighting is also kept when vNorm is 
+            recalculated after the mesh is changed
         
         Returns
         -------
         vNorm: ndarray
             normal of each vertex
 
+        Examples
+        --------
+        >>> amp = AmpObject(filename)
+        >>> amp.calcVNorm(weight='area')
+        >>> amp.vNorm.shape
+        (7530, 3)
+
         """
+        if weight is None:
+            weight = self._vNormWeight
+        self.vNorm = self._weightedVNorm(weight)
+        self._vNormWeight = weight
+
+    def _weightedVNorm(self, weight='uniform'):
+        r"""
+        The weighted mean of the connected face normals at each vertex, see 
+        calcVNorm
+        """
+        if weight not in ('uniform', 'area', 'angle'):
+            raise ValueError("Expected weight to be 'uniform', 'area' or "
+                             "'angle' but found: {}".format(weight))
         f = self.faces.flatten()
-        o_idx = f.argsort()
-        row, col = np.unravel_index(o_idx, self.faces.shape)
-        ndx = np.searchsorted(f[o_idx], range(self.vert.shape[0]), side='right')
-        ndx = np.r_[0, ndx]
-        norms = self.norm[row, :]
-        self.vNorm = np.zeros(self.vert.shape)
-        for i in range(self.vert.shape[0]):
-            self.vNorm[i, :] = np.nanmean(norms[ndx[i]:ndx[i+1], :], axis=0)
+        norm = self.norm
+        # Weight of each face at each of its three vertices
+        if weight == 'uniform':
+            w = np.ones(self.faces.shape)
+        elif weight == 'area':
+            cp = np.cross(self.vert[self.faces[:, 1]] - self.vert[self.faces[:, 0]],
+                          self.vert[self.faces[:, 2]] - self.vert[self.faces[:, 0]])
+            w = np.repeat(0.5 * np.linalg.norm(cp, axis=1)[:, None], 3, axis=1)
+        else:
+            v = self.vert[self.faces]
+            a = np.roll(v, -1, axis=1) - v
+            b = np.roll(v, 1, axis=1) - v
+            w = np.arctan2(np.linalg.norm(np.cross(a, b), axis=2),
+                           np.einsum('ijk, ijk->ij', a, b))
+        # Ignore faces with undefined normals
+        valid = ~np.isnan(norm).any(axis=1)
+        w = (w * valid[:, None]).flatten()
+        norm = np.where(valid[:, None], norm, 0)
+        nVert = len(self.vert)
+        total = np.bincount(f, w, minlength=nVert)
+        vNorm = np.stack([np.bincount(f, w * np.repeat(norm[:, i], 3), 
+                                      minlength=nVert) for i in range(3)],
+                         axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (vNorm / total[:, None]).astype(self.floatType(), 
+                                                   copy=False)
             
 
     def save(self, filename):
@@ -358,18 +1276,212 @@ class AmpObject(trimMixin, smoothMixin, visMixin):
         with open(filename, 'wb') as fh:
             header = '%s' % (filename)
             header = header.split('/')[-1].encode('utf-8')
-            header = header[:80].ljust(80, b' ')
+            header = header[:HEADER_SIZE].ljust(HEADER_SIZE, b' ')
             packed = struct.pack('@i', len(self.faces))
             fh.write(header)
             fh.write(packed)
-            data_type = np.dtype([('normals', np.float32, (3, )),
-                                  ('vertices', np.float32, (9, )),
-                                  ('atttr', '<i2', (1, ))])
-            data_write = np.zeros(len(self.faces), dtype=data_type)
+            data_write = np.zeros(len(self.faces), dtype=STL_DTYPE)
             data_write['normals'] = self.norm
             data_write['vertices'] = np.reshape(fv, (len(self.faces), 9))
             data_write.tofile(fh)
 
+    def save_amp(self, filename, struc=True):
+        r"""
+        Function to save the AmpObject as a .amp file. This is an 
+        uncompressed numpy .npz archive which holds the unified vertices and 
+        faces, the values, the cached derived arrays, the stype and the 
+        permutations set by reorder, so it can be loaded without 
+        recalculating the structure of the mesh 
+        
+        Parameters
+        -----------
+        filename: str
+            file path of the .amp file to save to
+        struc: boolean, default True
+            If True, the structure of the mesh and the vertex normals are 
+            calculated before saving if they are not already cached
+
+        """
+        if struc is True:
+            self.calcStruct(vNorm=True)
+        arrays = {'vert': self.vert, 'faces': self.faces}
+        if hasattr(self, 'values'):
+            arrays['values'] = self.values
+        for k in ['vertPerm', 'facePerm']:
+            if getattr(self, k) is not None:
+                arrays[k] = getattr(self, k)
+        # Only save the derived arrays, the sparse operators are rebuilt 
+        for k, v in self._cache.items():
+            if isinstance(v, np.ndarray):
+                arrays[k] = v
+        meta = {'version': AMP_VERSION, 'stype': self.stype, 
+                'cache': [k for k in arrays if k in self._cache],
+                'fingerprint': self.fingerprint(), 
+                'vNormWeight': self._vNormWeight}
+        arrays['meta'] = np.array(json.dumps(meta))
+        with open(filename, 'wb') as fh:
+            np.savez(fh, **arrays)
+
+    def load_amp(self, filename, mmap=False):
+        r"""
+        Function to read a .amp file saved using save_amp. The derived 
+        arrays are loaded into the cache so nothing is recalculated
+        
+        Parameters
+        -----------
+        filename: str 
+            file path of the .amp file to read 
+        mmap: boolean, default False
+            If True, the arrays are memory-mapped from the file in copy on 
+            write mode, so changes to the AmpObject are not written back 
+            to the file 
+
+        """
+        if mmap is True:
+            arrays = mapNpz(filename)
+        else:
+            with np.load(filename, allow_pickle=False) as data:
+                arrays = {k: data[k] for k in data.files}
+        meta = json.loads(str(arrays.pop('meta')))
+        if meta['version'] > AMP_VERSION:
+            raise ValueError("The .amp file version {} is not supported, "
+                             "expected version {} or "
+                             "earlier".format(meta['version'], AMP_VERSION))
+        self.stype = meta['stype']
+        self._vNormWeight = meta.get('vNormWeight', 'uniform')
+        self.faces = arrays.pop('faces')
+        vert = arrays.pop('vert')
+        self.vert = vert
+        values = arrays.pop('values', None)
+        if values is not None:
+            self.values = values
+        # Restore the fingerprint so the mesh is not rehashed, unless the 
+        # arrays were cast to another dtype when they were set
+        cast = (self.vert.dtype != vert.dtype or 
+                (values is not None and self.values.dtype != values.dtype))
+        if 'fingerprint' in meta and not cast:
+            self._cache['fingerprint'] = meta['fingerprint']
+        for k in ['vertPerm', 'facePerm']:
+            if k in arrays:
+                setattr(self, k, arrays.pop(k))
+        for k in meta['cache']:
+            arr = arrays[k]
+            if self.dtype is not None and arr.dtype.kind == 'f':
+                arr = arr.astype(self.dtype, copy=False)
+            self._cache[k] = arr
+
+    @property
+    def transform_matrix(self):
+        r"""
+        The total rigid transformation applied by translate, rotate, 
+        rigidTransform, matrixTransform and flip since the vertices were 
+        last set. This is a 4x4 array of the same form as align.tForm, with 
+        the rotation matrix in the top left and the translation in the 
+        bottom row, and can be replayed on another AmpObject using 
+        matrixTransform
+
+        Examples
+        --------
+        >>> amp = AmpObject(filename)
+        >>> amp.translate([1, 0, 0])
+        >>> amp.transform_matrix[3, :3]
+        array([1., 0., 0.])
+
+        """
+        if self._pose is None:
+            return np.eye(4)
+        return self._pose.copy()
+
+    def matrixTransform(self, tForm, norms=True):
+        r"""
+        Perform a rigid transformation on the AmpObject from a 4x4 array of
+        the same form as align.tForm and transform_matrix
+
+        Parameters
+        ----------
+        tForm: array_like
+            The 4x4 transformation array, the rotation matrix is in the top 
+            left and the translation is in the bottom row
+        norms: boolean, default True
+            If True, any cached normals are rotated with the vertices, 
+            otherwise they are recalculated when next accessed
+
+        Examples
+        --------
+        >>> amp = AmpObject(filename)
+        >>> moved = amp.clone()
+        >>> moved.rotateAng([0, 0, np.pi/2])
+        >>> moved.translate([0, 0, 5])
+        >>> amp.matrixTransform(moved.transform_matrix)
+        >>> np.allclose(amp.vert, moved.vert, atol=1e-4)
+        True
+
+        """
+        tForm = np.asarray(tForm, dtype=float)
+        if tForm.shape != (4, 4):
+            raise ValueError("Expected 4x4 array, but found: {}".format(tForm.shape))
+        self._transform(tForm[:3, :3], tForm[3, :3], norms)
+
+    def applyTransform(self):
+        r"""
+        Apply any pending rigid transformations to the vertices and cached 
+        normals. This is called automatically when the vertices or the 
+        arrays derived from them are read 
+
+        """
+        if self._pending is None:
+            return
+        R, T = self._pending
+        self._pending = None
+        if R is not None:
+            self._vert[:, :] = np.dot(self._vert, R.T)
+            # Rotate any cached normals and centroids
+            for name in self._poseCache:
+                if not self.isStale(name):
+                    arr = self._cache[name]
+                    self._cache[name] = np.dot(arr, R.T).astype(arr.dtype, 
+                                                                copy=False)
+        if T is not None:
+            self._vert[:] += T
+            if not self.isStale('faceCent'):
+                self._cache['faceCent'] = self._cache['faceCent'] + T.astype(
+                    self._cache['faceCent'].dtype)
+
+    def _transform(self, R=None, T=None, norms=True):
+        r"""
+        Compose a rigid transformation, first the rotation, then the 
+        translation, with those pending and apply it unless deferTransform 
+        is set
+
+        """
+        if R is not None and norms is not True:
+            for name in ['norm', 'vNorm', 'vNormAngle', 'edgeNorm']:
+                self._cache.pop(name, None)
+        for name in ['vertHash', 'fingerprint']:
+            self._cache.pop(name, None)
+        pR, pT = self._pending if self._pending is not None else (None, None)
+        if R is not None:
+            pR = R if pR is None else np.dot(R, pR)
+            pT = None if pT is None else np.dot(R, pT)
+        if T is not None:
+            pT = T if pT is None else pT + T
+        self._pending = (pR, pT)
+        tForm = np.eye(4)
+        if R is not None:
+            tForm[:3, :3] = R
+        if T is not None:
+            tForm[3, :3] = T
+        if self._pose is None:
+            self._pose = tForm
+        else:
+            self._pose = composeTForm(self._pose, tForm)
+        # The trees are not rebuilt, instead the query points are moved 
+        # back to the frame each tree was built in
+        for name, frame in self._treeFrame.items():
+            self._treeFrame[name] = composeTForm(frame, tForm)
+        if not self.deferTransform:
+            self.applyTransform()
+
     def translate(self, trans):
         r"""
         Translate the AmpObj in 3D space
@@ -385,7 +1497,7 @@ class AmpObject(trimMixin, smoothMixin, visMixin):
         if isinstance(trans, (list, np.ndarray, tuple)):
             # Check that trans has exactly 3 dimensions
             if len(trans) == 3:
-                self.vert[:] += trans
+                self._transform(T=np.asarray(trans, dtype=float))
             else:
                 raise ValueError("Translation has incorrect dimensions. Expected 3 but found: " + str(len(trans)))
         else:
@@ -452,11 +1564,13 @@ class AmpObject(trimMixin, smoothMixin, visMixin):
         R: array_like
             A 3x3 array specifying the rotation matrix
         norms: boolean, default True
+            If True, any cached normals are rotated with the vertices, 
+            otherwise they are recalculated when next accessed
             
         """
         if isinstance(R, (list, tuple)):
             # Make R a np array if its a list or tuple
-            R = np.array(R, np.float)
+            R = np.array(R, float)
         elif not isinstance(R, np.ndarray):
             # If
             raise TypeError("Expected R to be array-like but found: " + str(type(R)))
@@ -466,11 +1580,7 @@ class AmpObject(trimMixin, smoothMixin, visMixin):
                 raise ValueError("Expected 3x3 array, but found: {}".format(R.shape))
             else:
                 raise ValueError("Expected 3x3 array, but found: 3x"+str(len(R)))
-        self.vert[:, :] = np.dot(self.vert, R.T)
-        if norms is True:
-            self.norm[:, :] = np.dot(self.norm, R.T)
-            if hasattr(self, 'vNorm'):
-                self.vNorm[:, :] = np.dot(self.vNorm, R.T)
+        self._transform(R=np.asarray(R, dtype=float), norms=norms)
             
             
     def rigidTransform(self, R=None, T=None):
@@ -486,16 +1596,24 @@ class AmpObject(trimMixin, smoothMixin, visMixin):
             An array of the form [x, y, z] which specifies the translation
             
         """
-        if R is not None:
-            if isinstance(R, (tuple, list, np.ndarray)):
-                self.rotate(R, True)
-            else:
-                raise TypeError("Expecting array-like rotation, but found: "+type(R))
-        if T is not None:
-            if isinstance(T, (tuple, list, np.ndarray)):
-                self.translate(T)
-            else:
-                raise TypeError("Expecting array-like translation, but found: "+type(T))
+        # Compose both before applying so the vertices are only updated once
+        defer = self.deferTransform
+        self.deferTransform = True
+        try:
+            if R is not None:
+                if isinstance(R, (tuple, list, np.ndarray)):
+                    self.rotate(R, True)
+                else:
+                    raise TypeError("Expecting array-like rotation, but found: "+type(R))
+            if T is not None:
+                if isinstance(T, (tuple, list, np.ndarray)):
+                    self.translate(T)
+                else:
+                    raise TypeError("Expecting array-like translation, but found: "+type(T))
+        finally:
+            self.deferTransform = defer
+        if not defer:
+            self.applyTransform()
         
 
     @staticmethod
@@ -556,12 +1674,338 @@ class AmpObject(trimMixin, smoothMixin, visMixin):
         """
         if isinstance(axis, int):
             if 0 <= axis < 3:  # Check axis is between 0-2
-                self.vert[:, axis] *= -1.0
-                # Switch face order to normals face same direction
-                self.faces[:, [1, 2]] = self.faces[:, [2, 1]]
-                self.calcNorm()
-                self.calcVNorm()
+                R = np.eye(3)
+                R[axis, axis] = -1.0
+                self._transform(R=R)
+                # Switch face order to normals face same direction, setting 
+                # the faces invalidates the derived arrays
+                self.faces = self.faces[:, [0, 2, 1]]
             else:
                 raise ValueError("Expected axis to be within range 0-2 but found: {}".format(axis))
         else:
             raise TypeError("Expected axis to be int, but found: {}".format(type(axis)))
+
+
+def composeTForm(first, second):
+    r"""
+    Compose two 4x4 rigid transformation arrays of the same form as 
+    align.tForm, with the rotation matrix in the top left and the translation
+    in the bottom row
+
+    Parameters
+    ----------
+    first: ndarray
+        The transformation that is applied first
+    second: ndarray
+        The transformation that is applied second
+
+    Returns
+    -------
+    tForm: ndarray
+        The combined transformation 
+
+    """
+    tForm = np.eye(4)
+    tForm[:3, :3] = np.dot(second[:3, :3], first[:3, :3])
+    tForm[3, :3] = np.dot(second[:3, :3], first[3, :3]) + second[3, :3]
+    return tForm
+
+
+def invertTForm(tForm):
+    r"""
+    Invert a 4x4 rigid transformation array of the same form as align.tForm
+
+    Parameters
+    ----------
+    tForm: ndarray
+        The transformation
+
+    Returns
+    -------
+    inv: ndarray
+        The inverse transformation, so composing it with tForm gives the 
+        identity
+
+    Examples
+    --------
+    >>> tForm = np.eye(4)
+    >>> tForm[:3, :3] = [[0, -1, 0], [1, 0, 0], [0, 0, 1]]
+    >>> tForm[3, :3] = [1, 2, 3]
+    >>> np.allclose(composeTForm(tForm, invertTForm(tForm)), np.eye(4))
+    True
+
+    """
+    inv = np.eye(4)
+    inv[:3, :3] = tForm[:3, :3].T
+    inv[3, :3] = -np.dot(tForm[:3, :3].T, tForm[3, :3])
+    return inv
+
+
+def arrayHash(arr):
+    r"""
+    A hash of the dtype, shape and raw buffer of an array
+
+    Parameters
+    ----------
+    arr: ndarray
+        The array to hash
+
+    Returns
+    -------
+    hash: str
+        The hexadecimal hash of the array
+
+    """
+    arr = np.ascontiguousarray(arr)
+    h = hashlib.blake2b(digest_size=16)
+    h.update('{}{}'.format(arr.dtype.str, arr.shape).encode())
+    h.update(memoryview(arr).cast('B'))
+    return h.hexdigest()
+
+
+def mortonCode(points, bits=10):
+    r"""
+    The position of each point along a Morton, or Z-order, space filling 
+    curve through the bounding box of the points
+
+    Parameters
+    ----------
+    points: ndarray
+        The array of points
+    bits: int, default 10
+        The number of bits used to quantise each axis, at most 21
+
+    Returns
+    -------
+    code: ndarray
+        The uint64 Morton code of each point
+
+    Examples
+    --------
+    >>> mortonCode(np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [1, 1, 1]]), 1)
+    array([0, 1, 2, 7], dtype=uint64)
+
+    """
+    if not 0 < bits <= 21:
+        raise ValueError("Expected bits to be between 1 and 21 but found: {}".format(bits))
+    points = np.asarray(points, dtype=np.float64)
+    code = np.zeros(len(points), dtype=np.uint64)
+    if len(points) == 0:
+        return code
+    pMin = points.min(axis=0)
+    span = points.max(axis=0) - pMin
+    span[span == 0] = 1.0
+    q = ((points - pMin) / span * (2**bits - 1) + 0.5).astype(np.uint64)
+    for i in range(3):
+        code |= spreadBits(q[:, i]) << np.uint64(i)
+    return code
+
+
+def spreadBits(x):
+    r"""
+    Insert two zero bits between each of the lowest 21 bits of an integer, 
+    used to interleave the axes of a Morton code
+
+    Parameters
+    ----------
+    x: ndarray
+        The uint64 array
+
+    Returns
+    -------
+    x: ndarray
+        The uint64 array with the bits spread
+
+    """
+    x = x & np.uint64(0x1fffff)
+    for shift, mask in [(32, 0x1f00000000ffff), (16, 0x1f0000ff0000ff),
+                        (8, 0x100f00f00f00f00f), (4, 0x10c30c30c30c30c3),
+                        (2, 0x1249249249249249)]:
+        x = (x | (x << np.uint64(shift))) & np.uint64(mask)
+    return x
+
+
+def readOnly(arr):
+    r"""
+    A read-only view of an array, used to share the arrays of an AmpObject 
+    with its clones without allowing the clones to edit them in place
+
+    Parameters
+    ----------
+    arr: ndarray
+        The array to share
+
+    Returns
+    -------
+    view: ndarray
+        The read-only view of the array
+
+    """
+    if not arr.flags.writeable:
+        return arr
+    view = arr.view()
+    view.flags.writeable = False
+    return view
+
+
+def isASCII(head, NFaces, size):
+    r"""
+    Test if an .stl file is ASCII. Binary files may also have a header that 
+    starts with 'solid', so these are identified by the file size matching 
+    the number of faces stated after the header
+    
+    Parameters
+    ----------
+    head: bytes
+        The 80 byte header of the file
+    NFaces: int
+        The number of faces read from the 4 bytes after the header
+    size: int
+        The size of the file in bytes
+    
+    Returns
+    -------
+    ascii: boolean
+        True if the file is an ASCII .stl file
+
+    """
+    if head[:5].lower() != b'solid':
+        return False
+    return size != HEADER_SIZE + COUNT_SIZE + NFaces * STL_DTYPE.itemsize
+
+
+def unpackBinary(data, NFaces):
+    r"""
+    Get the vertices and normals from the structured array of binary .stl 
+    records
+    
+    Parameters
+    ----------
+    data: ndarray
+        Structured array of STL records, this may be a view on a buffer 
+        or a memory-mapped file
+    NFaces: int
+        The number of faces stated in the header of the file
+
+    Returns
+    -------
+    vert: ndarray
+        The vertices of each face, with three consecutive rows per face
+    norm: ndarray
+        The normal of each face
+
+    """
+    # Write the data to a numpy arrays in AmpObj
+    tfcond = NFaces==data['vertices'].shape[0]			#assigns true or false to tfcond
+    if not tfcond:							#if tfcond is false, raise error
+        raise ValueError("File is corrupt")							#if true, move on
+    # Copying the strided field gives the only full-size copy, the arrays 
+    # never refer back to the records
+    vert = np.array(data['vertices']).reshape(NFaces*3, 3)
+    norm = np.array(data['normals'])
+    return vert, norm
+
+
+def readASCII(fh, chunksize=2**24):
+    r"""
+    Read the vertices and normals from an ASCII .stl file. The file is read 
+    in blocks of complete lines, each block is split into tokens and the 
+    coordinates following each 'vertex' and 'normal' keyword are converted 
+    with numpy rather than parsing line by line
+    
+    Parameters
+    ----------
+    fh: file
+        File handle of the ASCII .stl opened in binary mode 
+    chunksize: int, default 2**24
+        The approximate number of bytes to tokenise at once
+    
+    Returns
+    -------
+    vert: ndarray
+        The vertices of each face, with three consecutive rows per face
+    norm: ndarray
+        The normal of each face
+
+    Examples
+    --------
+    >>> fh = os.path.join(os.getcwd(), "tests", "ascii_examples", 
+    ...                   "sample_stl_sphere_ASCII.stl")
+    >>> with open(fh, 'rb') as f:
+    ...     vert, norm = readASCII(f)
+    >>> vert.shape, norm.shape
+    ((3840, 3), (1280, 3))
+
+    """
+    verts = []
+    norms = []
+    tail = b''
+    while True:
+        chunk = fh.read(chunksize)
+        block = tail + chunk
+        if chunk:
+            # Only tokenise complete lines, the rest is carried over
+            end = block.rfind(b'\n') + 1
+            block, tail = block[:end], block[end:]
+        if block:
+            tokens = np.array(block.split())
+            for key, out in ((b'vertex', verts), (b'normal', norms)):
+                ind = np.flatnonzero(tokens == key)
+                ind = ind[ind + 3 < len(tokens)]
+                out.append(tokens[ind[:, None] + np.arange(1, 4)]
+                           .astype(np.float32))
+        if not chunk:
+            break
+    vert = np.concatenate(verts) if verts else np.zeros([0, 3], np.float32)
+    norm = np.concatenate(norms) if norms else np.zeros([0, 3], np.float32)
+    if len(vert) % 3 != 0 or len(norm) != len(vert) // 3:
+        raise ValueError("File is corrupt")
+    return vert, norm
+
+
+def mapNpz(filename):
+    r"""
+    Memory-map the arrays stored within an uncompressed .npz archive in copy 
+    on write mode 
+
+    Parameters
+    ----------
+    filename: str
+        file path of the .npz archive
+
+    Returns
+    -------
+    arrays: dict
+        The mapped arrays with the archive names, without the .npy extension
+
+    """
+    arrays = {}
+    with zipfile.ZipFile(filename) as zf, open(filename, 'rb') as fh:
+        for info in zf.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError("Cannot memory-map the compressed array: "
+                                 "{}".format(info.filename))
+            # Skip the local header of the zip entry to the .npy data
+            fh.seek(info.header_offset + 26)
+            nName, nExtra = struct.unpack('<HH', fh.read(4))
+            fh.seek(info.header_offset + 30 + nName + nExtra)
+            version = np.lib.format.read_magic(fh)
+            if version == (1, 0):
+                header = np.lib.format.read_array_header_1_0(fh)
+            else:
+                header = np.lib.format.read_array_header_2_0(fh)
+            shape, fortran, dtype = header
+            name = info.filename[:-4]
+            if dtype.hasobject:
+                raise ValueError("Cannot memory-map the object array: "
+                                 "{}".format(name))
+            if np.prod(shape) == 0 or dtype.kind == 'U':
+                # Empty arrays cannot be mapped, strings are read directly
+                count = int(np.prod(shape))
+                arrays[name] = np.fromfile(fh, dtype, count).reshape(
+                    shape, order='F' if fortran else 'C')
+            else:
+                arrays[name] = np.memmap(filename, dtype, mode='c', 
+                                         offset=fh.tell(), shape=shape, 
+                                         order='F' if fortran else 'C')
+    return arrays
@@ -4,10 +4,8 @@ Package for dealing with registration methods between two AmpObject meshes
 Copyright: Joshua Steer 2020, Joshua.Steer@soton.ac.uk
 """
 import numpy as np
-import copy
-from scipy import spatial
+import inspect
 from ampscan.core import AmpObject
-import matplotlib.pyplot as plt
 
 # For the doc examples
 import os
@@ -29,6 +27,10 @@ class registration(object):
     	A string of the method used for registration
     *args:
     	The arguments used for the registration methods
+    cache: resultCache, default None
+        If not None, the registration is loaded from the cache when the 
+        same meshes have been registered with the same parameters, otherwise 
+        it is calculated and stored
     **kwargs:
     	The keyword arguments used for the registration methods
         
@@ -47,11 +49,50 @@ class registration(object):
     >>> reg = registration(baseline, target, steps=10, neigh=10, smooth=1).reg
 		
     """ 
-    def __init__(self, baseline, target, method='point2plane', *args, **kwargs):
+    def __init__(self, baseline, target, method='point2plane', *args, 
+                 cache=None, **kwargs):
         self.b = baseline
         self.t = target
-        if method is not None:
+        if method is None:
+            pass
+        elif cache is not None:
+            self.cachedReg(cache, method, *args, **kwargs)
+        else:
             getattr(self, method)(*args, **kwargs)
+
+    def cachedReg(self, cache, method='point2plane', *args, **kwargs):
+        r"""
+        Run a registration method through a resultCache, the displacement 
+        field and values are keyed on the fingerprints of the meshes and all 
+        the parameters of the method including the defaults
+        
+        Parameters
+        ----------
+        cache: resultCache
+            The cache to load the result from or store it within
+        method: str, default 'point2plane'
+            A string of the method used for registration
+        *args:
+        	The arguments used for the registration method
+        **kwargs:
+        	The keyword arguments used for the registration method
+        
+        """
+        params = inspect.signature(getattr(self, method)).bind(*args, **kwargs)
+        params.apply_defaults()
+        key = cache.key('registration', self.b, self.t, method=method, 
+                        **params.arguments)
+        result = cache.get(key)
+        if result is None:
+            getattr(self, method)(*args, **kwargs)
+            cache.put(key, disp=self.disp.vert, values=self.reg.values)
+        else:
+            self.reg = self.b.clone()
+            self.reg.stype = 'reg'
+            self.disp = self.reg.clone()
+            self.disp.vert = result['disp']
+            self.reg.vert = self.b.vert + self.disp.vert
+            self.reg.values = result['values']
         
         
     def point2plane(self, steps = 1, neigh = 10, inside = True, subset = None, 
@@ -63,11 +104,13 @@ class registration(object):
         ----------
         steps: int, default 1
             Number of iterations
-        int, default 10
-            Number of nearest neighbours to interrogate for each baseline point
+        neigh: int, default 10
+            Number of nearest neighbours to interrogate for each baseline point, 
+            if None then each baseline point is registered to the exact closest 
+            point on the target surface, see AmpObject.closest_points
         inside: bool, default True
             If True, a barycentric centre check is made to ensure the registered 
-            point lines within the target triangle
+            point lines within the target triangle. Not used if neigh is None
         subset: array_like, default None
             Indicies of the baseline nodes to include in the registration, default is none so 
             all are used
@@ -84,17 +127,10 @@ class registration(object):
             between the target and baseline mesh
 		
         """
-        # Calc FaceCentroids
-        fC = self.t.vert[self.t.faces].mean(axis=1)
-        # Construct knn tree
-        tTree = spatial.cKDTree(fC)
-        bData = dict(zip(['vert', 'faces', 'values'], 
-                         [self.b.vert, self.b.faces, self.b.values]))
-        regData = copy.deepcopy(bData)
-        self.reg = AmpObject(regData, stype='reg')
-        self.disp = AmpObject({'vert': np.zeros(self.reg.vert.shape),
-                               'faces': self.reg.faces,
-                               'values':self.reg.values})
+        self.reg = self.b.clone()
+        self.reg.stype = 'reg'
+        self.disp = self.reg.clone()
+        self.disp.vert = np.zeros(self.reg.vert.shape, dtype=self.reg.vert.dtype)
         if scale is not None:
             tmin = self.t.vert.min(axis=0)[2]
             rmin = self.reg.vert.min(axis=0)[2]
@@ -109,37 +145,40 @@ class registration(object):
                          self.t.vert[self.t.faces[:,0]])
         mag = (normals**2).sum(axis=1)
         for step in np.arange(steps, 0, -1, dtype=float):
-            # Index of 10 centroids nearest to each baseline vertex
-            ind = tTree.query(self.reg.vert, neigh)[1]
-            # Define normals for faces of nearest faces
-            norms = normals[ind]
-            # Get a point on each face
-            fPoints = self.t.vert[self.t.faces[ind, 0]]
-            # Calculate dot product between point on face and normals
-            d = np.einsum('ijk, ijk->ij', norms, fPoints)
-            t = (d - np.einsum('ijk, ik->ij', norms, self.reg.vert))/mag[ind]
-            # Calculate the vector from old point to new point
-            G = self.reg.vert[:, None, :] + np.einsum('ijk, ij->ijk', norms, t)
-            # Ensure new points lie inside points otherwise set to 99999
-            # Find smallest distance from old to new point 
-            if inside is False:
-                G = G - self.reg.vert[:, None, :]
-                GMag = np.sqrt(np.einsum('ijk, ijk->ij', G, G))
-                GInd = GMag.argmin(axis=1)
+            if neigh is None:
+                # Vector from baseline point to the closest point on the target
+                D = self.t.closest_points(self.reg.vert)[2] - self.reg.vert
             else:
-                G, GInd = self.__calcBarycentric(self.reg.vert, G, ind)
-            # Define vector from baseline point to intersect point
-            D = G[np.arange(len(G)), GInd, :]
+                # Index of 10 centroids nearest to each baseline vertex
+                ind = self.t.queryTree(self.reg.vert, neigh, typ='faces')[1]
+                # Define normals for faces of nearest faces
+                norms = normals[ind]
+                # Get a point on each face
+                fPoints = self.t.vert[self.t.faces[ind, 0]]
+                # Calculate dot product between point on face and normals
+                d = np.einsum('ijk, ijk->ij', norms, fPoints)
+                t = (d - np.einsum('ijk, ik->ij', norms, self.reg.vert))/mag[ind]
+                # Calculate the vector from old point to new point
+                G = self.reg.vert[:, None, :] + np.einsum('ijk, ij->ijk', norms, t)
+                # Ensure new points lie inside points otherwise set to 99999
+                # Find smallest distance from old to new point 
+                if inside is False:
+                    G = G - self.reg.vert[:, None, :]
+                    GMag = np.sqrt(np.einsum('ijk, ijk->ij', G, G))
+                    GInd = GMag.argmin(axis=1)
+                else:
+                    G, GInd = self.__calcBarycentric(self.reg.vert, G, ind)
+                # Define vector from baseline point to intersect point
+                D = G[np.arange(len(G)), GInd, :]
 #            rVert += D/step
             self.disp.vert += D/step
             if smooth > 0 and step > 1:
                 self.disp.lp_smooth(smooth, brim = fixBrim)
-                self.reg.vert = self.b.vert + self.disp.vert
-            else:
-                self.reg.vert = self.b.vert + self.disp.vert
-                self.reg.calcNorm()
+            self.reg.vert = self.b.vert + self.disp.vert
         self.reg.calcStruct(vNorm=True)
-        self.reg.values[:] = self.calcError(error)
+        # Set rather than edited in place so the fingerprint is updated
+        values = self.calcError(error)
+        self.reg.values = values.astype(self.reg.values.dtype, copy=False)
         
     def calcError(self, method='norm'):
         r"""
@@ -207,7 +246,6 @@ class registration(object):
             Magnitude of distances
 
         """
-        self.b.calcVNorm()
         D = self.reg.vert - self.b.vert
         n = self.b.vNorm
         values = np.linalg.norm(D, axis=1)
@@ -284,6 +322,7 @@ class registration(object):
             A matplot figure of the standard analysis
         
         """
+        import matplotlib.pyplot as plt
         fig, ax = plt.subplots(1)
         n, bins, _ = ax.hist(self.reg.values, 50, density=True, range=xrange,
                              color=color, alpha=alpha)
@@ -5,7 +5,6 @@ Copyright: Joshua Steer 2020, Joshua.Steer@soton.ac.uk
 """
 
 import numpy as np
-import copy
 
 class smoothMixin(object):
     
@@ -19,35 +18,18 @@ class smoothMixin(object):
         
         n: int, default 1
             number of iterations of smoothing
+        brim: bool, default True
+            If true, then this will not smooth the vertices on the brim
         
         """
-        if brim is True:
-            eidx = (self.faceEdges == -99999).sum(axis=1).astype(bool)
-            vBrim = np.unique(self.edges[eidx, :])
-        else: vBrim = []
-        # Flatten the edges array to 1D
-        e = self.edges.flatten()
-        # Get the indicies to sort edges 
-        o_idx = e.argsort()
-        # Get indicies of sorted array where last of each vertex index 
-        # occurs 
-        ndx = np.searchsorted(e[o_idx], np.arange(len(self.vert)), 
-                              side='right')
-        ndx = np.r_[0, ndx]
-        # Map indicies between flatted edges array and standard
-        row, col = np.unravel_index(o_idx, self.edges.shape)
+        move = self._smoothVerts(brim)
+        # Degree of each vertex that is moved
+        deg = self.valence[move][:, None]
         for i in np.arange(n):
-            # List all vertices 
-            vert = copy.deepcopy(self.vert)
-            neighVerts = vert[self.edges[row, 1-col], :]
-            vRange = np.arange(self.vert.shape[0])
-            log = np.isin(vRange, vBrim)
-            vRange = vRange[~log]
-            for j in vRange:
-                # Calculate the mean of the vertex set
-                self.vert[j, :] = neighVerts[ndx[j]:ndx[j+1]].mean(axis=0)
-        self.calcNorm()
-        self.calcVNorm()
+            # Calculate the mean of the neighbouring vertices 
+            self.vert[move, :] = self.vertAdj.dot(self.vert)[move, :] / deg
+        # Vertices edited in place so the normals are out of date
+        self.invalidate('geometry')
 
     def hc_smooth(self, n=1 ,beta=0.6, brim=True):
         r"""
@@ -67,43 +49,20 @@ class smoothMixin(object):
             If true, then this will not smooth the vertices on the brim
         
         """
-        if brim is True:
-            eidx = (self.faceEdges == -99999).sum(axis=1).astype(bool)
-            vBrim = np.unique(self.edges[eidx, :])
-        else: vBrim = []
-        # Flatten the edges array to 1D
-        e = self.edges.flatten()
-        # Get the indicies to sort edges 
-        o_idx = e.argsort()
-        # Get indicies of sorted array where last of each vertex index 
-        # occurs 
-        ndx = np.searchsorted(e[o_idx], np.arange(len(self.vert)), 
-                              side='right')
-        ndx = np.r_[0, ndx]
-        # Map indicies between flatted edges array and standard
-        row, col = np.unravel_index(o_idx, self.edges.shape)
+        move = self._smoothVerts(brim)
+        deg = self.valence[move][:, None]
         for i in np.arange(n):
-            # List all vertices 
-            vert = copy.deepcopy(self.vert)
-            neighVerts = vert[self.edges[row, 1-col], :]
-            vRange = np.arange(self.vert.shape[0])
-            log = np.isin(vRange, vBrim)
-            vRange = vRange[~log]
-            for j in vRange:
-                # Get the adjacent vertices
-                adj = neighVerts[ndx[j]:ndx[j+1]]
-                # Get the original vertex
-                q = self.vert[j, :]
-                # calculate new Laplacian location 
-                p = adj.mean(axis=0)
-                # Distance between Laplacian and original 
-                b = p - q
-                # Mean distance adjacent between original 
-                d = (adj - q).mean(axis=0)
-                # Based upon beta, get the updated location 
-                self.vert[j, :] = q + beta*b - (1-beta)*d
-        self.calcNorm()
-        self.calcVNorm()
+            # Get the original vertices
+            q = self.vert[move, :]
+            # calculate new Laplacian location 
+            p = self.vertAdj.dot(self.vert)[move, :] / deg
+            # Distance between Laplacian and original 
+            b = p - q
+            # The mean distance from the original to the adjacent vertices 
+            # is also b, so q + beta*b - (1-beta)*b reduces to
+            self.vert[move, :] = q + (2*beta - 1)*b
+        # Vertices edited in place so the normals are out of date
+        self.invalidate('geometry')
     
     def smoothValues(self, n=1):
         """
@@ -118,20 +77,32 @@ class smoothMixin(object):
             number of iterations of smoothing
         
         """
-        # Flatten the edges array to 1D
-        e = self.edges.flatten()
-        # Get the indicies to sort edges 
-        o_idx = e.argsort()
-        # Get indicies of sorted array where last of each vertex index 
-        # occurs 
-        ndx = np.searchsorted(e[o_idx], np.arange(len(self.values)), 
-                              side='right')
-        ndx = np.r_[0, ndx]
-        # Map indicies between flatted edges array and standard
-        row, col = np.unravel_index(o_idx, self.edges.shape)
+        move = self.valence > 0
+        deg = self.valence[move]
         for i in np.arange(n):
-            neighValues = self.values[self.edges[row, 1-col]]
-            for j in np.arange(self.values.shape[0]):
-                # Calculate mean of values set 
-                self.values[j] = neighValues[ndx[j]:ndx[j+1]].mean()
-            
\ No newline at end of file
+            # Calculate mean of values set 
+            self.values[move] = self.vertAdj.dot(self.values)[move] / deg
+        # Values edited in place so their hash is out of date
+        for name in self._valuesCache:
+            self._cache.pop(name, None)
+
+    def _smoothVerts(self, brim=True):
+        r"""
+        Get the vertices to move when smoothing, vertices without any 
+        neighbours are never moved
+
+        Parameters
+        ----------
+        brim: bool, default True
+            If true, then the vertices on the brim are not moved
+        
+        Returns
+        -------
+        move: ndarray
+            Boolean array which is True for each vertex to smooth
+
+        """
+        move = self.valence > 0
+        if brim is True:
+            move[self.edges[self.brimEdges, :].flatten()] = False
+        return move
@@ -7,7 +7,6 @@ Copyright: Joshua Steer 2020, Joshua.Steer@soton.ac.uk
 import numpy as np
 from numbers import Number
 import os
-from scipy import spatial
 import copy
 
 # Used by doc tests
@@ -60,7 +59,6 @@ class trimMixin(object):
             self.faces = vInd[self.faces]
             self.vert = self.vert[~delv, :]
             self.values = self.values[~delv]
-            self.calcStruct()
         else:
             raise TypeError("height arg must be a float")
 
@@ -123,10 +121,9 @@ class trimMixin(object):
         self.faces = vInd[self.faces]
         self.vert = self.vert[~delv, :]
         self.values = self.values[~delv]
-        self.calcStruct()
     
 
-    def dynamicTrim(self, s, maxdist = 20):
+    def dynamicTrim(self, s, maxdist = 20, exact = False):
         """
         This function trims vertices and faces from the AmpObject. It calculates 
         the distance between the AmpObject mesh centroids and their nearest neighbour 
@@ -142,12 +139,17 @@ class trimMixin(object):
             distance with their nearest neighbour on the s mesh than maxdist
             will be removed, as will the vertices no longer connected to a 
             face afterwards.
+        exact : boolean, default False
+            If True, the distance is measured to the exact closest point on 
+            the surface of the s mesh rather than its nearest vertex, see 
+            AmpObject.closest_points
 
         """
         
-        kdTree = spatial.cKDTree(s.vert)
-        fC = self.vert[self.faces].mean(axis=1)
-        [dist, idx] = kdTree.query(fC,1)
+        if exact is True:
+            dist = s.closest_points(self.faceCent)[3]
+        else:
+            [dist, idx] = s.queryTree(self.faceCent, 1)
         # faceid = np.arange(len(dist))[dist < maxdist]
         # Find the faces with a centroid outside maxdist
         self.faces = self.faces[dist <= maxdist, :]
@@ -159,4 +161,3 @@ class trimMixin(object):
         # Set the vertices and faces 
         self.faces = vInd[self.faces]
         self.vert = self.vert[keepV, :]
-        self.calcStruct()
@@ -1,2 +1,15 @@
-from .vis import vtkRenWin, qtVtkWindow, visMixin, ampActor
-del vis
\ No newline at end of file
+from .mixin import visMixin
+
+# The vtk and Qt classes are only imported when they are first accessed
+_lazy = ('vtkRenWin', 'qtVtkWindow', 'ampActor')
+
+
+def __getattr__(name):
+    if name in _lazy:
+        from . import vis
+        return getattr(vis, name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_lazy))
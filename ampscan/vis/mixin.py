@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+The visualisation methods mixed into the AmpObject. vtk is only imported
+when one of these methods is called, so the AmpObject can be used without a
+display stack
+Copyright: Joshua Steer 2020, Joshua.Steer@soton.ac.uk
+"""
+
+import numpy as np
+
+
+class visMixin(object):
+    r"""
+    Set of visualisation methods that are contained within the AmpActor
+    
+    """
+
+    def genIm(self, size=[512, 512], views=[[0, -1, 0]], 
+              background=[1.0, 1.0, 1.0], projection=True,
+              shading=True, mag=10, out='im', fh='test.tiff', 
+              zoom=1.0, az = 0, el=0,crop=False, cam=None):
+        r"""
+        Creates a temporary off screen vtkRenWin which is then either returned
+        as a numpy array or saved as a .png file
+        
+        Parameters
+        ----------
+        out: str: default 'im'
+            If 'im' the the image will be returned as an array, if 'fh' the 
+            image will be saved as .png image
+        size: array_like, default [512, 512]
+            The width and height of the vtkRenWin to create
+        views: array_like, default [[0, -1, 0],]
+            The camera view set for each viewport, the length of this also
+            sets the number of viewports
+        background: array_like, default [1, 1, 1]
+            The RGB values as floats of the background colour between [0, 1]
+        projection: boolean, default True
+            If true, then perspective will be used as the projection for the
+            camera
+        shading: boolean, default True
+            If true, shading will be used on the ampActor
+        mag: int, default 10
+            The magnification for saving the image
+        fh: str
+            The file handle used if out ='fh'
+        
+        Returns
+        -------
+        im: ndarray
+            The array representation of the image if out = 'im'
+        
+        """
+        from ampscan.vis.vis import vtkRenWin
+        if not hasattr(self, 'actor'):
+            self.addActor()
+        # Generate a renderer window
+        win = vtkRenWin()
+        win.OffScreenRenderingOn()
+        # Set the number of viewports
+        win.setnumViewports(len(views))
+        # Set the background colour
+        win.setBackground(background)
+        # Set camera projection 
+        win.setProjection(projection)
+        win.SetSize(size[0], size[1])
+        win.Modified()
+        win.OffScreenRenderingOn()
+        
+        for i, view in enumerate(views):
+#            win.addAxes([self.actor,], color=[0.0, 0.0, 0.0], viewport=i)
+            win.setView(view, i)
+#            win.setProjection(projection, viewport=i)
+            win.renderActors([self.actor,], zoom=zoom)
+        win.rens[0].GetActiveCamera().Azimuth(az)
+        win.rens[0].GetActiveCamera().Elevation(el)
+        if cam is not None:
+            win.rens[0].SetActiveCamera(cam)
+        win.Render()
+        if out == 'im':
+            im = win.getImage()
+            if crop is True:
+                mask = np.all(im == 1, axis=2)
+                mask = ~np.all(mask, axis=1)
+                im = im[mask, :, :]
+                mask = np.all(im == 1, axis=2)
+                mask = ~np.all(mask, axis=0)
+                im = im[:, mask, :]
+            return im, win
+        elif out == 'fh':
+            win.getScreenshot(fh, mag=mag)
+            return
+        
+    def display(self):
+        r"""
+        Function to display the ampActor within in an interactable 
+        vtkRenWin window
+        
+        Returns
+        -------
+        win: vtkRenWin
+            The generated vtkRenWin
+        
+        """
+        import vtk
+        from ampscan.vis.vis import vtkRenWin
+        if not hasattr(self, 'actor'):
+            self.addActor()
+        # Generate a renderer window
+        win = vtkRenWin()
+        # Set the number of viewports
+        win.setnumViewports(1)
+        # Set the background colour
+        win.setBackground([1,1,1])
+        # Set camera projection 
+        renderWindowInteractor = vtk.vtkRenderWindowInteractor()
+        renderWindowInteractor.SetRenderWindow(win)
+        renderWindowInteractor.SetInteractorStyle(vtk.vtkInteractorStyleTrackballCamera())
+        # Set camera projection 
+        win.setView()
+        win.renderActors([self.actor,])
+        win.Render()
+        win.rens[0].GetActiveCamera().Azimuth(0)
+        win.rens[0].GetActiveCamera().SetParallelProjection(True)
+        win.Render()
+        return win
+
+
+    def addActor(self, CMap=None, bands=128, sRange=[0,8]):
+        r"""
+        Creates an ampActor based upon the ampObject 
+        
+        """
+        from ampscan.vis.vis import ampActor
+        self.actor = ampActor()
+        #self._v = numpy_support.numpy_to_vtk(self.vert, deep=0)
+        self.actor.setVert(self.vert)
+        self.actor.setFaces(self.faces)
+        self.actor.setNorm()
+        # Test if values array is non-zero
+        if self.values.any():
+            self.actor.setValues(self.values)
+            if self.values.min() < 0:
+                self.actor.setCMap(self.CMapN2P, bands)
+                self.actor.setScalarRange([self.values.min(), self.values.max()])
+                self.actor.Mapper.SetLookupTable(self.actor.lut)
+            else: 
+                self.actor.setCMap(self.CMap02P, bands)
+                self.actor.setScalarRange([0, self.values.max()])
+                self.actor.Mapper.SetLookupTable(self.actor.lut)
+
+    def createCMap(self, cmap=None, n = 50):
+        r"""
+        Function to generate a linear colormap for the AmpObj based upon 
+        base colours. By default the AmpObj uses the shared colormaps, see
+        sharedCMap, so this only needs calling to replace them
+        
+        cmap: array_like
+            The rgb float values of the base colors used to generate the 
+            colormap
+        n: int, default 50
+            The number of bands that form the colormap
+
+        """
+        if cmap is None:
+            # Revert to the shared colormaps
+            self.__dict__.pop('_CMapN2P', None)
+            self.__dict__.pop('_CMap02P', None)
+
+    @property
+    def CMapN2P(self):
+        r"""
+        The colormap used for values that range from negative to positive
+        """
+        return self.__dict__.get('_CMapN2P', sharedCMap('N2P'))
+
+    @CMapN2P.setter
+    def CMapN2P(self, CMap):
+        self._CMapN2P = CMap
+
+    @property
+    def CMap02P(self):
+        r"""
+        The colormap used for values that range from zero to positive
+        """
+        return self.__dict__.get('_CMap02P', sharedCMap('02P'))
+
+    @CMap02P.setter
+    def CMap02P(self, CMap):
+        self._CMap02P = CMap
+
+
+# The default colormaps shared by all the AmpObjects, built on first use
+_CMaps = {}
+
+
+def sharedCMap(name):
+    r"""
+    Get one of the default colormaps. These are built once when first
+    requested and are read-only as they are shared between all AmpObjects
+
+    Parameters
+    ----------
+    name: str
+        'N2P' for the negative to positive colormap or '02P' for the zero
+        to positive colormap
+
+    Returns
+    -------
+    CMap: ndarray
+        The rgb float values of the colormap
+
+    Examples
+    --------
+    >>> sharedCMap('N2P').shape
+    (99, 3)
+    >>> sharedCMap('02P') is sharedCMap('02P')
+    True
+
+    """
+    if not _CMaps:
+        c1 = [31.0, 73.0, 125.0]
+        c3 = [170.0, 75.0, 65.0]
+        c2 = [212.0, 221.0, 225.0]
+        CMap1 = np.c_[[np.linspace(st, en) for (st, en) in zip(c1, c2)]]
+        CMap2 = np.c_[[np.linspace(st, en) for (st, en) in zip(c2, c3)]]
+        CMap = np.c_[CMap1[:, :-1], CMap2]
+        CMapN2P = np.transpose(CMap)/255.0
+        CMap02P = np.flip(np.transpose(CMap1)/255.0, axis=0).copy()
+        for CMap in [CMapN2P, CMap02P]:
+            CMap.flags.writeable = False
+        _CMaps['N2P'] = CMapN2P
+        _CMaps['02P'] = CMap02P
+    return _CMaps[name]
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Package for welding the coincident vertices of a mesh
+Copyright: Joshua Steer 2020, Joshua.Steer@soton.ac.uk
+"""
+
+import numpy as np
+from scipy import sparse, spatial
+from scipy.sparse import csgraph
+
+
+def weldVert(vert, tol=None):
+    r"""
+    Weld the coincident vertices of a mesh. For float32 vertices, the x and
+    y co-ordinates are packed into a single integer key so the duplicates
+    are found from one full sort of a one dimensional key rather than the
+    row-wise lexicographic sort of np.unique(axis=0), the z co-ordinate
+    then only reorders vertices that share x and y. The unique vertices are
+    returned in the same order as np.unique(axis=0)
+
+    Parameters
+    ----------
+    vert: ndarray
+        The array of vertices to weld
+    tol: float, default None
+        If None, only vertices with exactly the same co-ordinates are
+        welded. Otherwise, clusters of vertices within tol of each other
+        are merged, see weldTol
+
+    Returns
+    -------
+    vert: ndarray
+        The unique vertices
+    inv: ndarray
+        The index of the unique vertex for each of the input vertices
+
+    Examples
+    --------
+    >>> vert = np.array([[0, 0, 1], [1, 0, 0], [0, 0, 1]], dtype=np.float32)
+    >>> u, inv = weldVert(vert)
+    >>> u
+    array([[0., 0., 1.],
+           [1., 0., 0.]], dtype=float32)
+    >>> inv
+    array([0, 1, 0])
+
+    """
+    vert = np.asarray(vert)
+    if tol is not None:
+        return weldTol(vert, tol)
+    if vert.dtype == np.float32:
+        # Map the bit patterns to unsigned integers with the same order as
+        # the floats and pack x and y into one 64 bit key
+        x, y, z = [sortableBits(vert[:, i]) for i in range(3)]
+        xy = (x.astype(np.uint64) << np.uint64(32)) | y
+        order = np.argsort(xy)
+        xy = xy[order]
+        # Replace the x and y of each vertex with their rank so z fits in the
+        # key, this is already sorted apart from the z of vertices that share
+        # x and y, which the stable sort reorders in close to linear time
+        new = np.zeros(len(xy), dtype=bool)
+        new[1:] = xy[1:] != xy[:-1]
+        key = (np.cumsum(new, dtype=np.uint64) << np.uint64(32)) | z[order]
+        sub = np.argsort(key, kind='stable')
+        order, key = order[sub], key[sub]
+        first = np.ones(len(key), dtype=bool)
+        first[1:] = key[1:] != key[:-1]
+        inv = np.empty(len(vert), dtype=np.int64)
+        inv[order] = np.cumsum(first) - 1
+        return vert[order[first]], inv
+    # Dense rank each axis and combine into an exact integer key
+    rx, nx = rankKey(vert[:, 0])
+    ry, ny = rankKey(vert[:, 1])
+    rz, nz = rankKey(vert[:, 2])
+    rxy, nxy = rankKey(rx * ny + ry)
+    key = rxy * nz + rz
+    _, ind, inv = np.unique(key, return_index=True, return_inverse=True)
+    return vert[ind], inv.reshape(-1)
+
+
+def weldTol(vert, tol):
+    r"""
+    Merge vertices that lie within a tolerance of each other. The pairs of
+    vertices within tol are found using a KD-tree and each connected
+    cluster of vertices is merged into one vertex at its mean position.
+    This is single linkage clustering, so merges are chained, vertices
+    further apart than tol are merged if they are joined by a chain of
+    vertices each within tol of the next, eg a line of vertices spaced
+    less than tol apart is merged into one vertex. The tolerance is meant
+    to absorb rounding errors so should be much smaller than the edges of
+    the mesh, the cost grows with the number of pairs within tol
+
+    Parameters
+    ----------
+    vert: ndarray
+        The array of vertices to weld
+    tol: float
+        The distance below which vertices are merged
+
+    Returns
+    -------
+    vert: ndarray
+        The welded vertices
+    inv: ndarray
+        The index of the welded vertex for each of the input vertices
+
+    """
+    if tol <= 0:
+        raise ValueError("Expected tol to be positive but found: {}".format(tol))
+    # Only pair each distinct position once
+    u, uInv = weldVert(vert)
+    n = len(u)
+    if n < 2 or np.linalg.norm(u.max(axis=0) - u.min(axis=0)) <= tol:
+        # Every vertex is within tol of every other
+        nL, labels = min(n, 1), np.zeros(n, dtype=np.int64)
+    else:
+        tree = spatial.cKDTree(u, balanced_tree=False)
+        pairs = tree.query_pairs(tol, output_type='ndarray')
+        graph = sparse.coo_matrix((np.ones(len(pairs), dtype=bool),
+                                   (pairs[:, 0], pairs[:, 1])), shape=(n, n))
+        nL, labels = csgraph.connected_components(graph, directed=False)
+    lab = labels[uInv]
+    merged = meanByIndex(vert, lab, nL).astype(vert.dtype)
+    # Order the clusters in the same way as the exact weld
+    merged, inv = weldVert(merged)
+    return merged, inv[lab]
+
+
+def sortableBits(a):
+    r"""
+    Reinterpret float32 values as uint32 keys which sort in the same order
+    as the floats, negative zero is mapped to zero
+
+    Parameters
+    ----------
+    a: ndarray
+        The float32 array
+
+    Returns
+    -------
+    bits: ndarray
+        The uint32 keys
+
+    """
+    a = np.ascontiguousarray(a, dtype=np.float32) + np.float32(0.0)
+    bits = a.view(np.uint32)
+    neg = (bits >> np.uint32(31)).astype(bool)
+    return np.where(neg, ~bits, bits | np.uint32(0x80000000))
+
+
+def rankKey(a):
+    r"""
+    Dense rank of the values within a one dimensional array
+
+    Parameters
+    ----------
+    a: ndarray
+        The array to rank
+
+    Returns
+    -------
+    rank: ndarray
+        The rank of each value in the unique sorted values
+    n: int
+        The number of unique values
+
+    """
+    u, inv = np.unique(a, return_inverse=True)
+    return inv.reshape(-1).astype(np.int64), len(u)
+
+
+def meanByIndex(vert, ind, n):
+    r"""
+    The mean position of the vertices sharing each index
+
+    Parameters
+    ----------
+    vert: ndarray
+        The array of vertices
+    ind: ndarray
+        The group index of each vertex
+    n: int
+        The number of groups
+
+    Returns
+    -------
+    mean: ndarray
+        The mean vertex of each group
+
+    """
+    count = np.bincount(ind, minlength=n)
+    total = np.stack([np.bincount(ind, vert[:, i], minlength=n)
+                      for i in range(3)], axis=1)
+    return total / count[:, None]
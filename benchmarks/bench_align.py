@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of multiresolution alignment against alignment at full resolution.
+The test scans are subdivided to give meshes of a realistic size for a
+surface scan and the moving scan is rotated away from the static scan
+
+Run from the root of the repository:
+    python -m benchmarks.bench_align [--levels 3] [--tol 1e-4]
+Copyright: Joshua Steer 2020, Joshua.Steer@soton.ac.uk
+"""
+
+import os
+import time
+import argparse
+from ampscan import AmpObject, align
+from benchmarks.bench_reorder import subdivide, basefh, targfh
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--levels', type=int, default=3,
+                        help='number of subdivisions of the test scans')
+    parser.add_argument('--tol', type=float, default=1e-4,
+                        help='the rmseTol of the alignments')
+    parser.add_argument('--schedule', type=float, nargs='+',
+                        default=[0.01, 0.1],
+                        help='the fractions of the coarse levels')
+    args = parser.parse_args()
+    static = subdivide(AmpObject(basefh), args.levels)
+    moving = subdivide(AmpObject(targfh), args.levels)
+    moving.rotateAng([5, 5, 5], ang='deg')
+    print('Static: {} faces, moving: {} vertices'.format(len(static.faces),
+                                                          len(moving.vert)))
+    # The full resolution queries are threaded, so the speedup depends on 
+    # the number of cpus
+    print('CPUs: {}'.format(os.cpu_count()))
+    # Build the static index before timing
+    static.faceTree
+    runs = [('full', {})] + [(s, {'levels': args.schedule, 'sampling': s})
+                             for s in ['random', 'voxel', 'normal']]
+    print('{:<8}{:>10}{:>8}{:>10}{:>10}'.format('', 'time', 'iters', 'rmse',
+                                                'speedup'))
+    for name, kwargs in runs:
+        t0 = time.perf_counter()
+        al = align(moving, static, maxiter=50, rmseTol=args.tol, **kwargs)
+        t = time.perf_counter() - t0
+        if name == 'full':
+            base = t
+        print('{:<8}{:>9.2f}s{:>8}{:>10.4f}{:>9.2f}x'.format(
+            name, t, len(al.history['rmse']) - 1, al.rmse, base / t))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the time taken to import ampscan in a fresh interpreter, which
+guards against the visualisation and report backends being imported eagerly
+again. The import is timed with python -X importtime and the slowest
+packages are listed. The exit status is non-zero if any of the backends are
+loaded or the import takes longer than the limit
+
+Run from the root of the repository:
+    python -m benchmarks.bench_import [--repeat 5] [--limit 2.0]
+Copyright: Joshua Steer 2020, Joshua.Steer@soton.ac.uk
+"""
+
+import os
+import sys
+import argparse
+import subprocess
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+# The modules that must only be imported when they are first used
+heavy = ['vtk', 'PyQt5', 'matplotlib', 'reportlab', 'PyPDF2']
+code = ("import sys\n"
+        "import ampscan\n"
+        "from ampscan import AmpObject, align, registration, analyse\n"
+        "print(','.join(m for m in {} if m in sys.modules))\n".format(heavy))
+
+
+def importTime():
+    r"""
+    Import ampscan in a new interpreter
+
+    Returns
+    -------
+    loaded: list
+        The heavy modules that were imported
+    total: float
+        The time in seconds to import ampscan and its dependencies
+    times: dict
+        The time in seconds spent importing the modules of each package, 
+        eg numpy
+
+    """
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                         cwd=root, check=True, stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE, universal_newlines=True)
+    loaded = [m for m in out.stdout.strip().split(',') if m]
+    total = 0
+    times = {}
+    for line in out.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        own, cumulative, name = line[12:].split('|')
+        package = name.strip().split('.')[0]
+        times[package] = times.get(package, 0) + int(own) * 1e-6
+        # Nested imports are indented below the module that imported them
+        if name.strip() == 'ampscan' and not name[1:].startswith(' '):
+            total = int(cumulative) * 1e-6
+    return loaded, total, times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of repeats, the best time is reported')
+    parser.add_argument('--limit', type=float, default=2.0,
+                        help='the maximum time in seconds to import ampscan')
+    parser.add_argument('--top', type=int, default=10,
+                        help='number of the slowest packages to list')
+    args = parser.parse_args()
+    runs = [importTime() for _ in range(args.repeat)]
+    loaded = sorted(set(m for r in runs for m in r[0]))
+    [_, total, times] = min(runs, key=lambda r: r[1])
+    print('{:<24}{:>10}'.format('package', 'time'))
+    for name in sorted(times, key=times.get, reverse=True)[:args.top]:
+        print('{:<24}{:>9.3f}s'.format(name, times[name]))
+    print('import ampscan: {:.3f}s'.format(total))
+    failed = []
+    if loaded:
+        failed.append('backends imported eagerly: ' + ', '.join(loaded))
+    if total > args.limit:
+        failed.append('import took {:.3f}s, over the limit of '
+                      '{:.3f}s'.format(total, args.limit))
+    if failed:
+        sys.exit('\n'.join(failed))
+
+
+if __name__ == '__main__':
+    main()
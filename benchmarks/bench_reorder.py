@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the effect of reordering the vertices and faces along a Morton
+curve on the normals, alignment and registration. The test scans are
+subdivided to give meshes of a realistic size for a surface scan
+
+Run from the root of the repository:
+    python -m benchmarks.bench_reorder [--levels 2] [--repeat 3]
+Copyright: Joshua Steer 2020, Joshua.Steer@soton.ac.uk
+"""
+
+import os
+import time
+import argparse
+import numpy as np
+from ampscan import AmpObject, align, registration
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+basefh = os.path.join(root, "tests", "stl_file.stl")
+targfh = os.path.join(root, "tests", "stl_file_2.stl")
+
+
+def subdivide(amp, levels=1):
+    r"""
+    Split each triangle into four using the midpoints of its edges, the
+    vertices are then unified so they are in the order given by unifyVert
+    """
+    for _ in range(levels):
+        v = amp.vert[amp.faces]
+        m = (v + np.roll(v, -1, axis=1)) / 2
+        tri = np.stack([np.stack([v[:, 0], m[:, 0], m[:, 2]], axis=1),
+                        np.stack([m[:, 0], v[:, 1], m[:, 1]], axis=1),
+                        np.stack([m[:, 2], m[:, 1], v[:, 2]], axis=1),
+                        m], axis=1).reshape(-1, 3)
+        amp = AmpObject({'vert': tri.astype(np.float32),
+                         'faces': np.arange(len(tri)).reshape(-1, 3)})
+        amp.unifyVert()
+        amp.values = np.zeros(len(amp.vert))
+    return amp
+
+
+def timeit(func, repeat):
+    r"""
+    The best time of several calls to func
+    """
+    best = np.inf
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def run(base, targ, repeat):
+    r"""
+    Time the operations on a baseline and target mesh
+    """
+    def norms():
+        base.invalidate('geometry')
+        base.calcNorm()
+    results = {}
+    results['calcNorm'] = timeit(norms, repeat)
+    results['align'] = timeit(lambda: align(targ, base, maxiter=10), repeat)
+    results['registration'] = timeit(
+        lambda: registration(base, targ, steps=3, smooth=1), repeat)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--levels', type=int, default=2,
+                        help='number of subdivisions of the test scans')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of repeats, the best time is reported')
+    args = parser.parse_args()
+    base = subdivide(AmpObject(basefh), args.levels)
+    targ = subdivide(AmpObject(targfh), args.levels)
+    print('Baseline: {} vertices, {} faces'.format(len(base.vert), len(base.faces)))
+    before = run(base, targ, args.repeat)
+    base.reorder()
+    targ.reorder()
+    after = run(base, targ, args.repeat)
+    print('{:<14}{:>12}{:>12}{:>10}'.format('', 'unified', 'morton', 'speedup'))
+    for k in before:
+        print('{:<14}{:>11.3f}s{:>11.3f}s{:>9.2f}x'.format(
+            k, before[k], after[k], before[k] / after[k]))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,7 @@ Testing suite for the align module
 """
 
 import unittest
+import numpy as np
 from util import get_path
 from ampscan import align
 
@@ -68,3 +69,134 @@ class TestAlign(unittest.TestCase):
 
         print(al.T)
         print(al_inv.T)
+
+    def test_align_inverse(self):
+        """Test that the inverse alignment returns the static mesh to its place and aligns the moving mesh"""
+        self.amp4.rotateAng([5, 5, 5], ang='deg')
+        self.amp4.translate([1, 2, 3])
+        vert = self.amp4.vert.copy()
+        al = align(self.amp3, self.amp4, inverse=True, maxiter=20)
+        self.assertTrue(np.array_equal(self.amp4.vert, vert))
+        self.assertTrue(np.allclose(al.m.vert, vert, atol=1e-3))
+        moved = np.dot(self.amp3.vert, al.R.T) + al.T
+        self.assertTrue(np.allclose(moved, al.m.vert, atol=1e-4))
+
+    def test_align_converge(self):
+        """Test that ICP stops early once converged and records the history of each iteration"""
+        self.amp4.rotateAng([5, 5, 5], ang='deg')
+        full = align(self.amp3, self.amp4, maxiter=30)
+        self.assertFalse(full.converged)
+        self.assertEqual(len(full.history['rmse']), 31)
+        al = align(self.amp3, self.amp4, maxiter=30, rmseTol=1e-6, tformTol=1e-6)
+        self.assertTrue(al.converged)
+        n = len(al.history['rmse'])
+        self.assertLess(n, 31)
+        self.assertEqual(len(al.history['time']), n)
+        self.assertTrue((al.history['inliers'] == self.amp3.vert.shape[0]).all())
+        self.assertAlmostEqual(al.rmse, full.rmse, delta=1e-4)
+        self.assertTrue(np.allclose(al.tForm, full.tForm, atol=1e-4))
+        # The number of query threads does not change the result
+        single = align(self.amp3, self.amp4, maxiter=30, queryWorkers=1)
+        self.assertTrue(np.array_equal(single.tForm, full.tForm))
+
+    def test_align_multires(self):
+        """Test that a coarse to fine schedule reaches the same alignment as full resolution"""
+        from ampscan.align import samplePoints
+        self.amp4.rotateAng([5, 5, 5], ang='deg')
+        full = align(self.amp3, self.amp4, maxiter=50, rmseTol=1e-5)
+        for sampling in ['random', 'voxel', 'normal']:
+            al = align(self.amp3, self.amp4, maxiter=50, rmseTol=1e-5,
+                       levels=[0.02, 0.1], sampling=sampling)
+            self.assertEqual(list(np.unique(al.history['level'])), [0, 1, 2])
+            self.assertAlmostEqual(al.rmse, full.rmse, delta=1e-3)
+            self.assertTrue(np.allclose(al.tForm, full.tForm, atol=1e-2))
+            ind = samplePoints(self.amp3.vert, 200, sampling, self.amp3.vNorm)
+            self.assertEqual(len(np.unique(ind)), 200)
+        with self.assertRaises(ValueError):
+            samplePoints(self.amp3.vert, 200, 'normal')
+
+    def test_align_inliers(self):
+        """Test that the trimming modes select the closest matches and reject outliers"""
+        np.random.seed(0)
+        dist = np.random.rand(1000)
+        self.assertEqual(align._inliers(dist), slice(None))
+        keep = align._inliers(dist, inlier=0.8)
+        self.assertTrue(np.array_equal(np.sort(keep), np.sort(np.argsort(dist)[:800])))
+        keep = align._inliers(dist, inlier=0.5, maxdist=0.25)
+        self.assertTrue(np.array_equal(np.sort(keep), np.flatnonzero(dist <= 0.25)))
+        with self.assertRaises(ValueError):
+            align._inliers(dist, maxdist=-1)
+        # An artefact far from the static surface is rejected by the MAD
+        self.amp4.rotateAng([5, 5, 5], ang='deg')
+        clean = align(self.amp3, self.amp4, maxiter=30)
+        vert = self.amp3.vert.copy()
+        vert[:300] += [0, 0, 40]
+        self.amp3.vert = vert
+        al = align(self.amp3, self.amp4, maxiter=30, madTol=3)
+        self.assertLess(al.history['inliers'][-1], len(vert) - 300 + 1)
+        self.assertTrue(np.allclose(al.tForm, clean.tForm, atol=0.05))
+        al = align(self.amp3, self.amp4, maxiter=30)
+        self.assertFalse(np.allclose(al.tForm, clean.tForm, atol=0.05))
+
+    def test_align_batch(self):
+        """Test that a batch alignment matches the individual alignments and optionally moves the meshes"""
+        from ampscan.core import AmpObject
+        movings = [AmpObject(get_path("stl_file.stl")) for _ in range(3)]
+        for i, amp in enumerate(movings):
+            amp.rotateAng([2 * i, 0, i], ang='deg')
+        vert = [amp.vert.copy() for amp in movings]
+        res = align.batch(movings, self.amp4, workers=2, maxiter=10)
+        self.assertEqual(res['tForm'].shape, (3, 4, 4))
+        for i, amp in enumerate(movings):
+            self.assertTrue(np.array_equal(amp.vert, vert[i]))
+            al = align(amp, self.amp4, maxiter=10)
+            self.assertTrue(np.allclose(res['tForm'][i], al.tForm))
+            self.assertAlmostEqual(res['rmse'][i], al.rmse)
+        # Only the vertex arrays are transformed, the meshes are not cloned
+        from unittest import mock
+        with mock.patch.object(AmpObject, 'clone', side_effect=AssertionError):
+            res = align.batch(movings, self.amp4, workers=1, maxiter=10)
+            al = align(movings[0], self.amp4, maxiter=10, apply=False)
+        self.assertIs(al.m, movings[0])
+        self.assertTrue(np.array_equal(movings[0].vert, vert[0]))
+        self.assertTrue(np.allclose(res['tForm'][0], al.tForm))
+        align.batch(movings, self.amp4, workers=1, maxiter=10, apply=True)
+        for amp in movings:
+            self.assertTrue(np.allclose(amp.vert, self.amp4.vert, atol=1e-3))
+
+    def test_align_pairwise(self):
+        """Test the all-pairs alignment matrix, its symmetry and resuming from a checkpoint"""
+        import os
+        import tempfile
+        from unittest import mock
+        from ampscan.core import AmpObject, composeTForm
+        amps = [AmpObject(get_path("stl_file.stl")) for _ in range(3)]
+        for i, amp in enumerate(amps):
+            amp.rotateAng([3 * i, i, 0], ang='deg')
+        fh = os.path.join(tempfile.mkdtemp(), 'pairs.npz')
+        res = align.pairwise(amps, workers=2, maxiter=10, checkpoint=fh)
+        self.assertEqual(res['rmse'].shape, (3, 3))
+        self.assertTrue(np.array_equal(np.diag(res['rmse']), np.zeros(3)))
+        for i in range(3):
+            for j in range(i + 1, 3):
+                al = align(amps[i], amps[j], maxiter=10)
+                self.assertTrue(np.allclose(res['tForm'][i, j], al.tForm))
+                self.assertAlmostEqual(res['rmse'][i, j], al.rmse)
+                self.assertTrue(np.allclose(composeTForm(res['tForm'][i, j], res['tForm'][j, i]), np.eye(4)))
+                self.assertAlmostEqual(res['rmse'][j, i], res['rmse'][i, j], delta=0.01)
+        # Only the pairs missing from the checkpoint are aligned
+        with np.load(fh) as data:
+            data = dict(data)
+        data['done'][0, 2] = data['done'][2, 0] = False
+        np.savez(fh, **data)
+        with mock.patch.object(align, 'runICP', autospec=True, side_effect=align.runICP) as run:
+            resumed = align.pairwise(amps, maxiter=10, checkpoint=fh)
+            self.assertEqual(run.call_count, 1)
+        self.assertTrue(np.allclose(resumed['tForm'], res['tForm']))
+        # The cache does not change the parameters of the checkpoint
+        from ampscan.cache import resultCache
+        cached = align.pairwise(amps, maxiter=10, checkpoint=fh,
+                                cache=resultCache(tempfile.mkdtemp()))
+        self.assertTrue(np.array_equal(cached['tForm'], resumed['tForm']))
+        with self.assertRaises(ValueError):
+            align.pairwise(amps, maxiter=5, checkpoint=fh)
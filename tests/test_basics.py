@@ -26,3 +26,19 @@ class TestBasicFunction(unittest.TestCase):
         self.assertEqual(s, "<class 'module'>")
         s = str(type(ampscan.core))
         self.assertEqual(s, "<class 'module'>", "Failed import: ampscan.core")
+
+    def test_headless_import(self):
+        """Test that importing ampscan does not load the visualisation or report
+        backends"""
+        import subprocess
+        import ampscan
+        root = os.path.dirname(os.path.dirname(os.path.abspath(ampscan.__file__)))
+        code = ("import sys\n"
+                "import ampscan\n"
+                "from ampscan import AmpObject, align, registration, analyse\n"
+                "heavy = ['vtk', 'PyQt5', 'matplotlib', 'reportlab', 'PyPDF2']\n"
+                "print(','.join(m for m in heavy if m in sys.modules))\n")
+        out = subprocess.run([sys.executable, "-c", code], cwd=root, check=True,
+                             stdout=subprocess.PIPE,
+                             universal_newlines=True).stdout.split("\n")
+        self.assertEqual(out[0], "", "Heavy modules loaded on import: " + out[0])
@@ -0,0 +1,56 @@
+"""
+Testing suite for the bulk loading module
+"""
+
+import unittest
+import os
+import tempfile
+import numpy as np
+from util import get_path
+from ampscan import load_many
+
+
+class TestBulk(unittest.TestCase):
+
+    def setUp(self):
+        """Runs before each unit test.
+        Sets up a list of stl files and a corrupt copy of "stl_file.stl".
+        """
+        self.paths = [get_path(fh) for fh in ["stl_file.stl", "stl_file_2.stl", "stl_file_4.stl"]]
+        self.tmp = tempfile.TemporaryDirectory()
+        with open(self.paths[0], 'rb') as fh:
+            data = fh.read()
+        self.corrupt = os.path.join(self.tmp.name, "corrupt.stl")
+        with open(self.corrupt, 'wb') as fh:
+            fh.write(data[:-100])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_load_many(self):
+        """Test that loading in parallel gives the same meshes and reports corrupt files"""
+        from ampscan.core import AmpObject
+        paths = self.paths[:2] + [self.corrupt, self.paths[2], get_path("missing.stl")]
+        for workers in [1, 2]:
+            amps, errors = load_many(paths, workers=workers)
+            self.assertEqual(len(amps), len(paths))
+            self.assertIsNone(amps[2])
+            self.assertIsNone(amps[4])
+            self.assertEqual(set(errors), {2, 4})
+            self.assertIn("corrupt", str(errors[2]))
+            for amp, path in zip([amps[0], amps[1], amps[3]], self.paths):
+                ref = AmpObject(path)
+                for k in ['vert', 'faces', 'edges', 'faceEdges']:
+                    self.assertTrue(np.array_equal(getattr(amp, k), getattr(ref, k)))
+            # Repeated paths are each loaded into their own AmpObject
+            amps, errors = load_many([self.paths[0], self.paths[1], self.paths[0]],
+                                     workers=workers)
+            self.assertEqual(errors, {})
+            self.assertIsNot(amps[0], amps[2])
+            self.assertTrue(np.array_equal(amps[0].vert, amps[2].vert))
+            # Including repeated paths that fail
+            amps, errors = load_many([self.corrupt, self.paths[0], self.corrupt],
+                                     workers=workers)
+            self.assertEqual(set(errors), {0, 2})
+            self.assertIsNot(errors[0], errors[2])
+            self.assertEqual([amp is None for amp in amps], [True, False, True])
@@ -0,0 +1,98 @@
+"""
+Testing suite for the bvh module
+"""
+
+import unittest
+import numpy as np
+from util import get_path
+from ampscan.bvh import triBVH, closestPointTriangle
+
+
+class TestBVH(unittest.TestCase):
+
+    def setUp(self):
+        """Runs before each unit test.
+        Sets up the AmpObject object using "stl_file.stl".
+        """
+        from ampscan.core import AmpObject
+        stl_path = get_path("stl_file.stl")
+        self.amp = AmpObject(stl_path)
+
+    def test_closest_points(self):
+        """Test that the closest points match a brute force search over every face"""
+        np.random.seed(0)
+        pts = self.amp.vert[::100] + np.random.normal(0, 5, [len(self.amp.vert[::100]), 3])
+        face, bary, point, dist = self.amp.closest_points(pts)
+        tri = self.amp.vert[self.amp.faces].astype(np.float64)
+        for i, p in enumerate(pts):
+            q = closestPointTriangle(np.repeat(p[None, :], len(tri), axis=0),
+                                     tri[:, 0], tri[:, 1], tri[:, 2])[1]
+            self.assertAlmostEqual(dist[i], np.linalg.norm(q - p, axis=1).min())
+        self.assertTrue(np.allclose(np.linalg.norm(point - pts, axis=1), dist))
+        self.assertTrue(np.allclose((bary[:, :, None] * tri[face]).sum(axis=1), point))
+        # The queries follow rigid transformations without a rebuild
+        bvh = self.amp.faceBVH
+        self.amp.rotateAng([10, 0, 30], ang='deg')
+        self.amp.translate([5, -2, 1])
+        R, T = self.amp.transform_matrix[:3, :3], self.amp.transform_matrix[3, :3]
+        tdist = self.amp.closest_points(np.dot(pts, R.T) + T)[3]
+        self.assertIs(self.amp.faceBVH, bvh)
+        self.assertTrue(np.allclose(tdist, dist))
+
+    def test_pruning(self):
+        """Test that points inside a cylinder of long thin triangles, far from any vertex, visit few leaves"""
+        from unittest import mock
+        k = 200
+        th = np.linspace(0, 2*np.pi, k, endpoint=False)
+        ring = np.c_[np.cos(th), np.sin(th), np.zeros(k)]
+        vert = np.r_[ring, ring + [0, 0, 100]]
+        i = np.arange(k)
+        j = (i + 1) % k
+        bvh = triBVH(vert, np.r_[np.c_[i, j, i+k], np.c_[j, j+k, i+k]])
+        th = np.random.RandomState(0).uniform(0, 2*np.pi, 100)
+        pts = np.c_[0.9*np.cos(th), 0.9*np.sin(th), np.linspace(10, 90, 100)]
+        with mock.patch.object(triBVH, '_leafSearch', autospec=True,
+                               side_effect=triBVH._leafSearch) as leafSearch:
+            dist = bvh.query(pts)[3]
+        self.assertTrue(np.allclose(dist, 0.1, atol=1e-3))
+        # The nearest vertex is at least 10 away, so alone it prunes no leaves
+        self.assertLess(len(leafSearch.call_args[0][2]), 16 * len(pts))
+
+    def test_signed(self):
+        """Test the sign of the distance inside and outside of closed meshes, including a cube"""
+        from ampscan.core import AmpObject
+        for fh in ["stl_file_4.stl", "stl_file_6.stl"]:
+            amp = AmpObject(get_path(fh))
+            c = amp.vert.mean(axis=0)
+            # Points near the vertices and faces test the pseudo-normals
+            for pts in [amp.vert, amp.faceCent]:
+                dist = amp.closest_points(c + (pts - c) * 1.05, signed=True)[3]
+                self.assertTrue((dist > 0).all())
+                dist = amp.closest_points(c + (pts - c) * 0.95, signed=True)[3]
+                self.assertTrue((dist < 0).all())
+            # The pseudo-normals are cached and rotated with the mesh
+            vNormAngle = amp.vNormAngle
+            amp.rotateAng([0, 90, 0], ang='deg')
+            c = amp.vert.mean(axis=0)
+            dist = amp.closest_points(c + (amp.vert - c) * 0.95, signed=True)[3]
+            self.assertTrue((dist < 0).all())
+            self.assertIsNot(amp.vNormAngle, vNormAngle)
+            self.assertFalse(amp.isStale('vNormAngle', 'edgeNorm'))
+        # Open meshes have edges with a single face
+        dist = self.amp.closest_points(self.amp.vert[:10], signed=True)[3]
+        self.assertTrue(np.allclose(dist, 0))
+
+    def test_degenerate(self):
+        """Test that degenerate triangles are treated as their longest edge and padding leaves are skipped"""
+        p = np.array([[1.5, 0, 1]] * 3)
+        a = np.array([[1, 0, 0], [2, 0, 0], [1, 1, 1]], dtype=float)
+        b = np.array([[0, 0, 0], [2, 0, 0], [1, 1, 1]], dtype=float)
+        c = np.array([[2, 0, 0], [0, 0, 0], [1, 1, 1]], dtype=float)
+        bary, q = closestPointTriangle(p, a, b, c)
+        self.assertTrue(np.allclose(q, [[1.5, 0, 0], [1.5, 0, 0], [1, 1, 1]]))
+        self.assertTrue(np.allclose(bary.sum(axis=1), 1))
+        vert = np.array([[0, 0, 0], [1, 0, 0], [2, 0, 0], [0, 1, 0]], dtype=float)
+        bvh = triBVH(vert, np.array([[0, 1, 2], [0, 1, 3]]), leafSize=1)
+        face, bary, point, dist = bvh.query(np.array([[2.0, 0, 1], [0.2, 0.2, -1]]))
+        self.assertTrue(np.allclose(dist, [1, 1]))
+        self.assertEqual(face[1], 1)
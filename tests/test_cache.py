@@ -0,0 +1,89 @@
+"""
+Testing suite for the result cache module
+"""
+
+import unittest
+import os
+import tempfile
+import numpy as np
+from unittest import mock
+from util import get_path
+from ampscan import align, registration
+from ampscan.cache import resultCache
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        """Runs before each unit test.
+        Sets up AmpObject objects using "stl_file.stl" and "stl_file_2.stl" and an empty cache.
+        """
+        from ampscan.core import AmpObject
+        self.amp1 = AmpObject(get_path("stl_file.stl"))
+        self.amp2 = AmpObject(get_path("stl_file_2.stl"))
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = resultCache(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_cache_align(self):
+        """Test that a cached alignment is returned without recalculating"""
+        al = align(self.amp2, self.amp1, maxiter=5, cache=self.cache)
+        with mock.patch.object(align, 'runICP', autospec=True, side_effect=AssertionError):
+            hit = align(self.amp2, self.amp1, maxiter=5, cache=self.cache)
+            # The number of query threads is not part of the key
+            align(self.amp2, self.amp1, maxiter=5, queryWorkers=1, cache=self.cache)
+        self.assertTrue(np.allclose(hit.tForm, al.tForm))
+        self.assertAlmostEqual(hit.rmse, al.rmse)
+        self.assertTrue(np.allclose(hit.m.vert, al.m.vert, atol=1e-4))
+        self.assertTrue(np.array_equal(hit.history['rmse'], al.history['rmse']))
+        # Changing the parameters or the meshes misses the cache
+        with mock.patch.object(align, 'runICP', autospec=True, side_effect=KeyError) as run:
+            for kwargs in [{'maxiter': 6}, {'maxiter': 5, 'inlier': 0.9}]:
+                with self.assertRaises(KeyError):
+                    align(self.amp2, self.amp1, cache=self.cache, **kwargs)
+            self.amp2.translate([0, 0, 1])
+            with self.assertRaises(KeyError):
+                align(self.amp2, self.amp1, maxiter=5, cache=self.cache)
+            self.assertEqual(run.call_count, 3)
+        # The inverse alignment is cached under its own key
+        inv = align(self.amp2, self.amp1, maxiter=5, inverse=True, cache=self.cache)
+        self.assertFalse(np.allclose(inv.tForm, al.tForm))
+        with mock.patch.object(align, 'runICP', autospec=True, side_effect=AssertionError):
+            hit = align(self.amp2, self.amp1, maxiter=5, inverse=True, cache=self.cache)
+        self.assertTrue(np.allclose(hit.tForm, inv.tForm))
+        self.assertTrue(np.allclose(hit.m.vert, inv.m.vert, atol=1e-4))
+
+    def test_cache_registration(self):
+        """Test that a cached registration is returned without recalculating"""
+        reg = registration(self.amp1, self.amp2, steps=2, smooth=1, cache=self.cache)
+        with mock.patch.object(registration, 'point2plane', autospec=True, side_effect=AssertionError):
+            hit = registration(self.amp1, self.amp2, steps=2, smooth=1, cache=self.cache)
+        self.assertTrue(np.array_equal(hit.reg.vert, reg.reg.vert))
+        self.assertTrue(np.array_equal(hit.reg.values, reg.reg.values))
+
+    def test_cache_evict(self):
+        """Test that the least recently used results are evicted"""
+        keys = [self.cache.key('test', self.amp1, n=i) for i in range(3)]
+        for i, key in enumerate(keys):
+            self.cache.put(key, a=np.random.rand(1000))
+            t = 1000000000 + i
+            os.utime(self.cache._path(key), (t, t))
+        # Using the first result means the second is the least recent
+        self.assertIsNotNone(self.cache.get(keys[0]))
+        size = [os.path.getsize(self.cache._path(key)) for key in keys]
+        self.cache.evict(size[0] + size[2])
+        self.assertIsNotNone(self.cache.get(keys[0]))
+        self.assertIsNone(self.cache.get(keys[1]))
+        self.assertIsNotNone(self.cache.get(keys[2]))
+        self.cache.clear()
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+    def test_cache_key(self):
+        """Test that keys depend on the parameters and reject those that cannot be serialised"""
+        key = self.cache.key('test', self.amp1, a=np.arange(3), b=np.float32(1))
+        self.assertEqual(key, self.cache.key('test', self.amp1, b=np.float32(1), a=np.arange(3)))
+        self.assertNotEqual(key, self.cache.key('test', self.amp1, a=np.arange(3.0), b=1.0))
+        with self.assertRaises(TypeError):
+            self.cache.key('test', self.amp1, a=object())
@@ -3,6 +3,7 @@ Testing suite for the core module
 """
 
 import unittest
+import os
 import numpy as np
 from random import randrange
 from util import get_path
@@ -20,6 +21,167 @@ class TestCore(unittest.TestCase):
         stl_path = get_path("stl_file.stl")
         self.amp = AmpObject(stl_path)
 
+    def test_read_mmap(self):
+        """Test that memory-mapped reading gives the same mesh as the standard reader"""
+        from ampscan.core import AmpObject
+        amp = AmpObject(get_path("stl_file.stl"), mmap=True)
+        self.assertTrue(np.array_equal(amp.vert, self.amp.vert))
+        self.assertTrue(np.array_equal(amp.faces, self.amp.faces))
+        self.assertTrue(np.array_equal(amp.edges, self.amp.edges))
+
+        # Check a truncated file is reported as corrupt
+        with open(get_path("stl_file.stl"), 'rb') as fh:
+            data = fh.read()
+        with self.assertRaises(ValueError):
+            AmpObject().read_bytes(data[:-10])
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            fh = os.path.join(tmp, "truncated.stl")
+            with open(fh, 'wb') as f:
+                f.write(data[:-10])
+            for mmap in [False, True]:
+                with self.assertRaisesRegex(ValueError, "corrupt"):
+                    AmpObject(fh, mmap=mmap)
+            # A file without faces is reported the same way in every mode
+            with open(fh, 'wb') as f:
+                f.write(data[:80] + np.int32(0).tobytes())
+            for mmap in [False, True]:
+                with self.assertRaisesRegex(ValueError, "no faces"):
+                    AmpObject(fh, mmap=mmap)
+
+    def test_read_ascii(self):
+        """Test that ASCII files are read and binary files with a 'solid' header are not treated as ASCII"""
+        from ampscan.core import AmpObject
+        amp = AmpObject(get_path(os.path.join("ascii_examples", "sample_stl_sphere_ASCII.stl")))
+        self.assertEqual(amp.vert.shape, (642, 3))
+        self.assertEqual(amp.faces.shape, (1280, 3))
+        # The ASCII sample is a unit sphere
+        self.assertAlmostEqual(np.linalg.norm(amp.vert, axis=1).max(), 1.0, TestCore.ACCURACY)
+
+        # Binary file with a header starting with solid
+        with open(get_path("stl_file.stl"), 'rb') as fh:
+            data = bytearray(fh.read())
+        data[:5] = b'solid'
+        amp = AmpObject(bytes(data))
+        self.assertTrue(np.array_equal(amp.vert, self.amp.vert))
+
+    def test_topology(self):
+        """Test the connectivity arrays from calcTopology are consistent"""
+        amp = self.amp
+        amp.planarTrim(amp.vert[:, 2].mean())
+        # Each edge of each face maps to an edge with the same vertices
+        fEdges = np.sort(amp.faces[:, [0, 1, 0, 2, 1, 2]].reshape(-1, 3, 2), axis=2)
+        self.assertTrue(np.array_equal(amp.edges[amp.edgesFace], fEdges))
+        # Each face on an edge has that edge
+        for i in range(2):
+            valid = amp.faceEdges[:, i] != -99999
+            eInd = np.arange(len(amp.edges))[valid]
+            self.assertTrue((amp.edgesFace[amp.faceEdges[valid, i]] == eInd[:, None]).any(axis=1).all())
+        # Trimmed mesh has a brim and all edges are attached to two vertices
+        self.assertTrue(amp.brimEdges.any())
+        self.assertTrue(np.array_equal(amp.brimEdges, amp.faceEdges[:, 1] == -99999))
+        self.assertEqual(amp.valence.sum(), 2 * len(amp.edges))
+
+    def test_lazy_struct(self):
+        """Test that derived arrays are only calculated when stale"""
+        from ampscan.core import AmpObject
+        amp = AmpObject(get_path("stl_file.stl"), struc=False)
+        self.assertTrue(amp.isStale('norm', 'edges', 'vNorm'))
+        # Accessing computes and caches the arrays
+        self.assertTrue(np.array_equal(amp.edges, self.amp.edges))
+        edges, norm = amp.edges, amp.norm
+        amp.calcStruct()
+        self.assertIs(amp.edges, edges)
+        self.assertIs(amp.norm, norm)
+
+        # Translating keeps all the derived arrays
+        amp.translate([1, 0, 0])
+        self.assertIs(amp.norm, norm)
+        # Rotating only updates the normals
+        amp.rotateAng([0, 0, np.pi/2])
+        self.assertIs(amp.edges, edges)
+        amp.calcNorm()
+        self.assertTrue(np.allclose(amp.norm, np.dot(norm, amp.rotMatrix([0, 0, np.pi/2]).T), atol=1e-5))
+        # Setting vertices invalidates geometry, faces invalidates all
+        amp.vert = amp.vert * 2
+        self.assertTrue(amp.isStale('norm'))
+        self.assertFalse(amp.isStale('edges'))
+        amp.planarTrim(amp.vert[:, 2].mean())
+        self.assertTrue(amp.isStale('edges', 'faceEdges'))
+        self.assertTrue(amp.brimEdges.any())
+
+        with self.assertRaises(ValueError):
+            amp.invalidate('vertices')
+
+    def test_vnorm(self):
+        """Test the vertex normals against the mean of the connected face normals"""
+        amp = self.amp
+        for i in np.random.randint(0, len(amp.vert), 20):
+            fInd = (amp.faces == i).any(axis=1)
+            self.assertTrue(np.allclose(amp.vNorm[i], amp.norm[fInd].mean(axis=0)))
+        # Weighted normals point in the same direction on a smooth surface
+        uniform = amp.vNorm.copy()
+        for weight in ['area', 'angle']:
+            amp.calcVNorm(weight)
+            cos = np.einsum('ij, ij->i', uniform, amp.vNorm)
+            cos /= np.linalg.norm(uniform, axis=1) * np.linalg.norm(amp.vNorm, axis=1)
+            self.assertGreater(np.median(cos), 0.99)
+        with self.assertRaises(ValueError):
+            amp.calcVNorm('volume')
+        # The weighting is kept when the normals are recalculated
+        angle = amp.vNorm.copy()
+        amp.vert = amp.vert
+        self.assertTrue(amp.isStale('vNorm'))
+        self.assertTrue(np.allclose(amp.vNorm, angle, equal_nan=True))
+        reg = amp.clone()
+        reg.vert = reg.vert
+        self.assertTrue(np.allclose(reg.vNorm, angle, equal_nan=True))
+        amp.calcVNorm('uniform')
+        self.assertTrue(np.allclose(amp.vNorm, uniform, equal_nan=True))
+
+    def test_fix_norm(self):
+        """Test that fixNorm restores consistent outward winding on each connected region"""
+        from ampscan.core import AmpObject
+        orig = self.amp.faces.copy()
+        np.random.seed(0)
+        flip = np.random.rand(len(orig)) < 0.5
+        faces = orig.copy()
+        faces[flip] = faces[flip][:, [0, 2, 1]]
+        self.amp.faces = faces
+        self.amp.fixNorm()
+        self.assertTrue(np.array_equal(self.amp.faces, orig))
+
+        # Two spheres, with the second one inside out
+        amp1 = AmpObject(get_path("stl_file_4.stl"))
+        amp2 = AmpObject(get_path("stl_file_5.stl"))
+        nV = len(amp1.vert)
+        amp = AmpObject({'vert': np.r_[amp1.vert, amp2.vert + 5],
+                         'faces': np.r_[amp1.faces, amp2.faces[:, [0, 2, 1]] + nV],
+                         'values': np.zeros(nV + len(amp2.vert))})
+        amp.fixNorm()
+        self.assertTrue(np.array_equal(amp.faces, np.r_[amp1.faces, amp2.faces + nV]))
+
+    def test_save_amp(self):
+        """Test that saving and loading a .amp file restores the mesh and cached structure"""
+        import tempfile
+        from ampscan.core import AmpObject
+        self.amp.values[:] = np.random.rand(len(self.amp.values))
+        with tempfile.TemporaryDirectory() as tmp:
+            fh = os.path.join(tmp, "test.amp")
+            self.amp.save_amp(fh)
+            for mmap in [False, True]:
+                amp = AmpObject(fh, mmap=mmap)
+                self.assertEqual(amp.stype, self.amp.stype)
+                # Nothing is recalculated on loading
+                self.assertFalse(amp.isStale('norm', 'vNorm', 'edges', 'edgesFace', 'faceEdges'))
+                for k in ['vert', 'faces', 'values', 'edges', 'edgesFace', 'faceEdges', 'norm', 'vNorm']:
+                    self.assertTrue(np.array_equal(getattr(amp, k), getattr(self.amp, k)))
+                # Changes are not written back to the file
+                amp.translate([1, 0, 0])
+                del amp
+            amp = AmpObject(fh)
+            self.assertTrue(np.array_equal(amp.vert, self.amp.vert))
+
     def test_centre(self):
         """Test the centre method of AmpObject"""
 
@@ -184,3 +346,210 @@ class TestCore(unittest.TestCase):
         with self.assertRaises(ValueError):
             self.amp.flip(3)
 
+
+    def test_shared_cmap(self):
+        """Tests that the colormaps are shared and read-only until replaced"""
+        from ampscan.core import AmpObject
+        amp = AmpObject(get_path("stl_file_4.stl"))
+        self.assertNotIn("_CMapN2P", amp.__dict__)
+        self.assertIs(amp.CMapN2P, self.amp.CMapN2P)
+        self.assertEqual(amp.CMap02P.shape, (50, 3))
+        with self.assertRaises(ValueError):
+            amp.CMapN2P[0, 0] = 0
+        # Replacing the colormap only affects this object
+        amp.CMapN2P = np.zeros([10, 3])
+        self.assertEqual(self.amp.CMapN2P.shape, (99, 3))
+        amp.createCMap()
+        self.assertIs(amp.CMapN2P, self.amp.CMapN2P)
+
+    def test_clone(self):
+        """Tests that clones share the topology but not the geometry"""
+        edges = self.amp.edges
+        vertAdj = self.amp.vertAdj
+        reg = self.amp.clone()
+        self.assertTrue(np.shares_memory(reg.faces, self.amp.faces))
+        self.assertTrue(np.shares_memory(reg.edges, edges))
+        self.assertIs(reg.vertAdj, vertAdj)
+        # The shared arrays cannot be edited through the clone, the source 
+        # is left writable
+        with self.assertRaises(ValueError):
+            reg.faces[0, 0] = 0
+        with self.assertRaises(ValueError):
+            reg.edges[0, 0] = 0
+        self.assertTrue(self.amp.faces.flags.writeable)
+        self.assertTrue(self.amp.edges.flags.writeable)
+        # The geometry is independent
+        vert = self.amp.vert.copy()
+        reg.vert[:, 2] += 1.0
+        reg.values[:] = 1.0
+        self.assertTrue(np.array_equal(self.amp.vert, vert))
+        self.assertFalse(self.amp.values.any())
+        # Setting the faces on the clone does not affect the source
+        reg.flip(0)
+        reg.faces = reg.faces[:, [0, 2, 1]]
+        self.assertFalse(self.amp.isStale('edges'))
+        self.assertTrue(np.shares_memory(self.amp.edges, edges))
+        copied = self.amp.clone(share_topology=False)
+        self.assertFalse(np.shares_memory(copied.edges, edges))
+        self.assertTrue(np.array_equal(copied.faceEdges, self.amp.faceEdges))
+
+    def test_defer_transform(self):
+        """Tests that deferred transformations match those applied immediately"""
+        from ampscan.core import AmpObject
+        amp = AmpObject(get_path("stl_file.stl"), deferTransform=True)
+        norm = amp.norm
+        vert = amp._vert.copy()
+        for a in [amp, self.amp]:
+            a.translate([1.0, -2.0, 3.0])
+            a.rotateAng([10, 20, 30], ang='deg')
+            a.rigidTransform(T=[0.0, 0.0, -5.0])
+        # The vertices are not changed until they are read
+        self.assertTrue(np.array_equal(amp._vert, vert))
+        self.assertIsNot(amp.norm, norm)
+        self.assertTrue(np.allclose(amp.vert, self.amp.vert, atol=1e-4))
+        self.assertTrue(np.allclose(amp.norm, self.amp.norm, atol=1e-5))
+        self.assertTrue(np.allclose(amp.transform_matrix, self.amp.transform_matrix))
+        # Replay the pose on the original vertices
+        replay = AmpObject({'vert': vert, 'faces': amp.faces})
+        replay.matrixTransform(amp.transform_matrix)
+        self.assertTrue(np.allclose(replay.vert, amp.vert, atol=1e-4))
+        # Setting the vertices resets the pose
+        amp.vert = vert
+        self.assertTrue(np.array_equal(amp.transform_matrix, np.eye(4)))
+        with self.assertRaises(ValueError):
+            amp.matrixTransform(np.eye(3))
+
+    def test_fingerprint(self):
+        """Tests that the fingerprint changes with the mesh and is saved in .amp files"""
+        import tempfile
+        from ampscan.core import AmpObject
+        fp = self.amp.fingerprint()
+        self.assertEqual(fp, AmpObject(get_path("stl_file.stl")).fingerprint())
+        self.assertNotEqual(fp, AmpObject(get_path("stl_file_2.stl")).fingerprint())
+        # Changes to the vertices, faces and values are all detected
+        reg = self.amp.clone()
+        reg.values[0] = 1.0
+        reg.invalidate('geometry')
+        self.assertNotEqual(reg.fingerprint(), fp)
+        reg = self.amp.clone(share_topology=False)
+        reg.vert[0, 0] += 1.0
+        reg.invalidate('geometry')
+        self.assertNotEqual(reg.fingerprint(), fp)
+        # The hash is cached until the mesh is changed
+        amp = self.amp.clone()
+        self.assertEqual(amp.fingerprint(), fp)
+        self.assertFalse(amp.isStale('fingerprint', 'vertHash', 'facesHash'))
+        amp.translate([0, 0, 1])
+        self.assertTrue(amp.isStale('fingerprint', 'vertHash'))
+        self.assertFalse(amp.isStale('facesHash'))
+        self.assertNotEqual(amp.fingerprint(), fp)
+        amp.translate([0, 0, -1])
+        amp.values = np.ones(len(amp.values))
+        self.assertTrue(amp.isStale('fingerprint', 'valuesHash'))
+        amp.smoothValues(1)
+        self.assertTrue(amp.isStale('fingerprint'))
+        reg = self.amp.clone()
+        reg.faces = reg.faces[:, [1, 2, 0]]
+        self.assertNotEqual(reg.fingerprint(), fp)
+        with tempfile.TemporaryDirectory() as tmp:
+            fh = os.path.join(tmp, "test.amp")
+            self.amp.save_amp(fh)
+            amp = AmpObject(fh)
+            # The saved fingerprint is restored without rehashing
+            self.assertFalse(amp.isStale('fingerprint'))
+            self.assertTrue(amp.isStale('vertHash'))
+            self.assertEqual(amp.fingerprint(), fp)
+            amp.invalidate()
+            self.assertEqual(amp.fingerprint(), fp)
+            # Vertices cast on loading are hashed as they are held
+            amp = AmpObject(fh, dtype=np.float64)
+            fp64 = amp.fingerprint()
+            amp.invalidate()
+            self.assertEqual(amp.fingerprint(), fp64)
+            self.assertNotEqual(fp64, fp)
+
+    def test_dtype(self):
+        """Tests the floating point type policy of the AmpObject"""
+        from ampscan.core import AmpObject, setDefaultDtype
+        data = {'vert': self.amp.vert.astype(np.float64), 'faces': self.amp.faces}
+        self.assertEqual(AmpObject(data).norm.dtype, np.float64)
+        amp = AmpObject(data, dtype=np.float32)
+        self.assertEqual(amp.vert.dtype, np.float32)
+        self.assertEqual(amp.norm.dtype, np.float32)
+        self.assertEqual(amp.vNorm.dtype, np.float32)
+        amp.rotateAng([0, 0, 1])
+        self.assertEqual(amp.norm.dtype, np.float32)
+        setDefaultDtype(np.float32)
+        try:
+            self.assertEqual(AmpObject(data).vert.dtype, np.float32)
+            self.assertEqual(AmpObject(data, dtype=np.float64).vert.dtype, np.float64)
+        finally:
+            setDefaultDtype(None)
+        with self.assertRaises(TypeError):
+            AmpObject(data, dtype=int)
+
+    def test_reorder(self):
+        """Tests that reordering keeps the mesh and can be mapped back"""
+        from ampscan.core import AmpObject
+        vert = self.amp.vert.copy()
+        tri = np.sort(vert[self.amp.faces].reshape(-1, 9), axis=0)
+        self.amp.values[:] = np.arange(len(vert))
+        self.amp.reorder()
+        self.assertFalse(np.array_equal(self.amp.vert, vert))
+        # The same triangles make up the mesh
+        self.assertTrue(np.array_equal(np.sort(self.amp.vert[self.amp.faces].reshape(-1, 9), axis=0), tri))
+        self.assertTrue(np.array_equal(self.amp.vert, vert[self.amp.vertPerm]))
+        self.assertTrue(np.array_equal(self.amp.originalOrder(self.amp.values), np.arange(len(vert))))
+        # Reordering twice composes the permutations
+        self.amp.reorder(bits=4)
+        self.assertTrue(np.array_equal(self.amp.originalOrder(self.amp.vert), vert))
+        norm = self.amp.originalOrder(self.amp.norm, typ='faces')
+        self.assertTrue(np.allclose(norm, AmpObject(get_path("stl_file.stl")).norm, equal_nan=True))
+        with self.assertRaises(ValueError):
+            self.amp.reorder(bits=22)
+        # The pose is kept
+        self.amp.translate([1, 0, 0])
+        self.amp.reorder()
+        self.assertTrue(np.allclose(self.amp.transform_matrix[3, :3], [1, 0, 0]))
+        self.assertTrue(np.allclose(self.amp.originalOrder(self.amp.vert), vert + [1, 0, 0]))
+        # A permutation that no longer matches the mesh is an error
+        self.amp.vertPerm = self.amp.vertPerm[:-1]
+        with self.assertRaises(ValueError):
+            self.amp.reorder()
+        with self.assertRaises(ValueError):
+            self.amp.originalOrder(self.amp.vert)
+
+    def test_reorder_save(self):
+        """Tests that a reordered mesh can be mapped back after saving as a .amp file"""
+        import tempfile
+        from ampscan.core import AmpObject
+        vert = self.amp.vert.copy()
+        self.amp.reorder()
+        with tempfile.TemporaryDirectory() as tmp:
+            fh = os.path.join(tmp, "test.amp")
+            self.amp.save_amp(fh)
+            amp = AmpObject(fh)
+        self.assertTrue(np.array_equal(amp.originalOrder(amp.vert), vert))
+        self.assertTrue(np.array_equal(amp.facePerm, self.amp.facePerm))
+
+    def test_tree(self):
+        """Tests that the cached trees follow rigid transformations without being rebuilt"""
+        from scipy import spatial
+        pts = self.amp.vert[::50] + 0.5
+        tree = self.amp.faceTree
+        self.amp.rotateAng([10, 0, 30], ang='deg')
+        self.amp.translate([5, -2, 1])
+        R, T = self.amp.transform_matrix[:3, :3], self.amp.transform_matrix[3, :3]
+        pts = np.dot(pts, R.T) + T
+        dist, idx = self.amp.queryTree(pts, 3, typ='faces')
+        self.assertIs(self.amp.faceTree, tree)
+        fC = self.amp.vert[self.amp.faces].mean(axis=1)
+        self.assertTrue(np.allclose(self.amp.faceCent, fC, atol=1e-4))
+        rdist, ridx = spatial.cKDTree(fC).query(pts, 3)
+        self.assertTrue(np.array_equal(idx, ridx))
+        self.assertTrue(np.allclose(dist, rdist, atol=1e-4))
+        # Editing the geometry rebuilds the tree
+        self.amp.vert = self.amp.vert * 2
+        self.assertIsNot(self.amp.faceTree, tree)
+        dist, idx = self.amp.queryTree(self.amp.vert[:10])
+        self.assertTrue(np.array_equal(idx, np.arange(10)))
@@ -60,3 +60,15 @@ class TestRegistration(unittest.TestCase):
         diameter = reg.vert[:, 2].max() - reg.vert[:, 2].min()
         self.assertAlmostEqual(diameter, 2, delta=TestRegistration.DELTA)
 
+
+    def test_registration_float32(self):
+        """Test that single precision meshes stay single precision through the registration"""
+        import numpy as np
+        from ampscan.core import AmpObject
+        amp1 = AmpObject(get_path("stl_file_4.stl"), dtype=np.float32)
+        amp2 = AmpObject(get_path("stl_file_5.stl"), dtype=np.float32)
+        reg = registration(amp1, amp2, steps=2)
+        for arr in [reg.reg.vert, reg.reg.norm, reg.reg.vNorm, reg.reg.values, reg.disp.vert]:
+            self.assertEqual(arr.dtype, np.float32)
+        diameter = reg.reg.vert[:, 2].max() - reg.reg.vert[:, 2].min()
+        self.assertAlmostEqual(diameter, 1.2*2, delta=TestRegistration.DELTA)
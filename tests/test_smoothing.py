@@ -3,6 +3,7 @@ Testing suite for the smoothing module
 """
 
 import unittest
+import numpy as np
 from util import get_path
 from ampscan import analyse
 import math
@@ -48,3 +49,36 @@ class TestSmoothing(unittest.TestCase):
         # self.assertAlmostEqual(analyse.est_volume(poly1), analyse.est_volume(poly3), delta=TestSmoothing.DELTA)
         self.assertLess(vol1-vol3, vol1-vol2)
 
+    def test_smoothing_brim(self):
+        """Tests that the brim vertices are fixed and others move to the mean of their neighbours"""
+        self.amp.planarTrim(0)
+        vert = self.amp.vert.copy()
+        brim = np.unique(self.amp.edges[self.amp.brimEdges])
+        self.amp.lp_smooth(1)
+        self.assertTrue(np.array_equal(self.amp.vert[brim], vert[brim]))
+        i = np.setdiff1d(np.arange(len(vert)), brim)[0]
+        neigh = np.unique(self.amp.edges[(self.amp.edges == i).any(axis=1)])
+        neigh = neigh[neigh != i]
+        self.assertTrue(np.allclose(self.amp.vert[i], vert[neigh].mean(axis=0), atol=1e-4))
+        # A HC smooth with beta=1 is the same as the Laplacian smooth
+        vert = self.amp.vert.copy()
+        self.amp.hc_smooth(1, beta=1)
+        self.assertTrue(np.array_equal(self.amp.vert[brim], vert[brim]))
+        self.assertTrue(np.allclose(self.amp.vert[i], vert[neigh].mean(axis=0), atol=1e-4))
+
+    def test_laplacian(self):
+        """Tests the cached adjacency and Laplacian operators"""
+        amp = self.amp
+        self.assertTrue(np.array_equal(amp.uniformLap.diagonal(), amp.valence))
+        self.assertTrue(np.array_equal(np.asarray(amp.vertFaceAdj.sum(axis=0)).flatten(), np.full(len(amp.faces), 3)))
+        for L in [amp.uniformLap, amp.cotanLap]:
+            # Rows sum to zero and the matrices are symmetric
+            self.assertAlmostEqual(np.abs(L.dot(np.ones(len(amp.vert)))).max(), 0, TestSmoothing.ACCURACY)
+            self.assertEqual(abs(L - L.T).max(), 0)
+        # Operators are reused until the topology changes
+        adj = amp.vertAdj
+        amp.lp_smooth(1)
+        self.assertIs(amp.vertAdj, adj)
+        self.assertTrue(amp.isStale('cotanLap'))
+        amp.planarTrim(0)
+        self.assertTrue(amp.isStale('vertAdj', 'uniformLap'))
@@ -0,0 +1,76 @@
+"""
+Testing suite for the weld module
+"""
+
+import unittest
+import numpy as np
+from util import get_path
+from ampscan.weld import weldVert
+
+
+class TestWeld(unittest.TestCase):
+
+    def setUp(self):
+        """Runs before each unit test.
+        Sets up the AmpObject object using "stl_file.stl" without unifying the vertices.
+        """
+        from ampscan.core import AmpObject
+        stl_path = get_path("stl_file.stl")
+        self.amp = AmpObject(stl_path, unify=False, struc=False)
+
+    def test_weld_exact(self):
+        """Test that exact welding matches np.unique for float32 and float64 vertices"""
+        u, inv = np.unique(self.amp.vert, return_inverse=True, axis=0)
+        for vert in [self.amp.vert, self.amp.vert.astype(np.float64)]:
+            wu, winv = weldVert(vert)
+            self.assertTrue(np.array_equal(wu, u))
+            self.assertTrue(np.array_equal(winv, inv.reshape(-1)))
+
+        # Many vertices sharing x and y, including negative co-ordinates
+        vert = np.random.RandomState(0).randint(-3, 3, [1000, 3]).astype(np.float32)
+        u, inv = np.unique(vert, return_inverse=True, axis=0)
+        wu, winv = weldVert(vert)
+        self.assertTrue(np.array_equal(wu, u))
+        self.assertTrue(np.array_equal(winv, inv.reshape(-1)))
+
+        # Negative and positive zero are the same vertex
+        wu, winv = weldVert(np.array([[0.0, -0.0, 1.0], [-0.0, 0.0, 1.0]], dtype=np.float32))
+        self.assertEqual(len(wu), 1)
+
+    def test_weld_tol(self):
+        """Test that vertices with float noise are merged using a tolerance"""
+        u = weldVert(self.amp.vert)[0]
+        np.random.seed(0)
+        noisy = self.amp.vert + np.random.uniform(-1e-4, 1e-4, self.amp.vert.shape)
+        self.assertGreater(len(weldVert(noisy)[0]), len(u))
+        wu, winv = weldVert(noisy, tol=1e-2)
+        self.assertEqual(len(wu), len(u))
+        self.assertLess(np.abs(wu[winv] - noisy).max(), 1e-2)
+
+        with self.assertRaises(ValueError):
+            weldVert(noisy, tol=0)
+
+    def test_weld_tol_chain(self):
+        """Test that only vertices within tol are paired and that the clusters are chained"""
+        # Opposite corners of a cell of size tol are not merged
+        vert = np.array([[0.05, 0.05, 0.05], [0.95, 0.95, 0.95]])
+        self.assertEqual(len(weldVert(vert, tol=1.0)[0]), 2)
+        # Close vertices on either side of a cell boundary are merged
+        vert = np.array([[0.9, 0, 0], [1.1, 0, 0], [5, 0, 0]])
+        wu, winv = weldVert(vert, tol=1.0)
+        self.assertEqual(len(wu), 2)
+        self.assertTrue(np.allclose(wu[winv[0]], [1, 0, 0]))
+        # A line of vertices spaced less than tol apart is merged into one
+        vert = np.c_[np.arange(10) * 0.9, np.zeros([10, 2])]
+        wu, winv = weldVert(vert, tol=1.0)
+        self.assertEqual(len(wu), 1)
+        self.assertTrue(np.allclose(wu, [[4.05, 0, 0]]))
+
+    def test_unify_tol(self):
+        """Test that unifying with a tolerance removes collapsed faces"""
+        nF = len(self.amp.faces)
+        self.amp.unifyVert(tol=1e-3)
+        self.assertEqual(self.amp.vert.shape, (7530, 3))
+        self.assertEqual(len(self.amp.faces), nF)
+        self.amp.unifyVert(tol=1e3)
+        self.assertEqual(len(self.amp.faces), 0)